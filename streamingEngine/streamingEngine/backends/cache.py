@@ -0,0 +1,615 @@
+import io, os, re, threading, time
+from collections import OrderedDict, deque
+from typing import AsyncGenerator, Awaitable, Callable, Dict, Generator, Iterable, Iterator, List, Union
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .file import File, StreamingFile
+from .storageInterface import IStorageInterface, IAsyncStorageInterface
+
+
+BYTE_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class CacheEntry(object):
+    def __init__(self, content:bytes, content_type:str, etag:str=None):
+        self.content = content
+        self.content_type = content_type
+        self.etag = etag
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+
+class CacheStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+
+    def increment(self, name:str, amount:int=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def as_dict(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+
+class LRUCache(object):
+    """
+    Per process cache bounded by the total number of bytes it holds. The least recently used entries are evicted
+    first and every entry expires after its own TTL.
+    """
+
+    def __init__(self, max_bytes:int, stats:CacheStats):
+        self.max_bytes = max_bytes
+        self.stats = stats
+        self.size = 0
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key:str) -> Union[CacheEntry, None]:
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            entry, expires_at = item
+            if expires_at <= time.monotonic():
+                self.__remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key:str, entry:CacheEntry, ttl:int):
+        if entry.size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.__remove(key)
+            self.entries[key] = (entry, time.monotonic() + ttl)
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                evicted_key = next(iter(self.entries))
+                self.__remove(evicted_key)
+                self.stats.increment("memory_evictions")
+
+    def invalidate(self, prefix:str):
+        with self.lock:
+            for key in [key for key in self.entries.keys() if key.startswith(prefix)]:
+                self.__remove(key)
+
+    def delete(self, key:str):
+        with self.lock:
+            if key in self.entries:
+                self.__remove(key)
+
+    def __remove(self, key:str):
+        entry, _ = self.entries.pop(key)
+        self.size -= entry.size
+
+
+class RedisCache(object):
+    """
+    Cache shared by every web worker. Failures are logged and treated as misses so that an unavailable Redis never
+    stops videos from being served.
+    """
+
+    def __init__(self, url:str, key_prefix:str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.key_prefix = key_prefix
+
+    def get(self, key:str) -> Union[CacheEntry, None]:
+        try:
+            data = self.client.hgetall(self.key_prefix + key)
+        except Exception as e:
+            print(f"Error reading {key} from redis cache")
+            print(e)
+            return None
+        if data is None or not (b"content" in data.keys()):
+            return None
+        etag = data.get(b"etag")
+        return CacheEntry(
+            content=data[b"content"],
+            content_type=data.get(b"content_type", b"").decode(),
+            etag=etag.decode() if not (etag is None) else None
+        )
+
+    def set(self, key:str, entry:CacheEntry, ttl:int):
+        mapping = {"content": entry.content, "content_type": entry.content_type or ""}
+        if not (entry.etag is None):
+            mapping["etag"] = entry.etag
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.hset(self.key_prefix + key, mapping=mapping)
+            pipeline.expire(self.key_prefix + key, ttl)
+            pipeline.execute()
+        except Exception as e:
+            print(f"Error writing {key} to redis cache")
+            print(e)
+
+    def delete(self, key:str):
+        try:
+            self.client.delete(self.key_prefix + key)
+        except Exception as e:
+            print(f"Error deleting {key} from redis cache")
+            print(e)
+
+    def invalidate(self, prefix:str):
+        try:
+            keys = list(self.client.scan_iter(match=self.key_prefix + prefix + "*", count=1000))
+            if len(keys) > 0:
+                self.client.delete(*keys)
+        except Exception as e:
+            print(f"Error invalidating {prefix} in redis cache")
+            print(e)
+
+
+class InvalidationChannel(object):
+    """
+    Publishes invalidations to every web worker over Redis pub/sub and passes those of the other workers to
+    invalidate_local, from a background thread. While the thread is not subscribed (e.g. Redis is unavailable) the
+    invalidations it would receive are lost, so everything is invalidated every time it subscribes again.
+    """
+
+    def __init__(self, url:str, channel:str, invalidate_local:Callable[[str], None]):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.invalidate_local = invalidate_local
+        self.subscribed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def publish(self, prefix:str):
+        try:
+            self.client.publish(self.channel, prefix)
+        except Exception as e:
+            print(f"Error publishing the invalidation of {prefix}")
+            print(e)
+
+    def run(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=False)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message["type"] == "subscribe":
+                        self.invalidate_local("")
+                        self.subscribed = True
+                    elif message["type"] == "message":
+                        self.invalidate_local(message["data"].decode())
+            except Exception as e:
+                print(f"Error receiving cache invalidations from {self.channel}")
+                print(e)
+            self.subscribed = False
+            time.sleep(5)
+
+
+class TieredCache(object):
+    """
+    In-memory tier in front of the optional Redis tier. Every invalidation bumps a generation and is kept in a short
+    log, so that a fill which read the storage before an invalidation (e.g. a segment streamed while it is deleted or
+    overwritten) can tell and be dropped instead of caching stale bytes.
+    """
+
+    INVALIDATION_LOG_SIZE = 1024
+
+    def __init__(self, config:dict):
+        self.stats = CacheStats()
+        self.max_item_bytes = config.get("MAX_ITEM_BYTES", 4 * 1024 * 1024)
+        self.ttls: Dict[str, int] = config.get("TTL", {})
+        self.memory = LRUCache(max_bytes=config.get("MAX_BYTES", 128 * 1024 * 1024), stats=self.stats)
+        self.generation = 0
+        self.invalidation_log: "deque[tuple]" = deque(maxlen=self.INVALIDATION_LOG_SIZE)
+        self.invalidation_lock = threading.Lock()
+        self.redis = None
+        redis_config = config.get("REDIS", {})
+        if redis_config.get("ENABLED", False):
+            self.redis = RedisCache(url=redis_config["URL"], key_prefix=redis_config.get("KEY_PREFIX", "storage:"))
+        invalidation_config = config.get("INVALIDATION", {})
+        self.unshared_max_ttl = invalidation_config.get("UNSHARED_MAX_TTL", 30)
+        self.invalidations = None
+        if invalidation_config.get("ENABLED", False):
+            self.invalidations = InvalidationChannel(
+                url=invalidation_config["URL"], invalidate_local=self.invalidate_local,
+                channel=invalidation_config.get("CHANNEL", "storage:invalidations")
+            )
+
+    def get_ttl(self, content_type:str) -> int:
+        return self.ttls.get(content_type, self.ttls.get("DEFAULT", 60))
+
+    def get_memory_ttl(self, ttl:int) -> int:
+        # Other workers cannot drop the entries of this one unless it receives their invalidations
+        if self.invalidations is None or not self.invalidations.subscribed:
+            return min(ttl, self.unshared_max_ttl)
+        return ttl
+
+    def get(self, key:str) -> Union[CacheEntry, None]:
+        entry = self.memory.get(key)
+        if not (entry is None):
+            self.stats.increment("memory_hits")
+            return entry
+        self.stats.increment("memory_misses")
+        if not (self.redis is None):
+            entry = self.redis.get(key)
+            if not (entry is None):
+                self.stats.increment("redis_hits")
+                # Redis does not expose the remaining TTL of a hash cheaply, so the local copy gets the full TTL
+                self.memory.set(key, entry, self.get_memory_ttl(self.get_ttl(entry.content_type)))
+                return entry
+            self.stats.increment("redis_misses")
+        return None
+
+    def get_generation(self) -> int:
+        """
+        Taken before reading a file from the storage and passed to set along with its content.
+        """
+        with self.invalidation_lock:
+            return self.generation
+
+    def is_invalidated(self, key:str, generation:int) -> bool:
+        with self.invalidation_lock:
+            if generation >= self.generation:
+                return False
+            if len(self.invalidation_log) == 0 or self.invalidation_log[0][0] > generation + 1:
+                # The log no longer covers every invalidation since the generation
+                return True
+            return any(logged > generation and key.startswith(prefix) for logged, prefix in self.invalidation_log)
+
+    def set(self, key:str, entry:CacheEntry, generation:int=None):
+        """
+        Caches entry unless key was invalidated since generation. It is checked again once the entry is stored, since
+        the invalidation may also run while it is being stored.
+        """
+        if entry.size > self.max_item_bytes:
+            return
+        ttl = self.get_ttl(entry.content_type)
+        if ttl <= 0:
+            return
+        if not (generation is None) and self.is_invalidated(key, generation):
+            self.stats.increment("stale_fills")
+            return
+        self.memory.set(key, entry, self.get_memory_ttl(ttl))
+        if not (self.redis is None):
+            self.redis.set(key, entry, ttl)
+        if not (generation is None) and self.is_invalidated(key, generation):
+            self.stats.increment("stale_fills")
+            self.memory.delete(key)
+            if not (self.redis is None):
+                self.redis.delete(key)
+
+    def invalidate_local(self, prefix:str):
+        # Logged before the entries are dropped, so that a fill storing them afterwards sees the invalidation
+        with self.invalidation_lock:
+            self.generation += 1
+            self.invalidation_log.append((self.generation, prefix))
+        self.memory.invalidate(prefix)
+
+    def invalidate(self, prefix:str):
+        self.invalidate_local(prefix)
+        if not (self.redis is None):
+            self.redis.invalidate(prefix)
+        if not (self.invalidations is None):
+            self.invalidations.publish(prefix)
+        self.stats.increment("invalidations")
+
+
+_caches: Dict[int, TieredCache] = {}
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> TieredCache:
+    """
+    The cache of this process. Forked web workers do not inherit the invalidation thread of their parent's cache, so
+    every process has its own.
+    """
+    pid = os.getpid()
+    cache = _caches.get(pid)
+    if cache is None:
+        with _cache_lock:
+            cache = _caches.get(pid)
+            if cache is None:
+                cache = TieredCache(settings.STORAGE_CACHE)
+                _caches.clear()
+                _caches[pid] = cache
+    return cache
+
+
+def get_cache_stats() -> Dict[str, int]:
+    return get_cache().stats.as_dict()
+
+
+def get_byte_range(byte_range:str, size:int) -> Union[tuple, None]:
+    """
+    Resolves a single range header value such as bytes=0-99, bytes=100- or bytes=-100 to an inclusive (start, end)
+    pair. Returns None for anything else (multiple ranges, malformed values) and (-1, -1) if it is not satisfiable.
+    """
+    match = BYTE_RANGE_PATTERN.match(byte_range.strip())
+    if match is None or (match.group(1) == "" and match.group(2) == ""):
+        return None
+    if match.group(1) == "":
+        start, end = max(size - int(match.group(2)), 0), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) != "" else size - 1
+    if start >= size or start > end:
+        return -1, -1
+    return start, end
+
+
+def get_file_from_entry(entry:CacheEntry, byte_range:str=None, if_none_match:str=None) -> StreamingFile:
+    if not (if_none_match is None) and not (entry.etag is None) and if_none_match == entry.etag:
+        return StreamingFile(file=None, content_type=entry.content_type, etag=entry.etag, status=304)
+    if not (byte_range is None):
+        start, end = get_byte_range(byte_range, entry.size)
+        if start < 0:
+            return StreamingFile(file=None, content_type=entry.content_type, etag=entry.etag, status=416)
+        return StreamingFile(
+            file=io.BytesIO(entry.content[start:end + 1]), content_type=entry.content_type,
+            content_length=end - start + 1, etag=entry.etag,
+            content_range=f"bytes {start}-{end}/{entry.size}", status=206
+        )
+    return StreamingFile(file=io.BytesIO(entry.content), content_type=entry.content_type,
+                         content_length=entry.size, etag=entry.etag)
+
+
+def is_cacheable_range(entry:CacheEntry, byte_range:str=None) -> bool:
+    return byte_range is None or not (get_byte_range(byte_range, entry.size) is None)
+
+
+class CacheFillingStreamingFile(StreamingFile):
+    """
+    Relays the stream of a file that is not cached yet and copies its chunks on the way, so that the viewer gets the
+    first bytes as soon as the storage sends them. The copy is passed to fill once the whole file went through; a
+    stream that is not read to the end (e.g. the viewer went away) is not cached.
+    """
+
+    def __init__(self, file:StreamingFile, fill:Callable[[bytes], None]):
+        super().__init__(file=file.file, content_type=file.content_type, content_length=file.content_length,
+                         etag=file.etag, content_range=file.content_range, status=file.status)
+        self.stream = file
+        self.fill = fill
+
+    def get_content(self, chunks:List[bytes]) -> Union[bytes, None]:
+        content = b"".join(chunks)
+        return content if len(content) == self.content_length else None
+
+    def chunks(self, chunk_size:int=StreamingFile.DEFAULT_CHUNK_SIZE) -> Generator[bytes, None, None]:
+        copied = []
+        stream = self.stream.chunks(chunk_size)
+        try:
+            for chunk in stream:
+                copied.append(chunk)
+                yield chunk
+        finally:
+            stream.close()
+        content = self.get_content(copied)
+        if not (content is None):
+            self.fill(content)
+
+    def close(self):
+        self.stream.close()
+
+
+class AsyncCacheFillingStreamingFile(CacheFillingStreamingFile):
+    """
+    CacheFillingStreamingFile for the async storages, whose files are read with achunks.
+    """
+
+    def __init__(self, file:StreamingFile, fill:Callable[[bytes], Awaitable[None]]):
+        super().__init__(file=file, fill=fill)
+
+    async def achunks(self, chunk_size:int=StreamingFile.DEFAULT_CHUNK_SIZE) -> AsyncGenerator[bytes, None]:
+        copied = []
+        stream = self.stream.achunks(chunk_size)
+        try:
+            async for chunk in stream:
+                copied.append(chunk)
+                yield chunk
+        finally:
+            await stream.aclose()
+        content = self.get_content(copied)
+        if not (content is None):
+            await self.fill(content)
+
+
+class CachedStorage(IStorageInterface):
+    """
+    Serves small, frequently requested files (manifests, keys and segments up to STORAGE_CACHE['MAX_ITEM_BYTES'])
+    from the tiered cache and delegates everything else to the wrapped storage.
+    """
+
+    def __init__(self, storage:IStorageInterface, cache:TieredCache=None):
+        self.storage = storage
+        self.cache = cache if not (cache is None) else get_cache()
+
+    def __get_key(self, basedir:str, path:str) -> str:
+        return f"{basedir}/{path}"
+
+    def does_file_exist(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        if not (self.cache.get(self.__get_key(basedir, path)) is None):
+            return True
+        return self.storage.does_file_exist(basedir, path, *args, **kwargs)
+
+    def upload_file(self, basedir: str, data, path: str, content_type: str, **kwargs) -> bool:
+        uploaded = self.storage.upload_file(basedir=basedir, data=data, path=path, content_type=content_type, **kwargs)
+        self.cache.invalidate(self.__get_key(basedir, path))
+        return uploaded
+
+    def get_file(self, basedir: str, path: str, *args, **kwargs) -> File:
+        key = self.__get_key(basedir, path)
+        entry = self.cache.get(key)
+        if not (entry is None):
+            return File(file=entry.content, content_type=entry.content_type)
+        generation = self.cache.get_generation()
+        file = self.storage.get_file(basedir, path, *args, **kwargs)
+        if not (file is None):
+            self.cache.set(key, CacheEntry(content=file.file, content_type=file.content_type), generation)
+        return file
+
+    def get_file_stream(self, basedir: str, path: str, byte_range: str = None, if_none_match: str = None,
+                        *args, **kwargs) -> StreamingFile:
+        if not (byte_range is None) and len(byte_range) == 0:
+            byte_range = None
+        key = self.__get_key(basedir, path)
+        entry = self.cache.get(key)
+        if not (entry is None) and is_cacheable_range(entry, byte_range):
+            return get_file_from_entry(entry, byte_range=byte_range, if_none_match=if_none_match)
+        if not (byte_range is None):
+            return self.storage.get_file_stream(basedir, path, byte_range, if_none_match, *args, **kwargs)
+
+        generation = self.cache.get_generation()
+        file = self.storage.get_file_stream(basedir, path, None, if_none_match, *args, **kwargs)
+        if file is None or file.status != 200 or file.content_length is None \
+                or file.content_length > self.cache.max_item_bytes:
+            return file
+        return CacheFillingStreamingFile(file, fill=lambda content: self.cache.set(key, CacheEntry(
+            content=content, content_type=file.content_type, etag=file.etag
+        ), generation))
+
+    def download_file(self, basedir: str, path: str, destination_filepath: str, *args, **kwargs) -> bool:
+        return self.storage.download_file(basedir, path, destination_filepath, *args, **kwargs)
+
+    def get_all_filepaths(self, basedir:str, path:str, *args, **kwargs) -> List[str]:
+        return self.storage.get_all_filepaths(basedir, path, *args, **kwargs)
+
+    def iterate_filepaths(self, basedir:str, path:str, *args, **kwargs) -> Iterator[str]:
+        return self.storage.iterate_filepaths(basedir, path, *args, **kwargs)
+
+    def delete_file(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        deleted = self.storage.delete_file(basedir, path, *args, **kwargs)
+        self.cache.invalidate(self.__get_key(basedir, path))
+        return deleted
+
+    def delete_files(self, basedir: str, paths: Iterable[str], *args, **kwargs) -> bool:
+        paths = list(paths)
+        deleted = self.storage.delete_files(basedir, paths, *args, **kwargs)
+        if len(paths) > 0:
+            # One invalidation of the prefix shared by every path instead of one scan of the cache per path
+            self.cache.invalidate(self.__get_key(basedir, os.path.commonprefix(paths)))
+        return deleted
+
+    def copy_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                  overwrite: bool = True, *args, **kwargs) -> bool:
+        copied = self.storage.copy_file(source_basedir, source_path, destination_basedir, destination_path,
+                                        overwrite, *args, **kwargs)
+        self.cache.invalidate(self.__get_key(destination_basedir, destination_path))
+        return copied
+
+    def move_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                  overwrite: bool = True, *args, **kwargs) -> bool:
+        moved = self.storage.move_file(source_basedir, source_path, destination_basedir, destination_path,
+                                       overwrite, *args, **kwargs)
+        self.cache.invalidate(self.__get_key(source_basedir, source_path))
+        self.cache.invalidate(self.__get_key(destination_basedir, destination_path))
+        return moved
+
+
+def get_cached_storage(storage:IStorageInterface) -> IStorageInterface:
+    # Local files are served from the page cache, with sendfile, so they are not copied into the cache
+    from .local.local import LocalStorage
+    if settings.STORAGE_CACHE.get("ENABLED", False) and not isinstance(storage, LocalStorage):
+        return CachedStorage(storage=storage)
+    return storage
+
+
+class AsyncCachedStorage(IAsyncStorageInterface):
+    """
+    CachedStorage for async views. The in-memory tier is read directly on the event loop; the Redis tier, whose
+    client is blocking, is only accessed from a thread.
+    """
+
+    def __init__(self, storage:IAsyncStorageInterface, cache:TieredCache=None):
+        self.storage = storage
+        self.cache = cache if not (cache is None) else get_cache()
+
+    def __get_key(self, basedir:str, path:str) -> str:
+        return f"{basedir}/{path}"
+
+    async def __get(self, key:str) -> Union[CacheEntry, None]:
+        if self.cache.redis is None:
+            return self.cache.get(key)
+        return await sync_to_async(self.cache.get, thread_sensitive=False)(key)
+
+    async def __set(self, key:str, entry:CacheEntry, generation:int=None):
+        if self.cache.redis is None:
+            self.cache.set(key, entry, generation)
+        else:
+            await sync_to_async(self.cache.set, thread_sensitive=False)(key, entry, generation)
+
+    async def __invalidate(self, basedir:str, path:str):
+        await sync_to_async(self.cache.invalidate, thread_sensitive=False)(self.__get_key(basedir, path))
+
+    async def does_file_exist(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        if not (await self.__get(self.__get_key(basedir, path)) is None):
+            return True
+        return await self.storage.does_file_exist(basedir, path, *args, **kwargs)
+
+    async def upload_file(self, basedir: str, data, path: str, content_type: str, *args, **kwargs) -> bool:
+        uploaded = await self.storage.upload_file(basedir, data, path, content_type, *args, **kwargs)
+        await self.__invalidate(basedir, path)
+        return uploaded
+
+    async def get_file(self, basedir: str, path: str, *args, **kwargs) -> File:
+        key = self.__get_key(basedir, path)
+        entry = await self.__get(key)
+        if not (entry is None):
+            return File(file=entry.content, content_type=entry.content_type)
+        generation = self.cache.get_generation()
+        file = await self.storage.get_file(basedir, path, *args, **kwargs)
+        if not (file is None):
+            await self.__set(key, CacheEntry(content=file.file, content_type=file.content_type), generation)
+        return file
+
+    async def get_file_stream(self, basedir: str, path: str, byte_range: str = None, if_none_match: str = None,
+                              *args, **kwargs) -> StreamingFile:
+        if not (byte_range is None) and len(byte_range) == 0:
+            byte_range = None
+        key = self.__get_key(basedir, path)
+        entry = await self.__get(key)
+        if not (entry is None) and is_cacheable_range(entry, byte_range):
+            return get_file_from_entry(entry, byte_range=byte_range, if_none_match=if_none_match)
+        if not (byte_range is None):
+            return await self.storage.get_file_stream(basedir, path, byte_range, if_none_match, *args, **kwargs)
+
+        generation = self.cache.get_generation()
+        file = await self.storage.get_file_stream(basedir, path, None, if_none_match, *args, **kwargs)
+        if file is None or file.status != 200 or file.content_length is None \
+                or file.content_length > self.cache.max_item_bytes:
+            return file
+        return AsyncCacheFillingStreamingFile(file, fill=lambda content: self.__set(key, CacheEntry(
+            content=content, content_type=file.content_type, etag=file.etag
+        ), generation))
+
+    async def get_all_filepaths(self, basedir:str, path:str, *args, **kwargs) -> List[str]:
+        return await self.storage.get_all_filepaths(basedir, path, *args, **kwargs)
+
+    async def delete_file(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        deleted = await self.storage.delete_file(basedir, path, *args, **kwargs)
+        await self.__invalidate(basedir, path)
+        return deleted
+
+    async def copy_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                        overwrite: bool = True, *args, **kwargs) -> bool:
+        copied = await self.storage.copy_file(source_basedir, source_path, destination_basedir, destination_path,
+                                              overwrite, *args, **kwargs)
+        await self.__invalidate(destination_basedir, destination_path)
+        return copied
+
+    async def move_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                        overwrite: bool = True, *args, **kwargs) -> bool:
+        moved = await self.storage.move_file(source_basedir, source_path, destination_basedir, destination_path,
+                                             overwrite, *args, **kwargs)
+        await self.__invalidate(source_basedir, source_path)
+        await self.__invalidate(destination_basedir, destination_path)
+        return moved
+
+
+def get_async_cached_storage(storage:IAsyncStorageInterface) -> IAsyncStorageInterface:
+    from .local.asynclocal import AsyncLocalStorage
+    if settings.STORAGE_CACHE.get("ENABLED", False) and not isinstance(storage, AsyncLocalStorage):
+        return AsyncCachedStorage(storage=storage)
+    return storage
@@ -0,0 +1,151 @@
+import hashlib, io, json
+from typing import Any, Dict, Iterable, List, Union
+
+from .storageInterface import IStorageInterface
+
+
+CONTENT_HASH_SUFFIX = ".sha256"
+# Written in place of a transcoded video whose source had already been transcoded. Holds the storage path of the
+# video it stands for
+ALIAS_FILENAME = "alias.json"
+# Every alias of a video saves a reference in this folder of the video, named after the id of the alias, so that the
+# video is not deleted while aliases still point at it
+ALIAS_REFERENCES_FOLDER_NAME = "aliases"
+# Written next to a transcoded video that was added to the index of transcoded videos. Holds the path of its record
+INDEX_RECORD_FILENAME = "dedupe.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_content_hasher():
+    return hashlib.sha256()
+
+
+def hash_chunks(chunks:Iterable[bytes]) -> str:
+    hasher = get_content_hasher()
+    for chunk in chunks:
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_file(filepath:str) -> str:
+    with open(filepath, "rb") as f:
+        return hash_chunks(iter(lambda: f.read(HASH_CHUNK_SIZE), b""))
+
+
+def get_content_hash_path(path:str) -> str:
+    return f"{path}{CONTENT_HASH_SUFFIX}"
+
+
+def get_ladder_key(ladder:Any) -> str:
+    """
+    Identifies everything that shapes the output of a transcode, e.g. the configured ladder and encoder settings.
+    ladder must be JSON serializable.
+    """
+    return hashlib.sha256(json.dumps(ladder, sort_keys=True, default=lambda value: value.__dict__).encode()) \
+        .hexdigest()[:16]
+
+
+def get_dedupe_index_path(index_dir:str, content_hash:str, ladder_key:str) -> str:
+    return f"{index_dir}/{content_hash}-{ladder_key}.json"
+
+
+def load_json(storage:IStorageInterface, basedir:str, path:str) -> Union[Dict[str, Any], None]:
+    if not storage.does_file_exist(basedir=basedir, path=path):
+        return None
+    file = storage.get_file(basedir=basedir, path=path)
+    if file is None:
+        return None
+    try:
+        return json.loads(file.file)
+    except ValueError as e:
+        print(f"Ignoring unreadable file {path}")
+        print(e)
+    return None
+
+
+def save_json(storage:IStorageInterface, basedir:str, path:str, data:Dict[str, Any]) -> bool:
+    return storage.upload_file(basedir=basedir, data=io.BytesIO(json.dumps(data).encode()), path=path,
+                               content_type="application/json", overwrite=True)
+
+
+def load_content_hash(storage:IStorageInterface, basedir:str, path:str) -> Union[str, None]:
+    """
+    Returns the content hash saved next to a stored file, if it was computed when the file was stored.
+    """
+    record = load_json(storage, basedir, get_content_hash_path(path))
+    return record.get("sha256") if not (record is None) else None
+
+
+def save_content_hash(storage:IStorageInterface, basedir:str, path:str, content_hash:str) -> bool:
+    return save_json(storage, basedir, get_content_hash_path(path), {"sha256": content_hash})
+
+
+def get_alias_reference_path(original:str, alias:str) -> str:
+    return f"{original}/{ALIAS_REFERENCES_FOLDER_NAME}/{alias.split('/')[-1]}.json"
+
+
+def add_alias_reference(storage:IStorageInterface, basedir:str, original:str, alias:str) -> bool:
+    return save_json(storage, basedir, get_alias_reference_path(original, alias), {"path": alias})
+
+
+def remove_alias_reference(storage:IStorageInterface, basedir:str, original:str, alias:str) -> bool:
+    return storage.delete_file(basedir=basedir, path=get_alias_reference_path(original, alias))
+
+
+def get_alias_references(storage:IStorageInterface, basedir:str, original:str) -> List[str]:
+    """
+    Returns the videos that are aliases of original. A reference is saved before the alias record, so an alias that
+    is still being saved is counted too; references whose alias record points at another video are removed.
+    """
+    aliases = []
+    for path in storage.iterate_filepaths(basedir=basedir, path=f"{original}/{ALIAS_REFERENCES_FOLDER_NAME}/"):
+        reference = load_json(storage, basedir, path)
+        if reference is None:
+            continue
+        alias = reference.get("path")
+        record = load_json(storage, basedir, f"{alias}/{ALIAS_FILENAME}")
+        if not (record is None) and record.get("path") != original:
+            storage.delete_file(basedir=basedir, path=path)
+            continue
+        aliases.append(alias)
+    return aliases
+
+
+def release_transcoded_video(storage:IStorageInterface, basedir:str, path:str) -> bool:
+    """
+    Prepares the transcoded video stored at path to be deleted. An alias drops its reference from the video it stands
+    for. A video with aliases is kept, as they share its files; it is taken out of the index of transcoded videos
+    before its aliases are counted and put back if any are found. An alias that saves its reference after they were
+    counted finds the video gone from the index and backs out (see task.alias_transcoded_duplicate), and its
+    reference is removed with remove_alias_references once the video is deleted. Returns False if the video has to
+    be kept.
+    """
+    record = load_json(storage, basedir, f"{path}/{ALIAS_FILENAME}")
+    if not (record is None):
+        remove_alias_reference(storage, basedir, original=record["path"], alias=path)
+        return True
+    index_record = load_json(storage, basedir, f"{path}/{INDEX_RECORD_FILENAME}")
+    index_path = index_record.get("path") if not (index_record is None) else None
+    if not (index_path is None):
+        entry = load_json(storage, basedir, index_path)
+        if entry is None or entry.get("path") != path:
+            # The source has been transcoded again since
+            index_path = None
+        else:
+            storage.delete_file(basedir=basedir, path=index_path)
+    aliases = get_alias_references(storage, basedir, path)
+    if len(aliases) > 0:
+        if not (index_path is None):
+            save_json(storage, basedir, index_path, {"path": path})
+        print(f"Keeping {path}, {len(aliases)} videos are aliases of it")
+        return False
+    return True
+
+
+def remove_alias_references(storage:IStorageInterface, basedir:str, original:str) -> bool:
+    """
+    Removes the references that aliases saved while original was being deleted. Their aliases back out, as original
+    is no longer in the index.
+    """
+    paths = list(storage.iterate_filepaths(basedir=basedir, path=f"{original}/{ALIAS_REFERENCES_FOLDER_NAME}/"))
+    return len(paths) == 0 or storage.delete_files(basedir=basedir, paths=paths)
@@ -1,4 +1,47 @@
+from typing import Any, Generator, Union
+
+
 class File(object):
     def __init__(self, file:bytes, content_type:str):
         self.file = file
         self.content_type = content_type
+
+
+class StreamingFile(File):
+    """
+    A file whose content is read lazily from an open stream instead of being held in memory.
+
+    :param file: a file like object exposing read() and close() (e.g. botocore's StreamingBody) or None when the
+                 storage answered without a body (304 Not Modified / 416 Range Not Satisfiable)
+    :param content_type: mimetype of the content
+    :param content_length: number of bytes that the stream will produce
+    :param etag: entity tag of the stored object
+    :param content_range: value of the Content-Range header when a byte range was requested
+    :param status: HTTP status that corresponds to the storage response (200, 206, 304 or 416)
+    """
+
+    DEFAULT_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, file:Union[Any, None], content_type:str, content_length:int=None, etag:str=None,
+                 content_range:str=None, status:int=200):
+        super().__init__(file=file, content_type=content_type)
+        self.content_length = content_length
+        self.etag = etag
+        self.content_range = content_range
+        self.status = status
+
+    def chunks(self, chunk_size:int=DEFAULT_CHUNK_SIZE) -> Generator[bytes, None, None]:
+        if self.file is None:
+            return
+        try:
+            while True:
+                chunk = self.file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if not (self.file is None) and hasattr(self.file, "close"):
+            self.file.close()
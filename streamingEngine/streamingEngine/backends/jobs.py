@@ -0,0 +1,205 @@
+import json, threading, time
+from typing import Any, Dict, Iterator, Union
+
+from django.conf import settings
+
+from .metrics import TRANSCODE_PHASE_DURATION, TRANSCODE_JOBS, TRANSCODE_ENCODER_FPS
+from .tracing import start_span
+
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_SUCCEEDED = "succeeded"
+JOB_STATUS_FAILED = "failed"
+
+PHASE_DOWNLOAD = "download"
+PHASE_TRANSCODE = "transcode"
+PHASE_UPLOAD = "upload"
+
+# The last step a job completed. A job that is run again (e.g. after its worker was restarted) skips everything up to
+# its checkpoint
+CHECKPOINT_DOWNLOADED = "downloaded"
+CHECKPOINT_TRANSCODED = "transcoded"
+# The chunks of the video were handed to other workers, which report the outcome
+CHECKPOINT_DISPATCHED = "dispatched"
+
+# Fields returned by the status endpoint. The others (e.g. the arguments of the task) are internal
+PUBLIC_JOB_FIELDS = ["id", "status", "job_class", "phase", "percent", "fps", "eta", "errors", "checkpoint", "chunks",
+                     "completed_chunks", "created_at", "updated_at"]
+
+
+class JobStore(object):
+    """
+    Transcoding jobs as Redis hashes, one per video id, with every field stored as JSON. Failures are logged and
+    ignored so that an unavailable Redis never fails a transcode; it only leaves the record of the job out of date.
+    """
+
+    def __init__(self, url:str, key_prefix:str, ttl:int):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+
+    def __get_key(self, job_id:str) -> str:
+        return self.key_prefix + job_id
+
+    def create(self, job_id:str, task:Dict[str, Any], job_class:str=None) -> bool:
+        """
+        Records a queued job. task holds the arguments of the celery task and job_class the class it was queued in (see
+        settings.TRANSCODE_ROUTING) so that the job can be queued again.
+        """
+        return self.update(job_id, id=job_id, status=JOB_STATUS_QUEUED, job_class=job_class, phase=None, percent=None,
+                           fps=None, eta=None, errors=[], checkpoint=None, created_at=time.time(), task=task)
+
+    def update(self, job_id:str, **fields) -> bool:
+        fields["updated_at"] = time.time()
+        key = self.__get_key(job_id)
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.hset(key, mapping={name: json.dumps(value) for name, value in fields.items()})
+            pipeline.expire(key, self.ttl)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            print(f"Error updating job {job_id}")
+            print(e)
+        return False
+
+    def increment(self, job_id:str, field:str, amount:int=1) -> Union[int, None]:
+        try:
+            return self.client.hincrby(self.__get_key(job_id), field, amount)
+        except Exception as e:
+            print(f"Error updating job {job_id}")
+            print(e)
+        return None
+
+    def complete_chunk(self, job_id:str, chunk_index:int) -> Union[int, None]:
+        """
+        Marks a chunk of the job as completed and returns the number of completed chunks. Every chunk is counted once,
+        so a chunk task that is delivered again does not push the progress past 100%.
+        """
+        key = self.__get_key(job_id)
+        try:
+            if self.client.hsetnx(key, f"chunk_{chunk_index}", json.dumps(True)):
+                return self.client.hincrby(key, "completed_chunks", 1)
+            completed_chunks = self.client.hget(key, "completed_chunks")
+            return json.loads(completed_chunks) if not (completed_chunks is None) else None
+        except Exception as e:
+            print(f"Error updating job {job_id}")
+            print(e)
+        return None
+
+    def get(self, job_id:str) -> Union[Dict[str, Any], None]:
+        try:
+            data = self.client.hgetall(self.__get_key(job_id))
+        except Exception as e:
+            print(f"Error reading job {job_id}")
+            print(e)
+            return None
+        if data is None or len(data) == 0:
+            return None
+        return {name.decode(): json.loads(value) for name, value in data.items()}
+
+    def get_job_ids(self) -> Iterator[str]:
+        for key in self.client.scan_iter(match=self.key_prefix + "*", count=1000):
+            yield key.decode()[len(self.key_prefix):]
+
+
+class JobProgress(object):
+    """
+    Reports the progress of a job. Calls write to the store at most every interval seconds, except the first one that
+    completes a phase (percent 100), so that ffmpeg's progress can be passed on as it comes. percent is of the current phase, fps
+    is in source frames per second and eta in seconds until the end of the phase. Without a store nothing is
+    recorded.
+    """
+
+    def __init__(self, store:Union[JobStore, None], job_id:str, interval:float):
+        self.store = store
+        self.job_id = job_id
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.phase = None
+        self.started_at = time.monotonic()
+        self.last_update = 0.0
+        self.last_percent = None
+        self.span = None
+
+    def __observe_phase(self, errors:list=None):
+        if not (self.phase is None):
+            TRANSCODE_PHASE_DURATION.observe(time.monotonic() - self.started_at, phase=self.phase)
+        TRANSCODE_ENCODER_FPS.remove(job=self.job_id)
+        if not (self.span is None):
+            if not (errors is None) and len(errors) > 0:
+                self.span.set_error("; ".join([str(error) for error in errors]))
+            self.span.end()
+            self.span = None
+
+    def start_phase(self, phase:str, **fields):
+        self.__observe_phase()
+        self.phase = phase
+        self.started_at = time.monotonic()
+        # A span per phase, a child of the task running the job
+        self.span = start_span(f"transcode {phase}", attributes={"job.id": self.job_id, "job.phase": phase})
+        self.last_update = self.started_at
+        self.last_percent = None
+        if not (self.store is None):
+            self.store.update(self.job_id, status=JOB_STATUS_RUNNING, phase=phase, percent=0, fps=None, eta=None,
+                              **fields)
+
+    def __call__(self, percent:float=None, fps:float=None, **fields):
+        if not (fps is None):
+            TRANSCODE_ENCODER_FPS.set(fps, job=self.job_id)
+        if self.store is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            completes = not (percent is None) and percent >= 100 and (self.last_percent is None or
+                                                                      self.last_percent < 100)
+            if now - self.last_update < self.interval and not completes:
+                return
+            self.last_update = now
+            self.last_percent = percent
+        elapsed = now - self.started_at
+        eta = None
+        if not (percent is None) and percent > 0:
+            eta = round(elapsed * (100 - percent) / percent, 1)
+        self.store.update(self.job_id, percent=round(percent, 1) if not (percent is None) else None,
+                          fps=round(fps, 1) if not (fps is None) else None, eta=eta, **fields)
+
+    def checkpoint(self, checkpoint:str, **fields):
+        if not (self.store is None):
+            self.store.update(self.job_id, checkpoint=checkpoint, **fields)
+
+    def finish(self, success:bool, errors:list):
+        self.__observe_phase(errors=errors if not success else None)
+        self.phase = None
+        TRANSCODE_JOBS.inc(status=JOB_STATUS_SUCCEEDED if success else JOB_STATUS_FAILED)
+        if not (self.store is None):
+            self.store.update(self.job_id, status=JOB_STATUS_SUCCEEDED if success else JOB_STATUS_FAILED,
+                              phase=None, percent=100 if success else None, fps=None, eta=None, errors=errors)
+
+
+_job_store: Union[JobStore, None] = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store() -> Union[JobStore, None]:
+    global _job_store
+    if not settings.TRANSCODE_JOBS.get("ENABLED", False):
+        return None
+    if _job_store is None:
+        with _job_store_lock:
+            if _job_store is None:
+                _job_store = JobStore(url=settings.TRANSCODE_JOBS["URL"],
+                                      key_prefix=settings.TRANSCODE_JOBS.get("KEY_PREFIX", "job:"),
+                                      ttl=settings.TRANSCODE_JOBS.get("TTL", 7 * 24 * 3600))
+    return _job_store
+
+
+def get_job_progress(job_id:str) -> JobProgress:
+    return JobProgress(store=get_job_store(), job_id=job_id,
+                       interval=settings.TRANSCODE_JOBS.get("PROGRESS_INTERVAL", 2.0))
+
+
+def get_public_job(job:Dict[str, Any]) -> Dict[str, Any]:
+    return {name: job.get(name) for name in PUBLIC_JOB_FIELDS}
@@ -0,0 +1,50 @@
+from typing import IO, Any, List, Union
+
+from asgiref.sync import sync_to_async
+
+from ..file import File, StreamingFile
+from ..storageInterface import IAsyncStorageInterface
+from .local import LocalStorage
+
+
+class AsyncLocalStorage(IAsyncStorageInterface):
+    """
+    LocalStorage for async views. Disk I/O blocks, so every call runs in a thread; the streams it returns are read in
+    a thread as well (see LocalStreamingFile.achunks).
+    """
+
+    def __init__(self, storage:LocalStorage=None) -> None:
+        self.storage = storage if not (storage is None) else LocalStorage()
+
+    async def does_file_exist(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.does_file_exist, thread_sensitive=False)(basedir, path, *args, **kwargs)
+
+    async def upload_file(self, basedir: str, data: Union[IO[Any], str], path: str, content_type: str,
+                          *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.upload_file, thread_sensitive=False)(
+            basedir=basedir, data=data, path=path, content_type=content_type, *args, **kwargs)
+
+    async def get_file(self, basedir: str, path: str, *args, **kwargs) -> File:
+        return await sync_to_async(self.storage.get_file, thread_sensitive=False)(basedir, path, *args, **kwargs)
+
+    async def get_file_stream(self, basedir: str, path: str, byte_range: str = None, if_none_match: str = None,
+                              *args, **kwargs) -> StreamingFile:
+        return await sync_to_async(self.storage.get_file_stream, thread_sensitive=False)(
+            basedir, path, byte_range, if_none_match, *args, **kwargs)
+
+    async def get_all_filepaths(self, basedir: str, path: str, *args, **kwargs) -> List[str]:
+        return await sync_to_async(self.storage.get_all_filepaths, thread_sensitive=False)(basedir, path, *args,
+                                                                                           **kwargs)
+
+    async def delete_file(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.delete_file, thread_sensitive=False)(basedir, path, *args, **kwargs)
+
+    async def copy_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                        overwrite: bool = True, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.copy_file, thread_sensitive=False)(
+            source_basedir, source_path, destination_basedir, destination_path, overwrite, *args, **kwargs)
+
+    async def move_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                        overwrite: bool = True, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.move_file, thread_sensitive=False)(
+            source_basedir, source_path, destination_basedir, destination_path, overwrite, *args, **kwargs)
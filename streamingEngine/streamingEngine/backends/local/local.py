@@ -0,0 +1,366 @@
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from typing import IO, Any, AsyncGenerator, Callable, Iterable, Iterator, List, Union
+
+import errno, hashlib, mimetypes, os, shutil, uuid
+
+from ..file import File, StreamingFile
+from ..storageInterface import IStorageInterface
+from ..cache import get_byte_range
+
+
+# Extended attribute holding the content type given on upload. Filesystems without extended attributes fall back to
+# the type guessed from the extension
+CONTENT_TYPE_XATTR = "user.content_type"
+TEMP_FILE_SUFFIX = ".tmp"
+DEFAULT_CONTENT_TYPES = {".ts": "video/mp2t", ".m4s": "video/iso.segment", ".mpd": "application/dash+xml"}
+
+
+def guess_content_type(path:str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in DEFAULT_CONTENT_TYPES.keys():
+        return DEFAULT_CONTENT_TYPES[extension]
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def is_temp_file(filename:str) -> bool:
+    return filename.startswith(".") and filename.endswith(TEMP_FILE_SUFFIX)
+
+
+class LocalFile(File):
+
+    def __init__(self, file:bytes, content_type:str):
+        super().__init__(file=file, content_type=content_type)
+
+
+class LocalStreamingFile(StreamingFile):
+    """
+    An open stored file positioned at the start of the requested content. Whole files (status 200) can be handed to
+    the WSGI server, which sends them with sendfile(2) (see views.get_streaming_response); chunks() and achunks() stop
+    after content_length bytes so that byte ranges are served exactly.
+    """
+
+    def __init__(self, file:Union[IO[bytes], None], content_type:str, content_length:int=None, etag:str=None,
+                 content_range:str=None, status:int=200):
+        super().__init__(file=file, content_type=content_type, content_length=content_length, etag=etag,
+                         content_range=content_range, status=status)
+
+    def chunks(self, chunk_size:int=StreamingFile.DEFAULT_CHUNK_SIZE):
+        if self.file is None:
+            return
+        try:
+            remaining = self.content_length
+            while remaining is None or remaining > 0:
+                chunk = self.file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if not (remaining is None):
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+    async def achunks(self, chunk_size:int=StreamingFile.DEFAULT_CHUNK_SIZE) -> AsyncGenerator[bytes, None]:
+        # Disk reads block, so they are made in a thread
+        chunks = self.chunks(chunk_size)
+        read = sync_to_async(lambda: next(chunks, None), thread_sensitive=False)
+        while True:
+            chunk = await read()
+            if chunk is None:
+                break
+            yield chunk
+
+
+class LocalStorage(IStorageInterface):
+    """
+    Stores files under root, one directory per basedir (the counterpart of a bucket). Files are spread over
+    16 ** shard_width shard directories by the hash of their first shard_depth path components, e.g. videos/<id>, so
+    that no directory grows with the number of videos while all files of a video stay in one shard and can be listed
+    without scanning the others.
+
+    Every write goes to a temporary file in the destination directory that is then renamed over the destination, so
+    readers never see a partial file and stored files are never modified in place. Files are therefore shared
+    between paths and with callers through hard links whenever possible (uploads of local files, downloads, copies)
+    instead of being copied.
+    """
+
+    def __init__(self, root:str=None, shard_depth:int=None, shard_width:int=None, fsync:bool=None) -> None:
+        local_settings = settings.STORAGE_BACKEND.get("LOCAL", {})
+        self.root = os.path.abspath(root or local_settings.get("ROOT", "storage"))
+        self.shard_depth = shard_depth if not (shard_depth is None) else local_settings.get("SHARD_DEPTH", 2)
+        self.shard_width = shard_width if not (shard_width is None) else local_settings.get("SHARD_WIDTH", 2)
+        self.fsync = fsync if not (fsync is None) else local_settings.get("FSYNC", False)
+
+    def __get_components(self, path:str) -> Union[List[str], None]:
+        components = path.split("/")
+        # Paths are keys, not filesystem paths: nothing may point outside of its basedir
+        if any(component in ("", ".", "..") or os.sep in component for component in components):
+            return None
+        return components
+
+    def __get_shard(self, components:List[str]) -> str:
+        return hashlib.sha1("/".join(components[:self.shard_depth]).encode()).hexdigest()[:self.shard_width]
+
+    def __get_basedir_path(self, basedir:str) -> Union[str, None]:
+        if self.__get_components(basedir) is None or "/" in basedir:
+            return None
+        return os.path.join(self.root, basedir)
+
+    def get_filepath(self, basedir:str, path:str) -> Union[str, None]:
+        """
+        Location of a stored file on disk, or None if basedir or path are not valid keys.
+        """
+        basedir_path = self.__get_basedir_path(basedir)
+        components = self.__get_components(path)
+        if basedir_path is None or components is None:
+            return None
+        return os.path.join(basedir_path, self.__get_shard(components), *components)
+
+    def __get_content_type(self, filepath:str) -> str:
+        try:
+            return os.getxattr(filepath, CONTENT_TYPE_XATTR).decode()
+        except (AttributeError, OSError):
+            return guess_content_type(filepath)
+
+    def __get_etag(self, stat:os.stat_result) -> str:
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def __get_temp_filepath(self, filepath:str) -> str:
+        return os.path.join(os.path.dirname(filepath),
+                            f".{os.path.basename(filepath)}.{uuid.uuid4().hex}{TEMP_FILE_SUFFIX}")
+
+    def __link_or_copy(self, source_filepath:str, destination_filepath:str):
+        try:
+            os.link(source_filepath, destination_filepath)
+        except OSError as e:
+            # Across filesystems or where hard links are not supported. copy2 keeps the content type attribute
+            if not e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            shutil.copy2(source_filepath, destination_filepath)
+
+    def __publish(self, temp_filepath:str, filepath:str, overwrite:bool) -> bool:
+        if overwrite:
+            os.replace(temp_filepath, filepath)
+            return True
+        # Linking fails if the destination exists, which makes the check and the write one atomic step
+        try:
+            os.link(temp_filepath, filepath)
+            return True
+        except FileExistsError:
+            print(f"The file {filepath} already exists")
+            return False
+        finally:
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+
+    def __write(self, filepath:str, write:Callable[[str], None], overwrite:bool, content_type:str=None) -> bool:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        temp_filepath = self.__get_temp_filepath(filepath)
+        try:
+            write(temp_filepath)
+            if not (content_type is None):
+                try:
+                    os.setxattr(temp_filepath, CONTENT_TYPE_XATTR, content_type.encode())
+                except (AttributeError, OSError):
+                    pass
+            return self.__publish(temp_filepath, filepath, overwrite)
+        except OSError as e:
+            print(f"Error writing file {filepath}")
+            print(e)
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+        return False
+
+    def __remove_empty_directories(self, directory:str, basedir_path:str):
+        while directory.startswith(basedir_path + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    def does_bucket_exist(self, name: str) -> bool:
+        basedir_path = self.__get_basedir_path(name)
+        return not (basedir_path is None) and os.path.isdir(basedir_path)
+
+    def create_bucket(self, name: str) -> bool:
+        basedir_path = self.__get_basedir_path(name)
+        if basedir_path is None or os.path.isdir(basedir_path):
+            return False
+        os.makedirs(basedir_path, exist_ok=True)
+        return True
+
+    def delete_bucket(self, name: str) -> bool:
+        if not self.does_bucket_exist(name):
+            return False
+        shutil.rmtree(self.__get_basedir_path(name), ignore_errors=True)
+        return True
+
+    def does_file_exist(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        filepath = self.get_filepath(basedir, path)
+        return not (filepath is None) and os.path.isfile(filepath)
+
+    def upload_file(self, basedir: str, data:Union[IO[Any], str], path: str, content_type:str,
+                    use_concurrency:bool=False, callback:Callable[[int], None]=None,
+                    create_basedir_if_not_exist=False, overwrite:bool=False, *args, **kwargs) -> bool:
+        """
+        Stores a file unless it already exists (see S3.upload_file). A local file given by its path is hard linked
+        when it is on the same filesystem, so it must not be modified in place afterwards.
+        """
+        if not self.does_bucket_exist(basedir):
+            if create_basedir_if_not_exist:
+                self.create_bucket(basedir)
+            else:
+                print(f'Bucket does not exist')
+                return False
+        filepath = self.get_filepath(basedir, path)
+        if filepath is None:
+            print(f"Invalid path {path}")
+            return False
+
+        def write(temp_filepath:str):
+            if type(data) == str:
+                self.__link_or_copy(data, temp_filepath)
+            else:
+                with open(temp_filepath, "wb") as f:
+                    shutil.copyfileobj(data, f)
+                    if self.fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+
+        uploaded = self.__write(filepath, write, overwrite=overwrite, content_type=content_type)
+        if uploaded and not (callback is None):
+            callback(os.path.getsize(filepath))
+        return uploaded
+
+    def get_file(self, basedir: str, path: str, *args, **kwargs) -> LocalFile:
+        filepath = self.get_filepath(basedir, path)
+        try:
+            with open(filepath, "rb") as f:
+                return LocalFile(file=f.read(), content_type=self.__get_content_type(filepath))
+        except (OSError, TypeError) as e:
+            print(f"Error fetching file")
+            print(e)
+        return None
+
+    def get_file_stream(self, basedir: str, path: str, byte_range: str = None, if_none_match: str = None,
+                        *args, **kwargs) -> LocalStreamingFile:
+        filepath = self.get_filepath(basedir, path)
+        try:
+            f = open(filepath, "rb")
+        except (OSError, TypeError) as e:
+            print(f"Error fetching file")
+            print(e)
+            return None
+        stat = os.fstat(f.fileno())
+        etag = self.__get_etag(stat)
+        content_type = self.__get_content_type(filepath)
+        if not (if_none_match is None) and if_none_match == etag:
+            f.close()
+            return LocalStreamingFile(file=None, content_type=content_type, etag=etag, status=304)
+        if not (byte_range is None) and len(byte_range) > 0:
+            resolved = get_byte_range(byte_range, stat.st_size)
+            if not (resolved is None):
+                start, end = resolved
+                if start < 0:
+                    f.close()
+                    return LocalStreamingFile(file=None, content_type=content_type, etag=etag, status=416)
+                f.seek(start)
+                return LocalStreamingFile(file=f, content_type=content_type, content_length=end - start + 1,
+                                          etag=etag, content_range=f"bytes {start}-{end}/{stat.st_size}", status=206)
+        return LocalStreamingFile(file=f, content_type=content_type, content_length=stat.st_size, etag=etag)
+
+    def download_file(self, basedir: str, path: str, destination_filepath: str,
+                      progress: Callable[[int, int], None] = None, *args, **kwargs) -> bool:
+        """
+        Hard links the stored file to destination_filepath when both are on the same filesystem, copies it otherwise.
+        :param progress: called with the bytes downloaded so far and the size of the file
+        """
+        filepath = self.get_filepath(basedir, path)
+        try:
+            self.__link_or_copy(filepath, destination_filepath)
+        except (OSError, TypeError) as e:
+            print(f"Error downloading file {path}")
+            print(e)
+            return False
+        if not (progress is None):
+            size = os.path.getsize(destination_filepath)
+            progress(size, size)
+        return True
+
+    def iterate_filepaths(self, basedir:str, path:str, *args, **kwargs) -> Iterator[str]:
+        """
+        Yields the paths starting with path. Only one shard is walked when path names the first shard_depth
+        components of the files it matches, i.e. has at least shard_depth directories (e.g. videos/<id>/); otherwise
+        every shard is, skipping the directories that cannot match.
+        """
+        basedir_path = self.__get_basedir_path(basedir)
+        if basedir_path is None or not os.path.isdir(basedir_path):
+            return
+        directories = path.split("/")[:-1]
+        if any(component in ("", ".", "..") for component in directories):
+            return
+        if len(directories) >= self.shard_depth:
+            shards = [self.__get_shard(directories)]
+        else:
+            shards = sorted(os.listdir(basedir_path))
+        for shard in shards:
+            shard_path = os.path.join(basedir_path, shard)
+            for directory, subdirectories, filenames in os.walk(os.path.join(shard_path, *directories)):
+                relative_directory = os.path.relpath(directory, shard_path).replace(os.sep, "/")
+                prefix = "" if relative_directory == "." else f"{relative_directory}/"
+                subdirectories[:] = [subdirectory for subdirectory in subdirectories
+                                     if f"{prefix}{subdirectory}/".startswith(path[:len(prefix + subdirectory) + 1])]
+                for filename in filenames:
+                    if is_temp_file(filename):
+                        continue
+                    key = f"{prefix}{filename}"
+                    if key.startswith(path):
+                        yield key
+
+    def get_all_filepaths(self, basedir:str, path:str, *args, **kwargs) -> List[str]:
+        return sorted(self.iterate_filepaths(basedir, path))
+
+    def delete_files(self, basedir: str, paths: Iterable[str], *args, **kwargs) -> bool:
+        basedir_path = self.__get_basedir_path(basedir)
+        deleted = True
+        for path in paths:
+            filepath = self.get_filepath(basedir, path)
+            try:
+                os.remove(filepath)
+                self.__remove_empty_directories(os.path.dirname(filepath), basedir_path)
+            except FileNotFoundError:
+                pass
+            except (OSError, TypeError) as e:
+                print(f"Error deleting file {path}")
+                print(e)
+                deleted = False
+        return deleted
+
+    def delete_file(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        """
+        Deletes a file or, if there is none at path, every file whose path starts with it (see S3.delete_file).
+        """
+        if self.does_file_exist(basedir, path):
+            return self.delete_files(basedir, [path])
+        return self.delete_files(basedir, list(self.iterate_filepaths(basedir, path)))
+
+    def copy_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                  overwrite: bool = True, *args, **kwargs) -> bool:
+        source_filepath = self.get_filepath(source_basedir, source_path)
+        destination_filepath = self.get_filepath(destination_basedir, destination_path)
+        if source_filepath is None or destination_filepath is None or not os.path.isfile(source_filepath):
+            print(f"Error copying file {source_basedir}/{source_path} to {destination_basedir}/{destination_path}")
+            return False
+        # Stored files are never modified in place, so a hard link is as good as a copy
+        return self.__write(destination_filepath, lambda temp_filepath: self.__link_or_copy(source_filepath,
+                                                                                             temp_filepath),
+                            overwrite=overwrite)
+
+    def move_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                  overwrite: bool = True, *args, **kwargs) -> bool:
+        if self.copy_file(source_basedir=source_basedir, source_path=source_path,
+                          destination_basedir=destination_basedir, destination_path=destination_path,
+                          overwrite=overwrite):
+            return self.delete_file(basedir=source_basedir, path=source_path)
+        return False
@@ -0,0 +1,484 @@
+import atexit, glob, math, os, re, socket, threading, time
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+from django.conf import settings
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds. Requests and S3 calls are expected to take milliseconds, transcoding phases minutes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASE_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+QUEUE_WAIT_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 1800, 3600)
+
+
+def format_value(value:float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label_value(value:str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names:Iterable[str], values:Iterable[str]) -> str:
+    labels = ",".join([f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)])
+    return "{" + labels + "}" if len(labels) > 0 else ""
+
+
+class Metric(object):
+    """
+    A metric of this process, kept in memory and rendered in the Prometheus text format. Values are keyed by the
+    values of label_names, which every update must provide.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name:str, help:str, label_names:Tuple[str, ...]=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def get_key(self, labels:Dict[str, str]) -> Tuple[str, ...]:
+        return tuple([str(labels.get(name, "")) for name in self.label_names])
+
+    def get_samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        with self.lock:
+            return [(self.name, self.label_names, key, value) for key, value in self.values.items()]
+
+    def render(self, const_labels:Dict[str, str]=None) -> List[str]:
+        const_labels = const_labels or {}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, label_names, label_values, value in self.get_samples():
+            labels = format_labels(tuple(const_labels.keys()) + label_names,
+                                   tuple(const_labels.values()) + label_values)
+            lines.append(f"{name}{labels} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount:float=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value:float, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def remove(self, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values.pop(key, None)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name:str, help:str, label_names:Tuple[str, ...]=(), buckets:Tuple[float, ...]=LATENCY_BUCKETS):
+        super().__init__(name=name, help=help, label_names=label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label values: the count of every bucket (not cumulative), the sum and the count of observations
+        self.observations: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value:float, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            observation = self.observations.get(key)
+            if observation is None:
+                observation = self.observations[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    observation[0][index] += 1
+                    break
+            observation[1] += value
+            observation[2] += 1
+
+    def get_samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.observations.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f"{self.name}_bucket", self.label_names + ("le",), key + (format_value(bound),),
+                                    cumulative))
+                samples.append((f"{self.name}_sum", self.label_names, key, total))
+                samples.append((f"{self.name}_count", self.label_names, key, count))
+        return samples
+
+    def time(self, **labels) -> "Timer":
+        return Timer(self, labels)
+
+
+class Timer(object):
+    def __init__(self, histogram:Histogram, labels:Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self.started_at = None
+
+    def __enter__(self) -> "Timer":
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.started_at, **self.labels)
+
+
+class Registry(object):
+    """
+    The metrics of this process. Collectors are called on every render and return metrics whose values are read
+    from elsewhere, e.g. the counters of the storage cache.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], Iterable[Metric]]] = []
+
+    def register(self, metric:Metric) -> Metric:
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector:Callable[[], Iterable[Metric]]):
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self, const_labels:Dict[str, str]=None) -> str:
+        """
+        const_labels are added to every sample, e.g. to tell apart the processes whose metrics are exported side by
+        side.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+        for collector in collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                print("Error collecting metrics")
+                print(e)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(const_labels))
+        return "\n".join(lines) + "\n"
+
+
+def merge_metrics(contents:Iterable[str]) -> str:
+    """
+    Merges metrics rendered by several processes, whose samples must be told apart by their labels, into one
+    exposition with a single HELP and TYPE line per metric.
+    """
+    headers: Dict[str, Dict[str, str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for content in contents:
+        name = None
+        for line in content.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                name = line.split(" ")[2]
+                headers.setdefault(name, {}).setdefault(line[:6], line)
+                samples.setdefault(name, [])
+            elif len(line) > 0 and not (name is None):
+                samples[name].append(line)
+    lines = []
+    for name, family_samples in samples.items():
+        lines.extend(headers[name].values())
+        lines.extend(family_samples)
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION: Histogram = REGISTRY.register(Histogram(
+    "streamingengine_http_request_duration_seconds",
+    "Time until a view returned its response, by view and kind of file (manifest, segment, key)",
+    ("view", "kind", "method", "status")))
+S3_REQUESTS: Counter = REGISTRY.register(Counter(
+    "streamingengine_s3_requests_total", "S3 API calls by operation and outcome", ("operation", "outcome")))
+S3_REQUEST_DURATION: Histogram = REGISTRY.register(Histogram(
+    "streamingengine_s3_request_duration_seconds",
+    "Duration of S3 API calls, including retries, until their response headers were read", ("operation",)))
+S3_BYTES: Counter = REGISTRY.register(Counter(
+    "streamingengine_s3_bytes_total", "Bytes sent to or received from S3 by operation", ("operation", "direction")))
+TRANSCODE_PHASE_DURATION: Histogram = REGISTRY.register(Histogram(
+    "streamingengine_transcode_phase_duration_seconds", "Duration of the phases of transcoding jobs", ("phase",),
+    buckets=PHASE_BUCKETS))
+TRANSCODE_JOBS: Counter = REGISTRY.register(Counter(
+    "streamingengine_transcode_jobs_total", "Finished transcoding jobs by status", ("status",)))
+TRANSCODE_ENCODER_FPS: Gauge = REGISTRY.register(Gauge(
+    "streamingengine_transcode_encoder_fps",
+    "Source frames per second last reported by ffmpeg, by running job; removed once the job's phase ends", ("job",)))
+TASK_QUEUE_WAIT: Histogram = REGISTRY.register(Histogram(
+    "streamingengine_task_queue_wait_seconds", "Time celery tasks waited in their queue before a worker started them",
+    ("task", "queue"), buckets=QUEUE_WAIT_BUCKETS))
+TASK_DURATION: Histogram = REGISTRY.register(Histogram(
+    "streamingengine_task_duration_seconds", "Duration of celery tasks by outcome", ("task", "state"),
+    buckets=PHASE_BUCKETS))
+
+
+def collect_cache_metrics() -> List[Metric]:
+    from .cache import get_cache_stats
+    stats = get_cache_stats()
+    events = Counter("streamingengine_storage_cache_events_total",
+                     "Hits, misses, evictions, invalidations and dropped stale fills of the storage cache", ("event",))
+    for name, value in stats.items():
+        events.inc(value, event=name)
+    ratio = Gauge("streamingengine_storage_cache_hit_ratio", "Hits over lookups of each tier of the storage cache",
+                  ("tier",))
+    for tier in ["memory", "redis"]:
+        lookups = stats.get(f"{tier}_hits", 0) + stats.get(f"{tier}_misses", 0)
+        if lookups > 0:
+            ratio.set(stats.get(f"{tier}_hits", 0) / lookups, tier=tier)
+    return [events, ratio]
+
+
+REGISTRY.register_collector(collect_cache_metrics)
+
+
+def is_metrics_enabled() -> bool:
+    return settings.METRICS.get("ENABLED", False)
+
+
+class MetricsExporter(object):
+    """
+    Writes the metrics of this process to a file for node_exporter's textfile collector and/or pushes them to a
+    Prometheus Pushgateway. Celery workers serve no HTTP, and the web processes behind one address each only know
+    their own metrics. Every process exports its own metrics, named and labelled after its host and its index in the
+    worker pool (which the process that replaces it takes over) or its pid, and removes them when it exits. Once
+    started, a thread of the process exports them every interval seconds, so that metrics updated during a long task
+    (e.g. the fps of a transcode) do not wait for its end.
+    """
+
+    def __init__(self, textfile_dir:str=None, pushgateway_url:str=None, job:str="streamingengine_worker",
+                 interval:float=15.0):
+        self.textfile_dir = textfile_dir
+        self.pushgateway_url = pushgateway_url
+        self.job = job
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_export = 0.0
+        self.stopped = threading.Event()
+        # The pid of the process whose thread exports, since forked processes do not inherit it
+        self.thread_pid = None
+
+    def has_targets(self) -> bool:
+        return len(self.textfile_dir or "") > 0 or len(self.pushgateway_url or "") > 0
+
+    def start(self):
+        if self.thread_pid == os.getpid() or self.stopped.is_set() or not self.has_targets():
+            return
+        with self.lock:
+            if self.thread_pid == os.getpid():
+                return
+            self.thread_pid = os.getpid()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.export(force=True)
+
+    def get_instance(self) -> str:
+        # Processes of a prefork pool have an index; processes without one, e.g. a solo pool, are named by pid
+        from billiard.process import current_process
+        index = getattr(current_process(), "index", None)
+        return f"{socket.gethostname()}_{index if not (index is None) else os.getpid()}"
+
+    def get_textfile_path(self) -> str:
+        return os.path.join(self.textfile_dir, f"{self.job}_{self.get_instance()}.prom")
+
+    def get_pushgateway_group_url(self) -> str:
+        return f"{self.pushgateway_url.rstrip('/')}/metrics/job/{self.job}/instance/{self.get_instance()}"
+
+    def get_textfile_paths(self) -> List[str]:
+        """
+        The files of every process that exports to textfile_dir, except those of processes of this host that are no
+        longer running (e.g. killed before they could remove them), which are removed.
+        """
+        pattern = re.compile(rf"^{re.escape(self.job)}_{re.escape(socket.gethostname())}_(\d+)\.prom$")
+        filepaths = []
+        for filepath in sorted(glob.glob(os.path.join(glob.escape(self.textfile_dir), f"{self.job}_*.prom"))):
+            match = pattern.match(os.path.basename(filepath))
+            if not (match is None) and not is_process_running(int(match.group(1))):
+                try:
+                    os.remove(filepath)
+                except OSError:
+                    pass
+                continue
+            filepaths.append(filepath)
+        return filepaths
+
+    def read_textfiles(self) -> str:
+        """
+        The merged metrics of every process that exports to textfile_dir, those of this process exported right now.
+        """
+        self.export(force=True)
+        contents = []
+        for filepath in self.get_textfile_paths():
+            try:
+                with open(filepath, "r") as f:
+                    contents.append(f.read())
+            except OSError:
+                # Removed by its process in the meantime
+                pass
+        return merge_metrics(contents)
+
+    def write_textfile(self, content:str):
+        os.makedirs(self.textfile_dir, exist_ok=True)
+        filepath = self.get_textfile_path()
+        # node_exporter may read the file at any time, so it is replaced atomically
+        temp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_filepath, "w") as f:
+            f.write(content)
+        os.replace(temp_filepath, filepath)
+
+    def push(self, content:str):
+        import requests
+        response = requests.put(self.get_pushgateway_group_url(), data=content.encode(),
+                                headers={"Content-Type": CONTENT_TYPE}, timeout=5)
+        response.raise_for_status()
+
+    def remove(self):
+        """
+        Removes the exported metrics of this process, so that the textfile collector and the Pushgateway do not keep
+        reporting a process that has exited.
+        """
+        self.stopped.set()
+        with self.lock:
+            if self.last_export == 0.0:
+                return
+            self.last_export = 0.0
+        try:
+            if not (self.textfile_dir is None) and len(self.textfile_dir) > 0 \
+                    and os.path.exists(self.get_textfile_path()):
+                os.remove(self.get_textfile_path())
+            if not (self.pushgateway_url is None) and len(self.pushgateway_url) > 0:
+                import requests
+                requests.delete(self.get_pushgateway_group_url(), timeout=5).raise_for_status()
+        except Exception as e:
+            print("Error removing exported metrics")
+            print(e)
+
+    def export(self, force:bool=False):
+        if self.stopped.is_set():
+            return
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_export < self.interval:
+                return
+            self.last_export = now
+        content = REGISTRY.render({"process": self.get_instance()})
+        try:
+            if not (self.textfile_dir is None) and len(self.textfile_dir) > 0:
+                self.write_textfile(content)
+            if not (self.pushgateway_url is None) and len(self.pushgateway_url) > 0:
+                self.push(content)
+        except Exception as e:
+            print("Error exporting metrics")
+            print(e)
+
+
+def is_process_running(pid:int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Set on every task message when it is published, so that workers can tell how long it waited in its queue
+ENQUEUED_AT_HEADER = "enqueued_at"
+
+_task_started_at: Dict[str, float] = {}
+_task_started_at_lock = threading.Lock()
+
+
+def record_task_published(headers:dict=None, **kwargs):
+    if not (headers is None):
+        headers[ENQUEUED_AT_HEADER] = time.time()
+
+
+def record_task_started(task_id:str=None, task:Any=None, **kwargs):
+    request = getattr(task, "request", None)
+    enqueued_at = getattr(request, ENQUEUED_AT_HEADER, None) or (getattr(request, "headers", None) or {}).get(
+        ENQUEUED_AT_HEADER)
+    if not (enqueued_at is None):
+        queue = (getattr(request, "delivery_info", None) or {}).get("routing_key") or "celery"
+        TASK_QUEUE_WAIT.observe(max(time.time() - float(enqueued_at), 0), task=task.name, queue=queue)
+    with _task_started_at_lock:
+        _task_started_at[task_id] = time.perf_counter()
+    if is_metrics_enabled():
+        get_metrics_exporter(EXPORTER_WORKER).start()
+
+
+def record_task_finished(task_id:str=None, task:Any=None, state:str=None, **kwargs):
+    with _task_started_at_lock:
+        started_at = _task_started_at.pop(task_id, None)
+    if not (started_at is None):
+        TASK_DURATION.observe(time.perf_counter() - started_at, task=task.name, state=state or "UNKNOWN")
+    if is_metrics_enabled():
+        get_metrics_exporter(EXPORTER_WORKER).export()
+
+
+def remove_worker_metrics(**kwargs):
+    # Called when a worker process exits
+    if is_metrics_enabled():
+        get_metrics_exporter(EXPORTER_WORKER).remove()
+
+
+def start_web_metrics_export():
+    # Called on every request, so that the exporting thread runs in every web process, which may be forked after
+    # the application was loaded
+    if is_metrics_enabled():
+        get_metrics_exporter(EXPORTER_WEB).start()
+
+
+def render_web_metrics() -> str:
+    """
+    The metrics served on /metrics/: those of every web process of this host if they export to a textfile directory,
+    else only those of this process.
+    """
+    web_settings = settings.METRICS.get("WEB", {})
+    if len(web_settings.get("TEXTFILE_DIR") or "") > 0:
+        return get_metrics_exporter(EXPORTER_WEB).read_textfiles()
+    return REGISTRY.render()
+
+
+# Keys of settings.METRICS
+EXPORTER_WORKER = "WORKER"
+EXPORTER_WEB = "WEB"
+
+_exporters: Dict[str, MetricsExporter] = {}
+_exporter_lock = threading.Lock()
+
+
+def get_metrics_exporter(kind:str) -> MetricsExporter:
+    exporter = _exporters.get(kind)
+    if exporter is None:
+        with _exporter_lock:
+            exporter = _exporters.get(kind)
+            if exporter is None:
+                exporter_settings = settings.METRICS.get(kind, {})
+                exporter = MetricsExporter(textfile_dir=exporter_settings.get("TEXTFILE_DIR"),
+                                           pushgateway_url=exporter_settings.get("PUSHGATEWAY_URL"),
+                                           job=exporter_settings.get("JOB", f"streamingengine_{kind.lower()}"),
+                                           interval=exporter_settings.get("INTERVAL", 15.0))
+                if kind == EXPORTER_WEB:
+                    # Web servers stop their processes without a signal that the application could connect to
+                    atexit.register(exporter.remove)
+                _exporters[kind] = exporter
+    return exporter
@@ -0,0 +1,103 @@
+import os
+from typing import Any, Dict, List, Union
+
+from django.conf import settings
+
+
+# The queue of the tasks that are not transcoding jobs, celery's default
+DEFAULT_QUEUE = "celery"
+
+
+def is_routing_enabled() -> bool:
+    return settings.TRANSCODE_ROUTING.get("ENABLED", False)
+
+
+def get_job_classes() -> List[Dict[str, Any]]:
+    return settings.TRANSCODE_ROUTING["CLASSES"]
+
+
+def get_job_class_by_name(name:Union[str, None]) -> Union[Dict[str, Any], None]:
+    for job_class in get_job_classes():
+        if job_class["NAME"] == name:
+            return job_class
+    return None
+
+
+def get_job_class(duration:float=None, size:int=None) -> Dict[str, Any]:
+    """
+    The first class of settings.TRANSCODE_ROUTING whose limits a source of duration seconds and size bytes is within.
+    A limit of None, or a duration or size that is not known, is not checked; a source of which neither is known gets
+    the default class.
+    """
+    classes = get_job_classes()
+    if duration is None and size is None:
+        return get_job_class_by_name(settings.TRANSCODE_ROUTING.get("DEFAULT_CLASS")) or classes[-1]
+    for job_class in classes:
+        max_duration = job_class.get("MAX_DURATION")
+        max_size = job_class.get("MAX_SIZE")
+        if not (duration is None or max_duration is None) and duration > max_duration:
+            continue
+        if not (size is None or max_size is None) and size > max_size:
+            continue
+        return job_class
+    return classes[-1]
+
+
+def get_task_route(job_class:Union[Dict[str, Any], None]) -> Dict[str, Any]:
+    """
+    The options of apply_async that queue a task of a job of job_class. Without routing tasks go to the default queue.
+    """
+    if job_class is None or not is_routing_enabled():
+        return {}
+    route = {"queue": job_class["QUEUE"]}
+    if not (job_class.get("PRIORITY") is None):
+        route["priority"] = job_class["PRIORITY"]
+    return route
+
+
+def get_task_queues() -> Union[list, None]:
+    """
+    The queues workers consume when they are not given any (celery worker -Q): the queues of the job classes in order,
+    then the default queue. With the broker's "priority" queue order strategy a worker takes a task from a queue only if
+    the queues before it are empty.
+    """
+    if not is_routing_enabled():
+        return None
+    from kombu import Queue
+    names = []
+    for job_class in get_job_classes():
+        if not job_class["QUEUE"] in names:
+            names.append(job_class["QUEUE"])
+    if not DEFAULT_QUEUE in names:
+        names.append(DEFAULT_QUEUE)
+    return [Queue(name) for name in names]
+
+
+def get_threads_per_job() -> int:
+    """
+    The cores one transcoding job keeps busy: settings.TRANSCODE_WORKER["THREADS_PER_JOB"], or else the ffmpeg threads
+    of the default encoding profile times the ffmpeg processes of a job. ffmpeg sizes its automatic thread count (0) to
+    every core.
+    """
+    cores = os.cpu_count() or 1
+    threads = settings.TRANSCODE_WORKER.get("THREADS_PER_JOB", 0)
+    if threads > 0:
+        return threads
+    profile = settings.TRANSCODE_PROFILES.get(settings.TRANSCODE_DEFAULT_PROFILE, {})
+    threads = profile.get("THREADS", 0)
+    if threads <= 0:
+        return cores
+    if settings.TRANSCODE_EXECUTION["MODE"] == "parallel":
+        threads *= settings.TRANSCODE_EXECUTION["MAX_PARALLEL_PROCESSES"]
+    return min(threads, cores)
+
+
+def get_worker_concurrency() -> int:
+    """
+    The number of tasks a worker runs at once, settings.TRANSCODE_WORKER["CONCURRENCY"] or as many transcoding jobs as
+    its cores can run without ffmpeg processes competing for them. celery worker -c takes precedence.
+    """
+    concurrency = settings.TRANSCODE_WORKER.get("CONCURRENCY", 0)
+    if concurrency > 0:
+        return concurrency
+    return max(1, (os.cpu_count() or 1) // get_threads_per_job())
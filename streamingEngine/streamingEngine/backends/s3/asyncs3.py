@@ -0,0 +1,145 @@
+import asyncio
+from typing import IO, Any, AsyncGenerator, Dict, List, Union
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from ..file import StreamingFile
+from ..storageInterface import IAsyncStorageInterface
+from .s3 import S3, S3File, CONTENT_TYPE_METADATA_KEY
+
+# httpx clients are bound to the event loop they were first used on
+_clients: Dict[int, httpx.AsyncClient] = {}
+
+# Requests are signed as presigned urls that only have to be valid until the request has been sent
+REQUEST_URL_EXPIRY = 300
+
+
+def get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(id(loop))
+    if client is None or client.is_closed:
+        for key in [key for key, value in _clients.items() if value.is_closed]:
+            _clients.pop(key)
+        client_settings = settings.AWS["S3"].get("CLIENT", {})
+        max_connections = client_settings.get("MAX_POOL_CONNECTIONS", 10)
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(client_settings.get("READ_TIMEOUT", 60),
+                                  connect=client_settings.get("CONNECT_TIMEOUT", 60)),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        _clients[id(loop)] = client
+    return client
+
+
+def get_content_type(response: httpx.Response) -> str:
+    return response.headers.get(f"x-amz-meta-{CONTENT_TYPE_METADATA_KEY}", response.headers.get("content-type"))
+
+
+class AsyncS3StreamingFile(StreamingFile):
+
+    def __init__(self, file: Union[httpx.Response, None], content_type: str, content_length: int = None,
+                 etag: str = None, content_range: str = None, status: int = 200):
+        super().__init__(file=file, content_type=content_type, content_length=content_length, etag=etag,
+                         content_range=content_range, status=status)
+
+    async def achunks(self, chunk_size: int = StreamingFile.DEFAULT_CHUNK_SIZE) -> AsyncGenerator[bytes, None]:
+        if self.file is None:
+            return
+        try:
+            async for chunk in self.file.aiter_bytes(chunk_size=chunk_size):
+                yield chunk
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if not (self.file is None):
+            await self.file.aclose()
+
+
+class AsyncS3(IAsyncStorageInterface):
+    """
+    Reads objects with non-blocking HTTP requests on the event loop, so a waiting viewer does not hold a thread.
+    Requests are presigned by the (thread safe, pooled) boto3 client of S3, which needs no network access, and then
+    sent with httpx. Writes are rare and not latency sensitive, so they run the synchronous S3 methods in a thread.
+    """
+
+    def __init__(self) -> None:
+        self.storage = S3()
+
+    def __get_url(self, basedir: str, path: str, method: str = "get_object") -> str:
+        return self.storage.get_presigned_url(basedir=basedir, path=path, expires_in=REQUEST_URL_EXPIRY, method=method)
+
+    async def does_file_exist(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        try:
+            response = await get_async_client().head(self.__get_url(basedir, path, method="head_object"))
+            return response.status_code == 200
+        except httpx.HTTPError as e:
+            print(f"Error checking whether file {path} exists")
+            print(e)
+        return False
+
+    async def upload_file(self, basedir: str, data: Union[IO[Any], str], path: str, content_type: str,
+                          *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.upload_file, thread_sensitive=False)(
+            basedir, data, path, content_type, *args, **kwargs)
+
+    async def get_file(self, basedir: str, path: str, *args, **kwargs) -> S3File:
+        try:
+            response = await get_async_client().get(self.__get_url(basedir, path))
+            if response.status_code == 200:
+                return S3File(file=response.content, content_type=get_content_type(response))
+            print(f"Error fetching file {path}: {response.status_code}")
+        except httpx.HTTPError as e:
+            print(f"Error fetching file")
+            print(e)
+        return None
+
+    async def get_file_stream(self, basedir: str, path: str, byte_range: str = None, if_none_match: str = None,
+                              *args, **kwargs) -> AsyncS3StreamingFile:
+        headers = {}
+        if not (byte_range is None) and len(byte_range) > 0:
+            headers["Range"] = byte_range
+        if not (if_none_match is None) and len(if_none_match) > 0:
+            headers["If-None-Match"] = if_none_match
+        client = get_async_client()
+        try:
+            response = await client.send(client.build_request("GET", self.__get_url(basedir, path), headers=headers),
+                                         stream=True)
+        except httpx.HTTPError as e:
+            print(f"Error fetching file")
+            print(e)
+            return None
+        if response.status_code in (200, 206):
+            content_length = response.headers.get("content-length")
+            return AsyncS3StreamingFile(
+                file=response,
+                content_type=get_content_type(response),
+                content_length=int(content_length) if not (content_length is None) else None,
+                etag=response.headers.get("etag"),
+                content_range=response.headers.get("content-range"),
+                status=response.status_code
+            )
+        await response.aclose()
+        if response.status_code in (304, 416):
+            return AsyncS3StreamingFile(file=None, content_type=None, etag=if_none_match, status=response.status_code)
+        print(f"Error fetching file {path}: {response.status_code}")
+        return None
+
+    async def get_all_filepaths(self, basedir: str, path: str, *args, **kwargs) -> List[str]:
+        return await sync_to_async(self.storage.get_all_filepaths, thread_sensitive=False)(
+            basedir, path, *args, **kwargs)
+
+    async def delete_file(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.delete_file, thread_sensitive=False)(basedir, path, *args, **kwargs)
+
+    async def copy_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                        overwrite: bool = True, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.copy_file, thread_sensitive=False)(
+            source_basedir, source_path, destination_basedir, destination_path, overwrite, *args, **kwargs)
+
+    async def move_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                        overwrite: bool = True, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.move_file, thread_sensitive=False)(
+            source_basedir, source_path, destination_basedir, destination_path, overwrite, *args, **kwargs)
@@ -2,20 +2,127 @@ from django.conf import settings
 import boto3
 from boto3.s3.transfer import TransferConfig
 from mypy_boto3_s3.client import S3Client
-from typing import IO, Union, Any, List
+from typing import IO, Union, Any, Callable, Iterable, Iterator, List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 from botocore.response import StreamingBody
 from botocore.exceptions import ClientError
+from boto3.exceptions import S3UploadFailedError
 
-import threading
+import os, threading, time
+from collections import Counter
 
-from ..file import File
+from ..file import File, StreamingFile
 from ..storageInterface import IStorageInterface
+from ..metrics import S3_REQUESTS, S3_REQUEST_DURATION, S3_BYTES
 
 
 CONTENT_TYPE_METADATA_KEY = "content_type"
+# Most keys that ListObjectsV2 returns and DeleteObjects accepts per request
+MAX_KEYS_PER_REQUEST = 1000
+
+_clients: Dict[Tuple, S3Client] = {}
+_clients_lock = threading.Lock()
+
+# Buckets known to exist mapped to the time at which that knowledge expires
+_existing_buckets: Dict[str, float] = {}
+_existing_buckets_lock = threading.Lock()
+
+# Number of S3 API calls issued by this process per operation name (GetObject, HeadObject, ...)
+_request_counts = Counter()
+_request_counts_lock = threading.Lock()
+
+
+def count_request(event_name:str, params:dict=None, context:dict=None, **kwargs):
+    operation = event_name.split(".")[-1]
+    with _request_counts_lock:
+        _request_counts[operation] += 1
+    if not (context is None):
+        context["metrics_started_at"] = time.perf_counter()
+    body = (params or {}).get("body")
+    if not (body is None) and hasattr(body, "__len__") and len(body) > 0:
+        S3_BYTES.inc(len(body), operation=operation, direction="sent")
+
+
+def record_response(event_name:str, http_response:Any=None, parsed:dict=None, model:Any=None, context:dict=None,
+                    **kwargs):
+    operation = event_name.split(".")[-1]
+    status = getattr(http_response, "status_code", 0)
+    S3_REQUESTS.inc(operation=operation, outcome=f"{status // 100}xx")
+    if not (context is None) and "metrics_started_at" in context.keys():
+        S3_REQUEST_DURATION.observe(time.perf_counter() - context["metrics_started_at"], operation=operation)
+    # The body of a streamed response (GetObject) is read later by the caller, all of it in practice
+    if getattr(model, "has_streaming_output", False) and status < 300 and "ContentLength" in (parsed or {}).keys():
+        S3_BYTES.inc(parsed["ContentLength"], operation=operation, direction="received")
+
+
+def record_error(event_name:str, context:dict=None, **kwargs):
+    # Connection errors and timeouts, which have no response
+    operation = event_name.split(".")[-1]
+    S3_REQUESTS.inc(operation=operation, outcome="error")
+    if not (context is None) and "metrics_started_at" in context.keys():
+        S3_REQUEST_DURATION.observe(time.perf_counter() - context["metrics_started_at"], operation=operation)
+
+
+def get_request_counts() -> Dict[str, int]:
+    with _request_counts_lock:
+        return dict(_request_counts)
+
+
+def reset_request_counts():
+    with _request_counts_lock:
+        _request_counts.clear()
+
+
+def is_not_found(e:ClientError) -> bool:
+    return e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NoSuchBucket", "NotFound")
+
+
+def get_client_config() -> Config:
+    client_settings = settings.AWS["S3"].get("CLIENT", {})
+    retries = client_settings.get("RETRIES", {})
+    return Config(
+        max_pool_connections=client_settings.get("MAX_POOL_CONNECTIONS", 10),
+        connect_timeout=client_settings.get("CONNECT_TIMEOUT", 60),
+        read_timeout=client_settings.get("READ_TIMEOUT", 60),
+        tcp_keepalive=client_settings.get("TCP_KEEPALIVE", False),
+        retries={
+            "max_attempts": retries.get("MAX_ATTEMPTS", 3),
+            "mode": retries.get("MODE", "legacy")
+        }
+    )
+
+
+def get_client(location:str, access_key:str, access_secret:str, region:str) -> S3Client:
+    """
+    Returns the process wide client for the given endpoint and credentials, creating it on first use.
+    boto3 clients are thread safe, so the client and its connection pool are shared by every request thread and
+    celery task of the process. Clients are keyed by pid so that forked workers never reuse the parent's sockets.
+    """
+    key = (os.getpid(), location, access_key, access_secret, region)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                for stale_key in [k for k in _clients.keys() if k[0] != key[0]]:
+                    _clients.pop(stale_key)
+                # Sessions are not thread safe, so each client is built from its own session under the lock
+                session = boto3.session.Session(
+                    aws_access_key_id=access_key,
+                    aws_secret_access_key=access_secret,
+                    region_name=region
+                )
+                client = session.client(service_name='s3', endpoint_url=location, config=get_client_config())
+                client.meta.events.register('before-call.s3', count_request)
+                client.meta.events.register('after-call.s3', record_response)
+                client.meta.events.register('after-call-error.s3', record_error)
+                _clients[key] = client
+    return client
+
 
 class S3FileUploadProgressCallback(object):
-    def __int__(self, callback:object=None):
+    def __init__(self, callback:object=None):
         self.lock = threading.Lock()
         self.current_progress = 0
         self.callback = callback
@@ -33,41 +140,83 @@ class S3File(File):
         super().__init__(file=file, content_type=content_type)
 
 
+class S3StreamingFile(StreamingFile):
+
+    def __init__(self, file:Union[StreamingBody, None], content_type:str, content_length:int=None, etag:str=None,
+                 content_range:str=None, status:int=200):
+        super().__init__(file=file, content_type=content_type, content_length=content_length, etag=etag,
+                         content_range=content_range, status=status)
+
+    def chunks(self, chunk_size:int=StreamingFile.DEFAULT_CHUNK_SIZE):
+        if self.file is None:
+            return
+        try:
+            for chunk in self.file.iter_chunks(chunk_size=chunk_size):
+                yield chunk
+        finally:
+            self.close()
+
+
 class S3(IStorageInterface):
 
+    # S3 rejects multipart uploads whose parts (other than the last one) are smaller than 5 MiB
+    MIN_PART_SIZE = 5 * 1024 * 1024
+
     def __init__(self) -> None:
         self.location = settings.AWS["S3"]["URL"]
         self.access_key = settings.AWS["ACCESS_KEY_ID"]
         self.access_secret = settings.AWS["ACCESS_KEY_SECRET"]
         self.region = settings.AWS["REGION"]
-        self.s3: S3Client = boto3.client(
-            service_name='s3', aws_access_key_id=self.access_key,
-            aws_secret_access_key=self.access_secret,
-            endpoint_url=self.location,
-            region_name=self.region
+        self.bucket_cache_ttl = settings.AWS["S3"].get("BUCKET_CACHE_TTL", 300)
+        self.s3: S3Client = get_client(
+            location=self.location,
+            access_key=self.access_key,
+            access_secret=self.access_secret,
+            region=self.region
         )
 
+    def __get_content_type(self, data:dict) -> str:
+        content_type = data.get("ContentType")
+        if "Metadata" in data.keys() and CONTENT_TYPE_METADATA_KEY in data["Metadata"].keys():
+            content_type = data["Metadata"][CONTENT_TYPE_METADATA_KEY]
+        return content_type
+
+    def __remember_bucket(self, name: str):
+        with _existing_buckets_lock:
+            _existing_buckets[name] = time.monotonic() + self.bucket_cache_ttl
+
+    def __forget_bucket(self, name: str):
+        with _existing_buckets_lock:
+            _existing_buckets.pop(name, None)
+
     def does_bucket_exist(self, name: str) -> bool:
+        # Buckets are created once and practically never removed, so a positive answer is cached for the process
+        expires_at = _existing_buckets.get(name)
+        if not (expires_at is None) and expires_at > time.monotonic():
+            return True
         try:
             response = self.s3.head_bucket(Bucket=name)
             if not (response is None):
+                self.__remember_bucket(name)
                 return True
         except:
             return False
         return False
 
     def does_file_exist(self, basedir: str, path: str, *args, **kwargs) -> bool:
-        if self.does_bucket_exist(basedir):
-            try:
-                self.s3.get_object(Bucket=basedir, Key=path)
-                return True
-            except:
-                print(f"File {path} does not exist in bucket")
+        try:
+            self.s3.head_object(Bucket=basedir, Key=path)
+            return True
+        except ClientError as e:
+            if not is_not_found(e):
+                print(f"Error checking whether file {path} exists")
+                print(e)
         return False
 
     def create_bucket(self, name: str) -> bool:
         if not (self.does_bucket_exist(name)):
             self.s3.create_bucket(Bucket=name)
+            self.__remember_bucket(name)
             return True
         else:
             print(f"Bucket {name} already exists")
@@ -76,12 +225,17 @@ class S3(IStorageInterface):
     def delete_bucket(self, name: str) -> bool:
         if self.does_bucket_exist(name):
             response = self.s3.delete_bucket(Bucket=name)
+            self.__forget_bucket(name)
             return True
         return False
 
     def upload_file(self, basedir: str, data:Union[IO[Any], StreamingBody, str], path: str, content_type:str,
                     use_concurrency:bool=False, callback:S3FileUploadProgressCallback=None,
-                    create_basedir_if_not_exist=False, *args, **kwargs) -> bool:
+                    create_basedir_if_not_exist=False, overwrite:bool=False, *args, **kwargs) -> bool:
+        """
+        Uploads a file unless it already exists. Pass overwrite=True when the destination is known to be new (e.g. a
+        freshly generated prefix) or may be replaced, which skips the existence check entirely.
+        """
 
         if not self.does_bucket_exist(basedir):
             if create_basedir_if_not_exist:
@@ -89,7 +243,9 @@ class S3(IStorageInterface):
             else:
                 print(f'Bucket does not exist')
                 return False
-        if not self.does_file_exist(basedir=basedir, path=path):
+        # The pinned botocore has no If-None-Match support for PutObject, so a HEAD request is the cheapest way
+        # to avoid replacing an existing object
+        if overwrite or not self.does_file_exist(basedir=basedir, path=path):
             try:
                 metadata = {"Metadata": {CONTENT_TYPE_METADATA_KEY: content_type}}
                 if not use_concurrency:
@@ -109,88 +265,254 @@ class S3(IStorageInterface):
                                             Callback=callback,
                                             ExtraArgs=metadata)
                 return True
-            except ClientError as e:
+            except (ClientError, S3UploadFailedError) as e:
                 print(f"Error uploading file")
                 print(e)
         else:
-            print(f"Bucket {basedir} does not exist or the file {path} already exists")
+            print(f"The file {path} already exists in bucket {basedir}")
 
         return False
 
     def get_file(self, basedir: str, path: str, *args, **kwargs) -> S3File:
-        if self.does_bucket_exist(basedir):
-            try:
-                data = self.s3.get_object(Bucket=basedir, Key=path)
-                if not (data is None) and ('Body' in data.keys()):
-                    content = data['Body'].read()
-                    content_type = data["ContentType"]
-                    if "Metadata" in data.keys() and CONTENT_TYPE_METADATA_KEY in data["Metadata"].keys():
-                        content_type = data["Metadata"][CONTENT_TYPE_METADATA_KEY]
-                    return S3File(file=content, content_type=content_type)
-            except ClientError as e:
-                print(f"Error fetching file")
-                print(e)
-        else:
-            print(f"Bucket {basedir} does not exist")
+        try:
+            data = self.s3.get_object(Bucket=basedir, Key=path)
+            if not (data is None) and ('Body' in data.keys()):
+                content = data['Body'].read()
+                return S3File(file=content, content_type=self.__get_content_type(data))
+        except ClientError as e:
+            print(f"Error fetching file")
+            print(e)
+        return None
+
+    def get_file_stream(self, basedir: str, path: str, byte_range: str = None, if_none_match: str = None,
+                        *args, **kwargs) -> S3StreamingFile:
+        request = {"Bucket": basedir, "Key": path}
+        if not (byte_range is None) and len(byte_range) > 0:
+            request["Range"] = byte_range
+        if not (if_none_match is None) and len(if_none_match) > 0:
+            request["IfNoneMatch"] = if_none_match
+        try:
+            data = self.s3.get_object(**request)
+            if not (data is None) and ('Body' in data.keys()):
+                return S3StreamingFile(
+                    file=data['Body'],
+                    content_type=self.__get_content_type(data),
+                    content_length=data.get("ContentLength"),
+                    etag=data.get("ETag"),
+                    content_range=data.get("ContentRange"),
+                    status=data["ResponseMetadata"]["HTTPStatusCode"]
+                )
+        except ClientError as e:
+            status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            if status in (304, 416):
+                return S3StreamingFile(file=None, content_type=None, etag=if_none_match, status=status)
+            print(f"Error fetching file")
+            print(e)
         return None
 
+    def download_file(self, basedir: str, path: str, destination_filepath: str,
+                      progress: Callable[[int, int], None] = None, *args, **kwargs) -> bool:
+        """
+        Streams an object to disk with parallel ranged GETs. Memory use is bounded by
+        MULTIPART_CHUNKSIZE * MAX_CONCURRENCY regardless of the size of the object.
+        :param progress: called with the bytes downloaded so far and the size of the object
+        """
+        transfer_settings = settings.AWS["S3"].get("TRANSFER", {})
+        chunk_size = transfer_settings.get("MULTIPART_CHUNKSIZE", 8 * 1024 * 1024)
+        config = TransferConfig(
+            multipart_threshold=chunk_size, multipart_chunksize=chunk_size,
+            max_concurrency=transfer_settings.get("MAX_CONCURRENCY", 10), use_threads=True
+        )
+        try:
+            callback = None
+            if not (progress is None):
+                size = self.s3.head_object(Bucket=basedir, Key=path)["ContentLength"]
+                callback = S3FileUploadProgressCallback(callback=lambda downloaded: progress(downloaded, size))
+            self.s3.download_file(Bucket=basedir, Key=path, Filename=destination_filepath, Config=config,
+                                  Callback=callback)
+            return True
+        except ClientError as e:
+            print(f"Error downloading file {path}")
+            print(e)
+        return False
+
+    def get_presigned_url(self, basedir: str, path: str, expires_in: int = 3600, method: str = "get_object",
+                          params: Dict[str, Any] = None) -> str:
+        """
+        :param params: additional parameters of the presigned request, e.g. UploadId and PartNumber for upload_part
+        """
+        try:
+            return self.s3.generate_presigned_url(ClientMethod=method,
+                                                  Params={"Bucket": basedir, "Key": path, **(params or {})},
+                                                  ExpiresIn=expires_in)
+        except ClientError as e:
+            print(f"Error generating presigned url for {path}")
+            print(e)
+        return None
+
+    def create_multipart_upload(self, basedir: str, path: str, content_type: str) -> Union[str, None]:
+        try:
+            response = self.s3.create_multipart_upload(Bucket=basedir, Key=path,
+                                                       Metadata={CONTENT_TYPE_METADATA_KEY: content_type})
+            return response["UploadId"]
+        except ClientError as e:
+            print(f"Error starting multipart upload of {path}")
+            print(e)
+        return None
+
+    def upload_part(self, basedir: str, path: str, upload_id: str, part_number: int,
+                    data: Union[bytes, IO[Any]]) -> Union[str, None]:
+        """
+        Uploads one part of a multipart upload and returns its ETag. Every part but the last must be at least
+        MIN_PART_SIZE bytes.
+        """
+        try:
+            response = self.s3.upload_part(Bucket=basedir, Key=path, UploadId=upload_id, PartNumber=part_number,
+                                           Body=data)
+            return response["ETag"]
+        except ClientError as e:
+            print(f"Error uploading part {part_number} of {path}")
+            print(e)
+        return None
+
+    def list_parts(self, basedir: str, path: str, upload_id: str) -> Union[List[Dict[str, Any]], None]:
+        """
+        Returns the parts uploaded so far as dicts with PartNumber, ETag and Size, or None if the upload is unknown.
+        """
+        parts = []
+        request = {"Bucket": basedir, "Key": path, "UploadId": upload_id}
+        try:
+            while True:
+                response = self.s3.list_parts(**request)
+                parts += response.get("Parts", [])
+                if not response.get("IsTruncated", False):
+                    return parts
+                request["PartNumberMarker"] = response["NextPartNumberMarker"]
+        except ClientError as e:
+            print(f"Error listing parts of {path}")
+            print(e)
+        return None
+
+    def complete_multipart_upload(self, basedir: str, path: str, upload_id: str,
+                                  parts: List[Dict[str, Any]]) -> bool:
+        try:
+            self.s3.complete_multipart_upload(
+                Bucket=basedir, Key=path, UploadId=upload_id,
+                MultipartUpload={"Parts": [{"PartNumber": part["PartNumber"], "ETag": part["ETag"]} for part in parts]}
+            )
+            return True
+        except ClientError as e:
+            print(f"Error completing multipart upload of {path}")
+            print(e)
+        return False
+
+    def abort_multipart_upload(self, basedir: str, path: str, upload_id: str) -> bool:
+        try:
+            self.s3.abort_multipart_upload(Bucket=basedir, Key=path, UploadId=upload_id)
+            return True
+        except ClientError as e:
+            print(f"Error aborting multipart upload of {path}")
+            print(e)
+        return False
+
+    def __get_filepath_pages(self, basedir:str, path:str) -> Iterator[List[str]]:
+        # Follows the continuation tokens of ListObjectsV2, one request per page of up to 1000 keys
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=basedir, Prefix=path,
+                                       PaginationConfig={"PageSize": MAX_KEYS_PER_REQUEST}):
+            keys = [object['Key'] for object in page.get('Contents', [])]
+            if len(keys) > 0:
+                yield keys
+
+    def __delete_batch(self, basedir:str, paths:List[str]) -> bool:
+        try:
+            response = self.s3.delete_objects(Bucket=basedir, Delete={
+                'Objects': [{'Key': path} for path in paths], 'Quiet': True
+            })
+        except ClientError as e:
+            print(f"Error deleting files")
+            print(e)
+            return False
+        errors = response.get('Errors', [])
+        for error in errors:
+            print(f"Error deleting file {error.get('Key')}: {error.get('Code')} {error.get('Message')}")
+        return len(errors) == 0
+
+    def __delete_pages(self, basedir:str, pages:Iterable[List[str]]) -> bool:
+        # Every page is deleted with one request while the next ones are listed
+        max_concurrency = settings.AWS["S3"].get("DELETE", {}).get("MAX_CONCURRENCY", 4)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [executor.submit(self.__delete_batch, basedir, page) for page in pages]
+            return all([future.result() for future in futures])
+
+    def delete_files(self, basedir: str, paths: Iterable[str], *args, **kwargs) -> bool:
+        """
+        Deletes the files at paths in batches of up to 1000 keys per DeleteObjects request, several batches at a time.
+        Missing files are ignored.
+        """
+        def get_batches() -> Iterator[List[str]]:
+            batch = []
+            for path in paths:
+                batch.append(path)
+                if len(batch) == MAX_KEYS_PER_REQUEST:
+                    yield batch
+                    batch = []
+            if len(batch) > 0:
+                yield batch
+
+        return self.__delete_pages(basedir, get_batches())
+
     def delete_file(self, basedir: str, path: str, *args, **kwargs) -> bool:
-        if self.does_bucket_exist(basedir):
-            if self.does_file_exist(basedir=basedir, path=path):
-                try:
-                    self.s3.delete_object(Bucket=basedir, Key=path)
-                    return True
-                except ClientError as e:
-                    print(f"Error deleting file")
-                    print(e)
-            else:
-                try :
-                    response = self.s3.list_objects_v2(Bucket=basedir, Prefix=path)
-                    if not (response is None) and ('Contents' in response.keys()):
-                        for object in response['Contents']:
-                            self.s3.delete_object(Bucket=basedir, Key=object['Key'])
-                    return True
-                except ClientError as e:
-                    print(f"Error fetching path with prefix")
-                    print(e)
-        else:
-            print(f"Bucket {basedir} does not exist")
+        """
+        Deletes the file at path or, if there is none, every file whose path starts with it. Keys are listed in
+        order, so the first page of the listing tells whether path is a file without probing it first.
+        """
+        pages = self.__get_filepath_pages(basedir, path)
+        try:
+            first_page = next(pages, None)
+            if first_page is None:
+                return True
+            if first_page[0] == path:
+                return self.__delete_batch(basedir, [path])
+
+            def get_pages() -> Iterator[List[str]]:
+                yield first_page
+                yield from pages
+
+            return self.__delete_pages(basedir, get_pages())
+        except ClientError as e:
+            print(f"Error fetching path with prefix")
+            print(e)
         return False
 
+    def iterate_filepaths(self, basedir:str, path:str, *args, **kwargs) -> Iterator[str]:
+        """
+        Yields every path starting with path, listing them one page at a time as they are consumed.
+        """
+        try:
+            for page in self.__get_filepath_pages(basedir, path):
+                yield from page
+        except ClientError as e:
+            print(f"Error fetching path with prefix")
+            print(e)
 
     def get_all_filepaths(self, basedir:str, path:str, *args, **kwargs)->List[str]:
-        result = []
-        if self.does_bucket_exist(basedir):
-            try:
-                response = self.s3.list_objects_v2(Bucket=basedir, Prefix=path)
-                if not (response is None) and ('Contents' in response.keys()):
-                    for object in response['Contents']:
-                        result.append(object['Key'])
-            except ClientError as e:
-                print(f"Error fetching path with prefix")
-                print(e)
-        else:
-            print(f"Bucket {basedir} does not exist")
-        return result
+        return list(self.iterate_filepaths(basedir, path))
 
     def copy_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
                   overwrite: bool = True, *args, **kwargs) -> bool:
-        if self.does_bucket_exist(source_basedir) and self.does_bucket_exist(destination_basedir) \
-                and self.does_file_exist(basedir=source_basedir, path=source_path):
-
-            if not overwrite and self.does_file_exist(basedir=destination_basedir, path=destination_path):
-                print(f"Cannot copy to destination path as a destination file {destination_path} already exists")
-                return False
-            try:
-                self.s3.copy(CopySource={'Bucket': source_basedir, 'Key': source_path},
-                             Bucket=destination_basedir, Key=destination_path)
-                return True
-            except ClientError as e:
-                print(f"Error deleting file")
-                print(e)
-        else:
+        if not overwrite and self.does_file_exist(basedir=destination_basedir, path=destination_path):
+            print(f"Cannot copy to destination path as a destination file {destination_path} already exists")
+            return False
+        try:
+            # A missing source bucket or file makes the copy itself fail, so they are not probed up front
+            self.s3.copy(CopySource={'Bucket': source_basedir, 'Key': source_path},
+                         Bucket=destination_basedir, Key=destination_path)
+            return True
+        except ClientError as e:
             print(
-                f"Bucket {source_basedir} or {destination_basedir} does not exist or the file {source_path} does not exist")
+                f"Error copying file {source_basedir}/{source_path} to {destination_basedir}/{destination_path}")
+            print(e)
         return False
 
     def move_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
@@ -0,0 +1,105 @@
+import mimetypes
+from typing import List, Union
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers, StopUpload
+
+from ..dedupe import get_content_hasher, save_content_hash
+from .s3 import S3
+
+
+class S3UploadedFile(UploadedFile):
+    """
+    A file of a multipart request that has already been stored in S3. It has no local content, only the location
+    of the stored object.
+    """
+
+    def __init__(self, bucket:str, path:str, name:str, content_type:str, size:int, charset:str=None,
+                 content_type_extra:dict=None):
+        super().__init__(file=None, name=name, content_type=content_type, size=size, charset=charset,
+                         content_type_extra=content_type_extra)
+        self.bucket = bucket
+        self.path = path
+
+
+class S3MultipartUploadHandler(FileUploadHandler):
+    """
+    Pipes the files of a multipart request into S3 multipart uploads while the request body is being read. At most
+    part_size bytes per file are held in memory and nothing is written to local disk. Files are stored at
+    {path_prefix}/{filename}. The content hash of each file is computed on the way and saved next to it, so that the
+    transcoder can recognize videos it has already transcoded without reading them again.
+    """
+
+    def __init__(self, request=None, bucket:str=None, path_prefix:str="", part_size:int=8 * 1024 * 1024,
+                 allowed_extensions:List[str]=None):
+        super().__init__(request)
+        self.bucket = bucket
+        self.path_prefix = path_prefix
+        self.part_size = max(part_size, S3.MIN_PART_SIZE)
+        self.allowed_extensions = allowed_extensions
+        self.storage = S3()
+        self.path = None
+        self.upload_id = None
+        self.parts = []
+        self.buffer = bytearray()
+        self.content_hash = None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if not (self.allowed_extensions is None) and \
+                not file_name.split(".")[-1].lower() in self.allowed_extensions:
+            raise SkipFile()
+
+        if not self.storage.does_bucket_exist(self.bucket):
+            self.storage.create_bucket(self.bucket)
+        self.path = f"{self.path_prefix}/{file_name}"
+        self.content_type = mimetypes.guess_type(file_name)[0] or content_type
+        self.upload_id = self.storage.create_multipart_upload(basedir=self.bucket, path=self.path,
+                                                              content_type=self.content_type)
+        if self.upload_id is None:
+            raise StopUpload(connection_reset=True)
+        self.parts = []
+        self.buffer = bytearray()
+        self.content_hash = get_content_hasher()
+        # The file is consumed here, the default handlers must not buffer it in memory or on disk as well
+        raise StopFutureHandlers()
+
+    def __upload_buffer(self):
+        part_number = len(self.parts) + 1
+        etag = self.storage.upload_part(basedir=self.bucket, path=self.path, upload_id=self.upload_id,
+                                        part_number=part_number, data=bytes(self.buffer))
+        if etag is None:
+            self.storage.abort_multipart_upload(basedir=self.bucket, path=self.path, upload_id=self.upload_id)
+            self.upload_id = None
+            raise StopUpload(connection_reset=True)
+        self.parts.append({"PartNumber": part_number, "ETag": etag})
+        self.buffer = bytearray()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.buffer += raw_data
+        self.content_hash.update(raw_data)
+        if len(self.buffer) >= self.part_size:
+            self.__upload_buffer()
+        return None
+
+    def file_complete(self, file_size) -> Union[S3UploadedFile, None]:
+        if self.upload_id is None:
+            return None
+        # The last part may be smaller than the minimum part size. A file always has at least one part
+        if len(self.buffer) > 0 or len(self.parts) == 0:
+            self.__upload_buffer()
+        if not self.storage.complete_multipart_upload(basedir=self.bucket, path=self.path, upload_id=self.upload_id,
+                                                      parts=self.parts):
+            self.storage.abort_multipart_upload(basedir=self.bucket, path=self.path, upload_id=self.upload_id)
+            self.upload_id = None
+            return None
+        self.upload_id = None
+        save_content_hash(self.storage, basedir=self.bucket, path=self.path, content_hash=self.content_hash.hexdigest())
+        return S3UploadedFile(bucket=self.bucket, path=self.path, name=self.file_name,
+                              content_type=self.content_type, size=file_size, charset=self.charset,
+                              content_type_extra=self.content_type_extra)
+
+    def upload_interrupted(self):
+        if not (self.upload_id is None):
+            self.storage.abort_multipart_upload(basedir=self.bucket, path=self.path, upload_id=self.upload_id)
+            self.upload_id = None
@@ -0,0 +1,42 @@
+from django.conf import settings
+
+from .storageInterface import IStorageInterface, IAsyncStorageInterface
+
+
+STORAGE_BACKEND_S3 = "s3"
+STORAGE_BACKEND_LOCAL = "local"
+STORAGE_BACKENDS = [STORAGE_BACKEND_S3, STORAGE_BACKEND_LOCAL]
+
+
+def get_storage_backend_name() -> str:
+    return settings.STORAGE_BACKEND.get("NAME", STORAGE_BACKEND_S3)
+
+
+def is_s3_storage() -> bool:
+    # Presigned urls, multipart and resumable uploads and chunked transcoding exist only for S3
+    return get_storage_backend_name() == STORAGE_BACKEND_S3
+
+
+def get_storage(name:str=None) -> IStorageInterface:
+    """
+    The storage selected by settings.STORAGE_BACKEND, or the one called name.
+    """
+    name = name or get_storage_backend_name()
+    if name == STORAGE_BACKEND_LOCAL:
+        from .local.local import LocalStorage
+        return LocalStorage()
+    if name == STORAGE_BACKEND_S3:
+        from .s3.s3 import S3
+        return S3()
+    raise ValueError(f"Unknown storage backend {name}")
+
+
+def get_async_storage(name:str=None) -> IAsyncStorageInterface:
+    name = name or get_storage_backend_name()
+    if name == STORAGE_BACKEND_LOCAL:
+        from .local.asynclocal import AsyncLocalStorage
+        return AsyncLocalStorage()
+    if name == STORAGE_BACKEND_S3:
+        from .s3.asyncs3 import AsyncS3
+        return AsyncS3()
+    raise ValueError(f"Unknown storage backend {name}")
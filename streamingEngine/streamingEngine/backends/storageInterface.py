@@ -1,6 +1,6 @@
 import abc
-from typing import IO, Any, List
-from .file import File
+from typing import IO, Any, Iterable, Iterator, List
+from .file import File, StreamingFile
 from typing import Union
 
 
@@ -18,12 +18,24 @@ class IStorageInterface(abc.ABC):
             hasattr(subclass, 'get_file') and
             callable(subclass.get_file) and
 
+            hasattr(subclass, 'get_file_stream') and
+            callable(subclass.get_file_stream) and
+
+            hasattr(subclass, 'download_file') and
+            callable(subclass.download_file) and
+
             hasattr(subclass, 'get_all_filepaths') and
             callable(subclass.get_all_filepaths) and
 
+            hasattr(subclass, 'iterate_filepaths') and
+            callable(subclass.iterate_filepaths) and
+
             hasattr(subclass, 'delete_file') and
             callable(subclass.delete_file) and
 
+            hasattr(subclass, 'delete_files') and
+            callable(subclass.delete_files) and
+
             hasattr(subclass, 'copy_file') and
             callable(subclass.copy_file) and
 
@@ -46,14 +58,37 @@ class IStorageInterface(abc.ABC):
     def get_file(cls, basedir: str, path: str, *args, **kwargs) ->File:
         raise NotImplementedError
 
+    @classmethod
+    def get_file_stream(cls, basedir: str, path: str, byte_range: str = None, if_none_match: str = None,
+                        *args, **kwargs) -> StreamingFile:
+        raise NotImplementedError
+
+    @classmethod
+    def download_file(cls, basedir: str, path: str, destination_filepath: str, *args, **kwargs) -> bool:
+        raise NotImplementedError
+
     @classmethod
     def get_all_filepaths(self, basedir:str, path:str, *args, **kwargs)->List[str]:
         raise NotImplementedError
 
+    @classmethod
+    def iterate_filepaths(cls, basedir:str, path:str, *args, **kwargs) -> Iterator[str]:
+        """
+        get_all_filepaths as a generator, so that large trees are listed page by page as they are consumed.
+        """
+        raise NotImplementedError
+
     @classmethod
     def delete_file(cls, basedir: str, path: str, *args, **kwargs) -> bool:
         raise NotImplementedError
 
+    @classmethod
+    def delete_files(cls, basedir: str, paths: Iterable[str], *args, **kwargs) -> bool:
+        """
+        Deletes many files in as few requests as the storage allows. Missing files are ignored.
+        """
+        raise NotImplementedError
+
     @classmethod
     def copy_file(cls, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
                   overwrite: bool, *args, **kwargs) -> bool:
@@ -64,3 +99,37 @@ class IStorageInterface(abc.ABC):
                   overwrite: bool, *args, **kwargs) -> bool:
         raise NotImplementedError
 
+
+class IAsyncStorageInterface(abc.ABC):
+    """
+    Asyncio counterpart of IStorageInterface for views served by the ASGI application. Streams returned by
+    get_file_stream expose achunks() instead of chunks().
+    """
+
+    async def does_file_exist(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        raise NotImplementedError
+
+    async def upload_file(self, basedir: str, data: Union[IO[Any], str], path: str, content_type: str,
+                          *args, **kwargs) -> bool:
+        raise NotImplementedError
+
+    async def get_file(self, basedir: str, path: str, *args, **kwargs) -> File:
+        raise NotImplementedError
+
+    async def get_file_stream(self, basedir: str, path: str, byte_range: str = None, if_none_match: str = None,
+                              *args, **kwargs) -> StreamingFile:
+        raise NotImplementedError
+
+    async def get_all_filepaths(self, basedir: str, path: str, *args, **kwargs) -> List[str]:
+        raise NotImplementedError
+
+    async def delete_file(self, basedir: str, path: str, *args, **kwargs) -> bool:
+        raise NotImplementedError
+
+    async def copy_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                        overwrite: bool, *args, **kwargs) -> bool:
+        raise NotImplementedError
+
+    async def move_file(self, source_basedir: str, source_path: str, destination_basedir, destination_path: str,
+                        overwrite: bool, *args, **kwargs) -> bool:
+        raise NotImplementedError
@@ -0,0 +1,336 @@
+import atexit, contextvars, json, os, random, re, secrets, threading, time
+from typing import Any, Dict, List, Union
+
+from django.conf import settings
+
+
+# Span kinds, numbered as in OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_PRODUCER = 4
+SPAN_KIND_CONSUMER = 5
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# W3C trace context: version-trace id-parent span id-flags
+TRACEPARENT_HEADER = "traceparent"
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class SpanContext(object):
+    def __init__(self, trace_id:str, span_id:str, sampled:bool=True, remote:bool=False):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+        self.remote = remote
+
+    def to_traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @staticmethod
+    def from_traceparent(value:str) -> Union["SpanContext", None]:
+        match = TRACEPARENT_PATTERN.match((value or "").strip().lower())
+        if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+            return None
+        return SpanContext(trace_id=match.group(1), span_id=match.group(2), sampled=int(match.group(3), 16) & 1 == 1,
+                           remote=True)
+
+
+_current_span: "contextvars.ContextVar[Union[Span, None]]" = contextvars.ContextVar("current_span", default=None)
+
+
+class Span(object):
+    """
+    A timed operation of a trace. Spans are only exported if their trace is sampled; unsampled spans still carry
+    their context so that the decision is kept by every process the trace goes through. Use start_span to create one.
+    """
+
+    def __init__(self, name:str, context:SpanContext, parent:Union[SpanContext, None], kind:int,
+                 attributes:Dict[str, Any]=None, start_time:float=None):
+        self.name = name
+        self.context = context
+        self.parent = parent
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_time = start_time if not (start_time is None) else time.time()
+        self.end_time = None
+        self.status = STATUS_UNSET
+        self.status_message = None
+        self.token = None
+
+    def set_attribute(self, name:str, value:Any):
+        self.attributes[name] = value
+
+    def set_error(self, message:str):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def end(self, end_time:float=None):
+        if not (self.end_time is None):
+            return
+        self.end_time = end_time if not (end_time is None) else time.time()
+        if self.context.sampled:
+            processor = get_span_processor()
+            if not (processor is None):
+                processor.add(self)
+
+    def activate(self) -> "Span":
+        # Makes the span the parent of the spans started after it in this thread or task
+        self.token = _current_span.set(self)
+        return self
+
+    def deactivate(self):
+        if not (self.token is None):
+            _current_span.reset(self.token)
+            self.token = None
+
+    def __enter__(self) -> "Span":
+        return self.activate()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not (exc_value is None):
+            self.set_error(f"{exc_type.__name__}: {exc_value}")
+        self.deactivate()
+        self.end()
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(int(self.start_time * 1e9)),
+            "endTimeUnixNano": str(int((self.end_time or self.start_time) * 1e9)),
+            "attributes": to_otlp_attributes(self.attributes),
+            "status": {"code": self.status}
+        }
+        if not (self.parent is None):
+            span["parentSpanId"] = self.parent.span_id
+        if not (self.status_message is None):
+            span["status"]["message"] = self.status_message
+        return span
+
+
+def to_otlp_value(value:Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp_attributes(attributes:Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": to_otlp_value(value)} for key, value in attributes.items() if not (value is None)]
+
+
+def is_tracing_enabled() -> bool:
+    return settings.TRACING.get("ENABLED", False)
+
+
+def get_current_span() -> Union[Span, None]:
+    return _current_span.get()
+
+
+def start_span(name:str, kind:int=SPAN_KIND_INTERNAL, attributes:Dict[str, Any]=None,
+               parent:Union[SpanContext, None]=None, start_time:float=None) -> Span:
+    """
+    Starts a span, by default a child of the current span. Use it as a context manager to make it current and end
+    it, or call end() to end it without making it current. A span without parent starts a trace, which is sampled
+    with settings.TRACING["SAMPLE_RATIO"].
+    """
+    if parent is None:
+        current = get_current_span()
+        parent = current.context if not (current is None) else None
+    if parent is None:
+        sampled = is_tracing_enabled() and random.random() < settings.TRACING.get("SAMPLE_RATIO", 1.0)
+        context = SpanContext(trace_id=secrets.token_hex(16), span_id=secrets.token_hex(8), sampled=sampled)
+    else:
+        context = SpanContext(trace_id=parent.trace_id, span_id=secrets.token_hex(8),
+                              sampled=parent.sampled and is_tracing_enabled())
+    return Span(name=name, context=context, parent=parent, kind=kind, attributes=attributes, start_time=start_time)
+
+
+def inject(headers:Dict[str, Any], span:Span=None):
+    """
+    Adds the context of span (the current span by default) to headers, e.g. of a celery message.
+    """
+    span = span if not (span is None) else get_current_span()
+    if not (span is None):
+        headers[TRACEPARENT_HEADER] = span.context.to_traceparent()
+
+
+def extract(headers:Dict[str, Any]) -> Union[SpanContext, None]:
+    return SpanContext.from_traceparent(headers.get(TRACEPARENT_HEADER)) if not (headers is None) else None
+
+
+class SpanProcessor(object):
+    """
+    Exports ended spans in batches from a background thread, as OTLP JSON: appended as one line per batch to a file
+    (readable by the OpenTelemetry collector's otlpjsonfile receiver) or posted to an OTLP/HTTP endpoint. Export
+    failures are logged and the batch dropped.
+    """
+
+    def __init__(self, service_name:str, exporter:str, filepath:str=None, endpoint:str=None, batch_size:int=512,
+                 flush_interval:float=5.0):
+        self.service_name = service_name
+        self.exporter = exporter
+        self.filepath = filepath
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.export_lock = threading.Lock()
+        self.spans: List[Span] = []
+        self.flush_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, span:Span):
+        with self.lock:
+            self.spans.append(span)
+            full = len(self.spans) >= self.batch_size
+        if full:
+            self.flush_event.set()
+
+    def run(self):
+        while True:
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            self.flush()
+
+    def get_payload(self, spans:List[Span]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": to_otlp_attributes({"service.name": self.service_name,
+                                                           "process.pid": os.getpid()})},
+            "scopeSpans": [{"scope": {"name": "streamingEngine"}, "spans": [span.to_otlp() for span in spans]}]
+        }]}
+
+    def flush(self):
+        with self.lock:
+            spans, self.spans = self.spans, []
+        if len(spans) == 0:
+            return
+        try:
+            payload = json.dumps(self.get_payload(spans))
+            with self.export_lock:
+                if self.exporter == "otlp":
+                    import requests
+                    response = requests.post(self.endpoint, data=payload,
+                                             headers={"Content-Type": "application/json"}, timeout=5)
+                    response.raise_for_status()
+                else:
+                    with open(self.filepath, "a") as f:
+                        f.write(payload + "\n")
+        except Exception as e:
+            print(f"Error exporting {len(spans)} spans")
+            print(e)
+
+
+_span_processors: Dict[int, SpanProcessor] = {}
+_span_processors_lock = threading.Lock()
+
+
+def get_span_processor() -> Union[SpanProcessor, None]:
+    """
+    The span processor of this process. Forked celery workers do not inherit the thread of their parent's
+    processor, so every process has its own.
+    """
+    if not is_tracing_enabled():
+        return None
+    pid = os.getpid()
+    processor = _span_processors.get(pid)
+    if processor is None:
+        with _span_processors_lock:
+            processor = _span_processors.get(pid)
+            if processor is None:
+                tracing_settings = settings.TRACING
+                processor = SpanProcessor(service_name=tracing_settings.get("SERVICE_NAME", "streamingEngine"),
+                                          exporter=tracing_settings.get("EXPORTER", "file"),
+                                          filepath=tracing_settings.get("FILE"),
+                                          endpoint=tracing_settings.get("OTLP_ENDPOINT"),
+                                          batch_size=tracing_settings.get("BATCH_SIZE", 512),
+                                          flush_interval=tracing_settings.get("FLUSH_INTERVAL", 5.0))
+                _span_processors.clear()
+                _span_processors[pid] = processor
+    return processor
+
+
+def flush_spans(**kwargs):
+    processor = _span_processors.get(os.getpid())
+    if not (processor is None):
+        processor.flush()
+
+
+atexit.register(flush_spans)
+
+
+# Spans of the celery messages being published and of the tasks being run by this process, by task id
+_task_spans: Dict[str, Span] = {}
+_task_spans_lock = threading.Lock()
+
+
+def get_task_header(request:Any, name:str) -> Any:
+    return getattr(request, name, None) or (getattr(request, "headers", None) or {}).get(name)
+
+
+def trace_task_published(sender:str=None, headers:dict=None, routing_key:str=None, **kwargs):
+    """
+    Records the publishing of a task as a producer span of the current trace and passes its context to the worker
+    in the headers of the message.
+    """
+    if headers is None or not is_tracing_enabled():
+        return
+    span = start_span(f"{sender} publish", kind=SPAN_KIND_PRODUCER, attributes={
+        "messaging.system": "celery", "messaging.destination.name": routing_key, "celery.task_id": headers.get("id")
+    })
+    inject(headers, span)
+    with _task_spans_lock:
+        _task_spans[f"publish:{headers.get('id')}"] = span
+
+
+def trace_task_sent(headers:dict=None, **kwargs):
+    with _task_spans_lock:
+        span = _task_spans.pop(f"publish:{(headers or {}).get('id')}", None)
+    if not (span is None):
+        span.end()
+
+
+def trace_task_started(task_id:str=None, task:Any=None, **kwargs):
+    """
+    Starts the consumer span of a task, a child of the span that published it, and makes it current for the run of
+    the task. The time the message waited in its queue is recorded as a span of its own.
+    """
+    if not is_tracing_enabled():
+        return
+    from .metrics import ENQUEUED_AT_HEADER
+    request = getattr(task, "request", None)
+    parent = SpanContext.from_traceparent(get_task_header(request, TRACEPARENT_HEADER))
+    queue = (getattr(request, "delivery_info", None) or {}).get("routing_key")
+    enqueued_at = get_task_header(request, ENQUEUED_AT_HEADER)
+    if not (parent is None) and not (enqueued_at is None):
+        start_span(f"{task.name} queue", parent=parent, start_time=float(enqueued_at),
+                   attributes={"messaging.destination.name": queue}).end()
+    span = start_span(task.name, kind=SPAN_KIND_CONSUMER, parent=parent, attributes={
+        "messaging.system": "celery", "messaging.destination.name": queue, "celery.task_id": task_id,
+        "celery.retries": getattr(request, "retries", None)
+    })
+    span.activate()
+    with _task_spans_lock:
+        _task_spans[task_id] = span
+
+
+def trace_task_finished(task_id:str=None, state:str=None, **kwargs):
+    with _task_spans_lock:
+        span = _task_spans.pop(task_id, None)
+    if span is None:
+        return
+    span.set_attribute("celery.state", state)
+    if state == "FAILURE":
+        span.set_error(state)
+    span.deactivate()
+    span.end()
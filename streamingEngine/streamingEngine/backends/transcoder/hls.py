@@ -0,0 +1,364 @@
+import math, os, re, subprocess, tempfile
+from typing import Callable, Dict, List, Tuple, Union
+
+import ffmpeg
+
+from .profiles import EncodingProfile, DEFAULT_SEGMENT_DURATION
+
+
+# Codec names accepted by Transcoder mapped to the ffmpeg encoders that implement them
+VIDEO_ENCODERS = {"h264": "libx264"}
+AUDIO_ENCODERS = {"aac": "aac"}
+
+# Encoder options used by ffmpeg_streaming for h264 so that every execution mode produces the same output
+H264_OPTIONS = {"bf": 1, "keyint_min": 25, "g": 250, "sc_threshold": 40}
+
+# HLS segment containers. fmp4 segments are CMAF, i.e. they can also be referenced from a DASH manifest
+SEGMENT_TYPE_MPEGTS = "mpegts"
+SEGMENT_TYPE_FMP4 = "fmp4"
+SEGMENT_EXTENSIONS = {SEGMENT_TYPE_MPEGTS: "ts", SEGMENT_TYPE_FMP4: "m4s"}
+
+# Variant playlists are named <master name>_<height>p.m3u8 (as by ffmpeg_streaming), <master name>_audio_<bitrate>k.m3u8
+# or, next to a DASH manifest, media_<stream>.m3u8 (as by ffmpeg's dash muxer)
+VARIANT_PLAYLIST_PATTERN = re.compile(r"(_(\d+p|audio_\d+k)|(^|/)media_\d+)\.m3u8$")
+
+
+class Rendition(object):
+    """
+    A TranscoderConfiguration resolved against the source video, i.e. with its final output size.
+    """
+
+    def __init__(self, width:int, height:int, video_bitrate:int, audio_bitrate:int):
+        self.width = width
+        self.height = height
+        self.video_bitrate = video_bitrate
+        self.audio_bitrate = audio_bitrate
+
+    @property
+    def bandwidth(self) -> int:
+        return self.video_bitrate + self.audio_bitrate
+
+    def get_playlist_filename(self, manifest_stem:str) -> str:
+        return f"{manifest_stem}_{self.height}p.m3u8"
+
+    def get_segment_filename(self, manifest_stem:str, prefix:str="", segment_type:str=SEGMENT_TYPE_MPEGTS) -> str:
+        return f"{manifest_stem}_{self.height}p_{prefix}%04d.{SEGMENT_EXTENSIONS[segment_type]}"
+
+    def get_init_filename(self, manifest_stem:str, prefix:str="") -> str:
+        # Initialization segment of fmp4 output, named as by ffmpeg_streaming
+        return f"{manifest_stem}_{self.height}p_{prefix}init.mp4"
+
+    def to_dict(self) -> Dict[str, int]:
+        return {"width": self.width, "height": self.height, "video_bitrate": self.video_bitrate,
+                "audio_bitrate": self.audio_bitrate}
+
+    @staticmethod
+    def from_dict(data:Dict[str, int]) -> "Rendition":
+        return Rendition(width=data["width"], height=data["height"], video_bitrate=data["video_bitrate"],
+                         audio_bitrate=data["audio_bitrate"])
+
+
+class AudioRendition(object):
+    """
+    An audio only rendition encoded once and shared by every video rendition that refers to its group in the master
+    playlist. The video renditions then carry no audio.
+    """
+
+    def __init__(self, bitrate:int):
+        self.bitrate = bitrate
+
+    @property
+    def group_id(self) -> str:
+        return f"audio_{round(self.bitrate / 1024)}k"
+
+    def get_playlist_filename(self, manifest_stem:str) -> str:
+        return f"{manifest_stem}_{self.group_id}.m3u8"
+
+    def get_segment_filename(self, manifest_stem:str, prefix:str="", segment_type:str=SEGMENT_TYPE_MPEGTS) -> str:
+        return f"{manifest_stem}_{self.group_id}_{prefix}%04d.{SEGMENT_EXTENSIONS[segment_type]}"
+
+    def get_init_filename(self, manifest_stem:str, prefix:str="") -> str:
+        return f"{manifest_stem}_{self.group_id}_{prefix}init.mp4"
+
+    def to_dict(self) -> Dict[str, int]:
+        return {"bitrate": self.bitrate}
+
+    @staticmethod
+    def from_dict(data:Dict[str, int]) -> "AudioRendition":
+        return AudioRendition(bitrate=data["bitrate"])
+
+
+def get_even(value:float) -> int:
+    # Most encoders (libx264 included) reject odd frame dimensions
+    return max(2, int(round(value / 2)) * 2)
+
+
+def get_renditions(configurations:list, source_width:int, source_height:int) -> List[Rendition]:
+    return [
+        Rendition(
+            width=get_even(config.width),
+            height=config.height if config.height > 0 else get_even(source_height * config.width / source_width),
+            video_bitrate=config.video_bitrate,
+            audio_bitrate=config.audio_bitrate
+        ) for config in configurations
+    ]
+
+
+def select_audio_rendition(audio_bitrate:int, audio_renditions:List[AudioRendition]) -> AudioRendition:
+    # The best audio that does not exceed what the video rendition was configured with, or the smallest one
+    fitting = [audio for audio in audio_renditions if audio.bitrate <= audio_bitrate]
+    if len(fitting) > 0:
+        return max(fitting, key=lambda audio: audio.bitrate)
+    return min(audio_renditions, key=lambda audio: audio.bitrate)
+
+
+def get_audio_renditions(renditions:List[Rendition], bitrates:List[int],
+                         source_bitrate:int=None) -> List[AudioRendition]:
+    """
+    Returns the shared audio renditions that the given video renditions use, out of one per bitrate. Bitrates are
+    capped at that of the source.
+    """
+    bitrates = sorted(set(min(bitrate, source_bitrate) if not (source_bitrate is None) else bitrate
+                          for bitrate in bitrates))
+    candidates = [AudioRendition(bitrate=bitrate) for bitrate in bitrates]
+    if len(candidates) == 0:
+        return []
+    used = set(select_audio_rendition(rendition.audio_bitrate, candidates).bitrate for rendition in renditions)
+    return [audio for audio in candidates if audio.bitrate in used]
+
+
+def is_variant_playlist(filepath:str) -> bool:
+    return not (VARIANT_PLAYLIST_PATTERN.search(filepath) is None)
+
+
+def get_bitrate_argument(bitrate:int) -> str:
+    # Same conversion as ffmpeg_streaming
+    return f"{round(bitrate / 1024)}k"
+
+
+def get_option_arguments(options:dict) -> List[str]:
+    arguments = []
+    for key, value in options.items():
+        arguments += [f"-{key}", str(value)]
+    return arguments
+
+
+def write_key_info_file(key_info_filepath:str, key_url:str, key_filepath:str, iv:str):
+    """
+    Writes the key info file consumed by ffmpeg's hls_key_info_file option. An explicit IV is required whenever the
+    segments of one playlist are produced by more than one ffmpeg process, since ffmpeg otherwise derives the IV from
+    a media sequence number that is only valid within its own process.
+    """
+    with open(key_info_filepath, "w") as f:
+        f.write("\n".join([key_url, key_filepath, iv]))
+
+
+def build_hls_command(input_filepath:str, renditions:List[Rendition], output_dir:str, manifest_stem:str,
+                      segment_duration:int=DEFAULT_SEGMENT_DURATION, key_info_filepath:str=None,
+                      start:float=None, end:float=None, segment_prefix:str="", video_codec:str="h264",
+                      audio_codec:str="aac", ffmpeg_bin:str="ffmpeg", hls_options:dict=None,
+                      encoding_profile:EncodingProfile=None, fps:float=None, threads:int=None,
+                      audio_renditions:List[AudioRendition]=None,
+                      segment_type:str=SEGMENT_TYPE_MPEGTS) -> List[str]:
+    """
+    Builds one ffmpeg invocation that decodes the input once and encodes it into an HLS output per rendition.
+    start and end (in seconds) restrict the transcode to a section of the input; the output timestamps are then
+    offset by start so that sections can be concatenated into a single playlist without discontinuities.
+    hls_options are passed to every output as -key value and take precedence over the defaults. encoding_profile
+    sets the encoder options (see EncodingProfile.get_video_options for fps and threads); its segment duration
+    replaces segment_duration. When audio_renditions is given (even empty) the renditions are video only and the
+    audio is encoded into one additional HLS output per audio rendition. segment_type is SEGMENT_TYPE_MPEGTS or
+    SEGMENT_TYPE_FMP4.
+    """
+    video_encoder = VIDEO_ENCODERS.get(video_codec, video_codec)
+    video_options = dict(H264_OPTIONS) if video_encoder == "libx264" else {}
+    if not (encoding_profile is None):
+        video_options.update(encoding_profile.get_video_options(video_encoder, fps=fps, threads=threads))
+        segment_duration = encoding_profile.segment_duration
+    command = [ffmpeg_bin, "-y"]
+    if not (start is None) and start > 0:
+        command += ["-ss", str(start)]
+    if not (end is None):
+        command += ["-t", str(end - (start or 0))]
+    command += ["-i", input_filepath]
+
+    def get_output_arguments(variant:Union[Rendition, AudioRendition]) -> List[str]:
+        arguments = []
+        if not (start is None) and start > 0:
+            arguments += ["-output_ts_offset", str(start)]
+        segment_filename = variant.get_segment_filename(manifest_stem, prefix=segment_prefix, segment_type=segment_type)
+        arguments += ["-f", "hls", "-hls_time", str(segment_duration), "-hls_list_size", "0",
+                      "-hls_playlist_type", "vod", "-hls_segment_filename", os.path.join(output_dir, segment_filename)]
+        if segment_type == SEGMENT_TYPE_FMP4:
+            # Relative to the playlist
+            arguments += ["-hls_segment_type", "fmp4",
+                          "-hls_fmp4_init_filename", variant.get_init_filename(manifest_stem, prefix=segment_prefix)]
+        if not (key_info_filepath is None):
+            arguments += ["-hls_key_info_file", key_info_filepath]
+        arguments += get_option_arguments(hls_options or {})
+        return arguments + ["-strict", "-2", os.path.join(output_dir, variant.get_playlist_filename(manifest_stem))]
+
+    audio_encoder = AUDIO_ENCODERS.get(audio_codec, audio_codec)
+    for rendition in renditions:
+        if audio_renditions is None:
+            command += ["-map", "0:v:0", "-map", "0:a:0?", "-c:v", video_encoder, "-c:a", audio_encoder]
+        else:
+            command += ["-map", "0:v:0", "-an", "-c:v", video_encoder]
+        command += get_option_arguments(video_options)
+        command += ["-s:v", f"{rendition.width}x{rendition.height}",
+                    "-b:v", get_bitrate_argument(rendition.video_bitrate)]
+        if audio_renditions is None:
+            command += ["-b:a", get_bitrate_argument(rendition.audio_bitrate)]
+        if not (encoding_profile is None):
+            command += get_option_arguments({key: get_bitrate_argument(value) for key, value
+                                             in encoding_profile.get_rate_control(rendition.video_bitrate).items()})
+        command += get_output_arguments(rendition)
+    for audio in audio_renditions or []:
+        command += ["-map", "0:a:0", "-vn", "-c:a", audio_encoder, "-b:a", get_bitrate_argument(audio.bitrate)]
+        command += get_output_arguments(audio)
+    return command
+
+
+def run_ffmpeg(command:List[str], progress:Callable[[float], None]=None) -> bool:
+    """
+    progress is called with the position, in seconds of output, that ffmpeg reached.
+    """
+    if not (progress is None):
+        # key=value reports on stdout, -nostats keeps the usual ones off stderr
+        command = command[:1] + ["-progress", "pipe:1", "-nostats"] + command[1:]
+    print(f"Running {' '.join(command)}")
+    # stderr goes to a file so that it cannot fill up while stdout is read
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE if not (progress is None) else subprocess.DEVNULL,
+                                   stderr=stderr)
+        if not (progress is None):
+            for line in process.stdout:
+                name, _, value = line.decode(errors="replace").strip().partition("=")
+                if name == "out_time_us" and value.isdigit():
+                    progress(int(value) / 1000000)
+        returncode = process.wait()
+        if returncode != 0:
+            print(f"ffmpeg exited with code {returncode}")
+            stderr.seek(0)
+            print(stderr.read().decode(errors="replace")[-4000:])
+            return False
+    return True
+
+
+def is_complete_playlist(path:str) -> bool:
+    """
+    Whether a media playlist was written to its end, e.g. by a transcode that was interrupted afterwards.
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, "r") as f:
+        return "#EXT-X-ENDLIST" in f.read()
+
+
+def read_media_playlist(path:str) -> List[Tuple[float, str]]:
+    """
+    Returns the (duration, uri) pairs of the segments listed in a media playlist.
+    """
+    segments = []
+    duration = None
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",")[0])
+            elif len(line) > 0 and not line.startswith("#") and not (duration is None):
+                segments.append((duration, line))
+                duration = None
+    return segments
+
+
+def write_media_playlist(path:str, segments:List[Tuple[float, str]], key_url:str=None, iv:str=None):
+    target_duration = math.ceil(max([duration for duration, _ in segments] + [1]))
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{target_duration}", "#EXT-X-MEDIA-SEQUENCE:0",
+             "#EXT-X-PLAYLIST-TYPE:VOD"]
+    if not (key_url is None):
+        key = f'#EXT-X-KEY:METHOD=AES-128,URI="{key_url}"'
+        if not (iv is None):
+            key += f",IV=0x{iv}"
+        lines.append(key)
+    for duration, uri in segments:
+        lines += [f"#EXTINF:{duration:.6f},", uri]
+    lines.append("#EXT-X-ENDLIST")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_master_playlist(path:str, renditions:List[Rendition], manifest_stem:str,
+                          audio_renditions:List[AudioRendition]=None, segment_type:str=SEGMENT_TYPE_MPEGTS):
+    """
+    Same layout as the master playlist generated by ffmpeg_streaming. With audio_renditions every rendition refers to
+    the audio group it uses (see select_audio_rendition) and its bandwidth includes that audio.
+    """
+    # fmp4 segments need version 7, as in ffmpeg_streaming
+    lines = ["#EXTM3U", f"#EXT-X-VERSION:{7 if segment_type == SEGMENT_TYPE_FMP4 else 3}"]
+    audio_groups = {}
+    if not (audio_renditions is None) and len(audio_renditions) > 0:
+        audio_groups = {rendition: select_audio_rendition(rendition.audio_bitrate, audio_renditions)
+                        for rendition in renditions}
+        for audio in sorted(set(audio_groups.values()), key=lambda audio: audio.bitrate):
+            lines.append(f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="{audio.group_id}",NAME="audio",DEFAULT=YES,'
+                         f'AUTOSELECT=YES,URI="{audio.get_playlist_filename(manifest_stem)}"')
+    for rendition in renditions:
+        stream_info = f'#EXT-X-STREAM-INF:BANDWIDTH={rendition.bandwidth},'
+        audio = audio_groups.get(rendition)
+        if not (audio is None):
+            stream_info = f'#EXT-X-STREAM-INF:BANDWIDTH={rendition.video_bitrate + audio.bitrate},'
+        stream_info += f'RESOLUTION={rendition.width}x{rendition.height},NAME="{rendition.height}"'
+        if not (audio is None):
+            stream_info += f',AUDIO="{audio.group_id}"'
+        lines += [stream_info, rendition.get_playlist_filename(manifest_stem)]
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def get_split_points(duration:float, chunk_duration:float) -> List[float]:
+    # Where plan_chunks looks for keyframes: every chunk_duration seconds, except in the last quarter of a chunk
+    return [chunk_duration * index for index in range(1, math.ceil(duration / chunk_duration))
+            if duration - chunk_duration * index >= chunk_duration / 4]
+
+
+def probe_keyframes(input_filepath:str, split_points:List[float], window:float=10.0) -> List[float]:
+    """
+    Returns the presentation times of the keyframes of the first video stream around split_points, read from the
+    packet flags. ffprobe seeks to each point, which lands on the keyframe before it, and demuxes window seconds of
+    packets from there, so only those sections of the source are read instead of the whole video track.
+    """
+    if len(split_points) == 0:
+        return []
+    probe = ffmpeg.probe(input_filepath, select_streams="v:0", show_entries="packet=pts_time,dts_time,flags",
+                         read_intervals=",".join(f"{point}%+{window}" for point in split_points))
+    keyframes = set()
+    for packet in probe.get("packets", []):
+        if not ("K" in packet.get("flags", "")):
+            continue
+        time = packet.get("pts_time", packet.get("dts_time"))
+        if time == "N/A":
+            time = packet.get("dts_time")
+        if not (time is None) and time != "N/A":
+            keyframes.add(float(time))
+    return sorted(keyframes)
+
+
+def plan_chunks(keyframes:List[float], duration:float, chunk_duration:float) -> List[Tuple[float, Union[float, None]]]:
+    """
+    Splits a video into sections of roughly chunk_duration seconds that start on keyframes: every section but the
+    first starts on the first keyframe at or after one of the split points (see get_split_points), so a late keyframe
+    does not push the following sections back. The last section is open ended (its end is None) so that nothing is
+    lost to rounding of the reported duration.
+    """
+    chunks = []
+    start = 0.0
+    split_point = chunk_duration
+    for keyframe in keyframes:
+        if keyframe >= split_point and keyframe > start and duration - keyframe >= chunk_duration / 4:
+            chunks.append((start, keyframe))
+            start = keyframe
+            while split_point <= start:
+                split_point += chunk_duration
+    chunks.append((start, None))
+    return chunks
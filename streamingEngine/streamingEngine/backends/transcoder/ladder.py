@@ -0,0 +1,143 @@
+import os, tempfile
+from typing import Any, Dict, List, Union
+
+from .hls import VIDEO_ENCODERS, get_even, get_renditions, run_ffmpeg
+from .mediainfo import MediaInfo
+from .transcoder import TranscoderConfiguration
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+LADDER_REPORT_FILENAME = "ladder.json"
+
+# A rung must carry at least this many times the bitrate of the rung below it to be worth encoding
+DEFAULT_MIN_BITRATE_STEP = 1.4
+
+# Complexity analysis encodes a sample at a constant quality and compares its bits per pixel to this reference,
+# which is typical of live action footage at the settings below
+COMPLEXITY_SAMPLE_WIDTH = 640
+COMPLEXITY_SAMPLE_CRF = 23
+DEFAULT_REFERENCE_BITS_PER_PIXEL = 0.1
+
+
+def get_source_video_bitrate(media_info:MediaInfo) -> Union[int, None]:
+    if not (media_info.video_bitrate is None):
+        return media_info.video_bitrate
+    # Some containers (e.g. mkv, webm) only report the overall bitrate
+    if not (media_info.bitrate is None):
+        return max(media_info.bitrate - (media_info.audio_bitrate or 0), 0) or None
+    return None
+
+
+def analyze_complexity(input_filepath:str, media_info:MediaInfo, sample_duration:float,
+                       reference_bits_per_pixel:float=DEFAULT_REFERENCE_BITS_PER_PIXEL) -> Union[float, None]:
+    """
+    Estimates how hard a video is to compress by encoding sample_duration seconds from its middle at a constant
+    quality with the fastest preset. Returns the bits per pixel of the sample relative to reference_bits_per_pixel
+    (below 1 for static content such as screencasts, above 1 for high motion footage), or None if the sample could
+    not be encoded.
+    """
+    duration = media_info.duration or 0
+    sample_duration = min(sample_duration, duration) if duration > 0 else sample_duration
+    start = max((duration - sample_duration) / 2, 0)
+    width = min(get_even(COMPLEXITY_SAMPLE_WIDTH), get_even(media_info.display_width))
+    height = get_even(media_info.display_height * width / media_info.display_width)
+    with tempfile.TemporaryDirectory() as directory:
+        sample_filepath = os.path.join(directory, "sample.ts")
+        if not run_ffmpeg([
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-ss", str(start), "-t", str(sample_duration),
+            "-i", input_filepath, "-an", "-vf", f"scale={width}:{height}", "-c:v", VIDEO_ENCODERS["h264"],
+            "-preset", "ultrafast", "-crf", str(COMPLEXITY_SAMPLE_CRF), "-f", "mpegts", sample_filepath
+        ]):
+            return None
+        sample_size = os.path.getsize(sample_filepath)
+    frames = sample_duration * (media_info.fps or 25)
+    if frames <= 0 or sample_size == 0:
+        return None
+    return (sample_size * 8 / (width * height * frames)) / reference_bits_per_pixel
+
+
+def plan_ladder(configurations:List[TranscoderConfiguration], media_info:MediaInfo, complexity:float=None,
+                min_bitrate_step:float=DEFAULT_MIN_BITRATE_STEP, min_complexity:float=0.5,
+                max_complexity:float=1.0) -> List[TranscoderConfiguration]:
+    """
+    Fits a static ladder to one source:
+    - rungs wider than the source are dropped, so nothing is upscaled. A source narrower than every rung gets a
+      single rung at its own width;
+    - video and audio bitrates are capped at those of the source, and scaled by complexity (see analyze_complexity)
+      clamped to [min_complexity, max_complexity];
+    - a rung whose bitrate is less than min_bitrate_step times that of the rung below replaces that rung, as the two
+      would look alike.
+    """
+    source_width = media_info.display_width
+    source_video_bitrate = get_source_video_bitrate(media_info)
+    scale = 1.0
+    if not (complexity is None):
+        scale = min(max(complexity, min_complexity), max_complexity)
+
+    configurations = sorted(configurations, key=lambda config: config.width)
+    fitting = [config for config in configurations if config.width <= source_width]
+    if len(fitting) == 0 and len(configurations) > 0:
+        smallest = configurations[0]
+        fitting = [TranscoderConfiguration(audio_bitrate=smallest.audio_bitrate,
+                                           video_bitrate=int(smallest.video_bitrate * source_width / smallest.width),
+                                           width=get_even(source_width))]
+
+    planned = []
+    for config in fitting:
+        video_bitrate = int(config.video_bitrate * scale)
+        if not (source_video_bitrate is None):
+            video_bitrate = min(video_bitrate, source_video_bitrate)
+        audio_bitrate = config.audio_bitrate
+        if not (media_info.audio_bitrate is None):
+            audio_bitrate = min(audio_bitrate, media_info.audio_bitrate)
+        rung = TranscoderConfiguration(audio_bitrate=audio_bitrate, video_bitrate=video_bitrate, width=config.width,
+                                       height=config.height)
+        if len(planned) > 0 and video_bitrate < planned[-1].video_bitrate * min_bitrate_step:
+            planned[-1] = rung
+        else:
+            planned.append(rung)
+    return planned
+
+
+def get_ladder_report(static:List[TranscoderConfiguration], planned:List[TranscoderConfiguration],
+                      media_info:MediaInfo, complexity:float=None, cpu_seconds:float=None) -> Dict[str, Any]:
+    """
+    Compares a planned ladder with the static one it was derived from. Bytes are estimated from the bitrates and the
+    duration of the source. CPU time scales with the number of pixels encoded, so the static ladder's CPU time is
+    extrapolated from the measured cpu_seconds of the planned ladder, if given.
+    """
+    def describe(configurations:List[TranscoderConfiguration]) -> Dict[str, Any]:
+        renditions = get_renditions(configurations, source_width=media_info.display_width,
+                                    source_height=media_info.display_height)
+        return {
+            "renditions": [rendition.to_dict() for rendition in renditions],
+            "bytes": int(sum(rendition.bandwidth for rendition in renditions) * (media_info.duration or 0) / 8),
+            "pixels": sum(rendition.width * rendition.height for rendition in renditions)
+        }
+
+    static_ladder, planned_ladder = describe(static), describe(planned)
+    report = {
+        "complexity": complexity,
+        "static": static_ladder,
+        "planned": planned_ladder,
+        "bytes_saved": static_ladder["bytes"] - planned_ladder["bytes"],
+        "cpu_seconds": cpu_seconds,
+        "cpu_seconds_saved": None
+    }
+    if not (cpu_seconds is None) and planned_ladder["pixels"] > 0:
+        report["cpu_seconds_saved"] = cpu_seconds * static_ladder["pixels"] / planned_ladder["pixels"] - cpu_seconds
+    return report
+
+
+def get_children_cpu_seconds() -> Union[float, None]:
+    """
+    CPU time used so far by the finished child processes (i.e. ffmpeg) of this process.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
@@ -0,0 +1,192 @@
+import json, os, statistics, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Union
+
+import ffmpeg
+
+
+MEDIA_INFO_FILENAME = "mediainfo.json"
+# Seconds of the source that are demuxed to measure the keyframe interval
+KEYFRAME_PROBE_DURATION = 30
+# Microseconds ffprobe waits for a read from a url (e.g. a presigned S3 url) before it gives up
+PROBE_RW_TIMEOUT = 30 * 1000 * 1000
+MAX_CACHED_MEDIA_INFO = 256
+
+_media_info_cache: "OrderedDict[str, MediaInfo]" = OrderedDict()
+_media_info_cache_lock = threading.Lock()
+
+
+def get_fraction(value:Union[str, None]) -> Union[float, None]:
+    # ffprobe reports frame rates as fractions such as 30000/1001
+    if value is None or value in ("0/0", "N/A", ""):
+        return None
+    numerator, _, denominator = str(value).partition("/")
+    try:
+        return float(numerator) / float(denominator) if len(denominator) > 0 else float(numerator)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def get_int(value:Any) -> Union[int, None]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_float(value:Any) -> Union[float, None]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_rotation(stream:dict) -> int:
+    rotation = stream.get("tags", {}).get("rotate")
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data.keys():
+            rotation = side_data["rotation"]
+    return abs(get_int(rotation) or 0) % 360
+
+
+def get_keyframe_interval(frames:List[dict]) -> Union[float, None]:
+    times = [
+        get_float(frame.get("pts_time", frame.get("best_effort_timestamp_time")))
+        for frame in frames
+        if frame.get("media_type", "video") == "video" and str(frame.get("key_frame", 1)) == "1"
+    ]
+    times = sorted([time for time in times if not (time is None)])
+    if len(times) < 2:
+        return None
+    return statistics.median([b - a for a, b in zip(times, times[1:])])
+
+
+class MediaInfo(object):
+    """
+    What the pipeline needs to know about a source video, extracted from a single ffprobe run.
+    width and height are the stored frame size; display_width and display_height account for rotation, which
+    ffmpeg applies when transcoding.
+    """
+
+    def __init__(self, width:int, height:int, duration:float=None, fps:float=None, rotation:int=0,
+                 video_codec:str=None, video_bitrate:int=None, audio_codec:str=None, audio_channels:int=None,
+                 audio_sample_rate:int=None, audio_bitrate:int=None, bitrate:int=None, size:int=None,
+                 format_name:str=None, keyframe_interval:float=None):
+        self.width = width
+        self.height = height
+        self.duration = duration
+        self.fps = fps
+        self.rotation = rotation
+        self.video_codec = video_codec
+        self.video_bitrate = video_bitrate
+        self.audio_codec = audio_codec
+        self.audio_channels = audio_channels
+        self.audio_sample_rate = audio_sample_rate
+        self.audio_bitrate = audio_bitrate
+        self.bitrate = bitrate
+        self.size = size
+        self.format_name = format_name
+        self.keyframe_interval = keyframe_interval
+
+    @property
+    def display_width(self) -> int:
+        return self.height if self.rotation in (90, 270) else self.width
+
+    @property
+    def display_height(self) -> int:
+        return self.width if self.rotation in (90, 270) else self.height
+
+    @property
+    def has_audio(self) -> bool:
+        return not (self.audio_codec is None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def save(self, path:str):
+        directory = os.path.dirname(path)
+        if len(directory) > 0 and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, "w") as f:
+            f.write(self.to_json())
+
+    @staticmethod
+    def from_dict(data:Dict[str, Any]) -> "MediaInfo":
+        return MediaInfo(**data)
+
+    @staticmethod
+    def from_json(data:Union[str, bytes]) -> "MediaInfo":
+        return MediaInfo.from_dict(json.loads(data))
+
+    @staticmethod
+    def from_probe(probe:dict) -> "MediaInfo":
+        streams = probe.get("streams", [])
+        video = next(stream for stream in streams if stream.get("codec_type") == "video")
+        audio = next((stream for stream in streams if stream.get("codec_type") == "audio"), {})
+        format = probe.get("format", {})
+        return MediaInfo(
+            width=int(video["width"]),
+            height=int(video["height"]),
+            duration=get_float(format.get("duration", video.get("duration"))),
+            fps=get_fraction(video.get("avg_frame_rate")) or get_fraction(video.get("r_frame_rate")),
+            rotation=get_rotation(video),
+            video_codec=video.get("codec_name"),
+            video_bitrate=get_int(video.get("bit_rate")),
+            audio_codec=audio.get("codec_name"),
+            audio_channels=get_int(audio.get("channels")),
+            audio_sample_rate=get_int(audio.get("sample_rate")),
+            audio_bitrate=get_int(audio.get("bit_rate")),
+            bitrate=get_int(format.get("bit_rate")),
+            size=get_int(format.get("size")),
+            format_name=format.get("format_name"),
+            keyframe_interval=get_keyframe_interval(probe.get("frames", []))
+        )
+
+
+def probe_media_info(input_filepath:str) -> MediaInfo:
+    """
+    Runs ffprobe once. Besides the streams and the container it reads the keyframes (and only the keyframes) of the
+    first KEYFRAME_PROBE_DURATION seconds to measure the keyframe interval. Reads from urls time out after
+    PROBE_RW_TIMEOUT.
+    """
+    options = {"rw_timeout": PROBE_RW_TIMEOUT} if "://" in input_filepath else {}
+    probe = ffmpeg.probe(input_filepath, read_intervals=f"%+{KEYFRAME_PROBE_DURATION}", skip_frame="nokey",
+                         show_entries="frame=media_type,key_frame,pts_time,best_effort_timestamp_time", **options)
+    return MediaInfo.from_probe(probe)
+
+
+def get_media_info(input_filepath:str, cache_key:str=None) -> MediaInfo:
+    """
+    Returns the media info of a source, probing it only the first time it is seen by this process. cache_key
+    identifies the source when input_filepath does not, e.g. for presigned urls that change on every call. Local
+    files are keyed by path, size and modification time.
+    """
+    if cache_key is None:
+        cache_key = input_filepath
+        if os.path.isfile(input_filepath):
+            stat = os.stat(input_filepath)
+            cache_key = f"{input_filepath}:{stat.st_size}:{stat.st_mtime_ns}"
+    media_info = get_cached_media_info(cache_key)
+    if media_info is None:
+        media_info = probe_media_info(input_filepath)
+        remember_media_info(cache_key, media_info)
+    return media_info
+
+
+def get_cached_media_info(cache_key:str) -> Union[MediaInfo, None]:
+    with _media_info_cache_lock:
+        media_info = _media_info_cache.get(cache_key)
+        if not (media_info is None):
+            _media_info_cache.move_to_end(cache_key)
+        return media_info
+
+
+def remember_media_info(cache_key:str, media_info:MediaInfo):
+    with _media_info_cache_lock:
+        _media_info_cache[cache_key] = media_info
+        _media_info_cache.move_to_end(cache_key)
+        while len(_media_info_cache) > MAX_CACHED_MEDIA_INFO:
+            _media_info_cache.popitem(last=False)
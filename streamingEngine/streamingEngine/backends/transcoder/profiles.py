@@ -0,0 +1,91 @@
+from typing import Any, Dict, Union
+
+
+DEFAULT_SEGMENT_DURATION = 10
+
+# Profiles name presets in x264's vocabulary. Other encoders use the closest preset they have, if any
+ENCODER_PRESETS = {
+    "libx264": {preset: preset for preset in ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow",
+                                              "slower", "veryslow"]},
+    "h264_nvenc": {"ultrafast": "p1", "superfast": "p1", "veryfast": "p2", "faster": "p3", "fast": "p4",
+                   "medium": "p5", "slow": "p6", "slower": "p7", "veryslow": "p7"},
+    "h264_qsv": {"ultrafast": "veryfast", "superfast": "veryfast", "veryfast": "veryfast", "faster": "faster",
+                 "fast": "fast", "medium": "medium", "slow": "slow", "slower": "slower", "veryslow": "veryslow"},
+}
+# Option that sets the constant quality of an encoder
+ENCODER_QUALITY_OPTIONS = {"libx264": "crf", "h264_nvenc": "cq", "h264_qsv": "global_quality"}
+
+
+class EncodingProfile(object):
+    """
+    How much CPU an encode may spend for how much quality. Profiles are independent of the ladder: the bitrates of
+    the renditions are targets when crf is None, and caps (maxrate = bitrate * maxrate_factor) of a constant quality
+    encode otherwise. Keyframes are placed exactly every segment_duration seconds so that every segment starts on
+    one and all renditions switch at the same points. threads is per ffmpeg process, 0 lets the encoder decide.
+    """
+
+    def __init__(self, name:str, preset:str="medium", threads:int=0, segment_duration:int=DEFAULT_SEGMENT_DURATION,
+                 crf:int=None, maxrate_factor:float=None, bufsize_factor:float=None):
+        self.name = name
+        self.preset = preset
+        self.threads = threads
+        self.segment_duration = segment_duration
+        self.crf = crf
+        self.maxrate_factor = maxrate_factor
+        self.bufsize_factor = bufsize_factor
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+    @staticmethod
+    def from_dict(data:Dict[str, Any]) -> "EncodingProfile":
+        return EncodingProfile(**data)
+
+    @staticmethod
+    def from_settings(name:str, settings:Dict[str, Any]) -> "EncodingProfile":
+        return EncodingProfile(
+            name=name,
+            preset=settings.get("PRESET", "medium"),
+            threads=settings.get("THREADS", 0),
+            segment_duration=settings.get("SEGMENT_DURATION", DEFAULT_SEGMENT_DURATION),
+            crf=settings.get("CRF"),
+            maxrate_factor=settings.get("MAXRATE_FACTOR"),
+            bufsize_factor=settings.get("BUFSIZE_FACTOR")
+        )
+
+    def get_gop_size(self, fps:float) -> Union[int, None]:
+        return max(int(round(fps * self.segment_duration)), 1) if not (fps is None) and fps > 0 else None
+
+    def get_video_options(self, encoder:str, fps:float=None, threads:int=None) -> Dict[str, Any]:
+        """
+        Encoder options shared by every rendition. threads overrides the profile's threads when it is 0, e.g. to
+        split the cores between several ffmpeg processes.
+        """
+        options = {
+            # Forced keyframes do not depend on the frame rate being known, the fixed GOP keeps x264 from adding more
+            "force_key_frames": f"expr:gte(t,n_forced*{self.segment_duration})",
+            "sc_threshold": 0
+        }
+        gop_size = self.get_gop_size(fps)
+        if not (gop_size is None):
+            options["g"] = gop_size
+            options["keyint_min"] = gop_size
+        preset = ENCODER_PRESETS.get(encoder, {}).get(self.preset)
+        if not (preset is None):
+            options["preset"] = preset
+        if not (self.crf is None) and encoder in ENCODER_QUALITY_OPTIONS.keys():
+            options[ENCODER_QUALITY_OPTIONS[encoder]] = self.crf
+        if self.threads > 0 or not (threads is None):
+            options["threads"] = self.threads if self.threads > 0 else threads
+        return options
+
+    def get_rate_control(self, video_bitrate:int) -> Dict[str, int]:
+        """
+        Per rendition VBV limits, in bits per second, of a constant quality encode.
+        """
+        if self.crf is None or self.maxrate_factor is None:
+            return {}
+        rate_control = {"maxrate": int(video_bitrate * self.maxrate_factor)}
+        if not (self.bufsize_factor is None):
+            rate_control["bufsize"] = int(video_bitrate * self.bufsize_factor)
+        return rate_control
@@ -1,12 +1,23 @@
 import os.path
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
 from typing import Union, Generator
 
-import ffmpeg, sys, datetime
+import ffmpeg, sys, datetime, secrets, tempfile, threading, time
 import ffmpeg_streaming
 from ffmpeg_streaming._input import Input
 from ffmpeg_streaming import Formats, Format, Bitrate, Representation, Size
 
+from .hls import Rendition, AudioRendition, VIDEO_ENCODERS, SEGMENT_TYPE_MPEGTS, SEGMENT_TYPE_FMP4, get_renditions, \
+    get_audio_renditions, get_bitrate_argument, build_hls_command, run_ffmpeg, write_key_info_file, \
+    write_master_playlist, is_complete_playlist
+from .profiles import EncodingProfile
+from .mediainfo import MediaInfo, get_media_info
+
+
+def is_url(path:str) -> bool:
+    return path.startswith("http://") or path.startswith("https://")
+
 
 def monitor(ffmpeg, duration, time_, time_left, process):
     """
@@ -53,6 +64,37 @@ def monitor(ffmpeg, duration, time_, time_left, process):
         (per, datetime.timedelta(seconds=int(time_left)), '#' * per, '-' * (100 - per))
     )
     sys.stdout.flush()
+
+
+class TranscodeProgress(object):
+    """
+    Combines the positions reached by the ffmpeg processes of one transcode into the percentage of the source that
+    was transcoded and the number of source frames transcoded per second, and passes them on to callback.
+    """
+
+    def __init__(self, callback:Callable[[float, float], None], duration:float, fps:float=None, processes:int=1):
+        self.callback = callback
+        self.duration = duration
+        self.fps = fps
+        self.processes = max(processes, 1)
+        self.positions = {}
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+
+    def update(self, process:int, position:float):
+        with self.lock:
+            self.positions[process] = position
+            position = sum(self.positions.values()) / self.processes
+        if self.duration is None or self.duration <= 0:
+            return
+        elapsed = time.monotonic() - self.started_at
+        fps = position * self.fps / elapsed if not (self.fps is None) and elapsed > 0 else None
+        self.callback(min(position / self.duration * 100, 100), fps)
+
+    def get_process_callback(self, process:int) -> Callable[[float], None]:
+        return lambda position: self.update(process, position)
+
+
 class TranscoderConfiguration(object):
     def __init__(self, audio_bitrate:int, video_bitrate:int, width:int, height:int=-1):
         self.audio_bitrate = audio_bitrate
@@ -61,59 +103,249 @@ class TranscoderConfiguration(object):
         self.height = height
 
 class Transcoder(object):
+    # All renditions in one ffmpeg process through ffmpeg_streaming
+    EXECUTION_MODE_SINGLE = "single"
+    # All renditions in one ffmpeg process that decodes the input only once. Best when CPU is the bottleneck
+    EXECUTION_MODE_SHARED_DECODE = "shared"
+    # One ffmpeg process per rendition. A failing rendition does not affect the others
+    EXECUTION_MODE_PARALLEL = "parallel"
+
     def __init__(self, output_video_codec: str = 'h264', output_audio_codec='aac'):
         self.output_video_codec = output_video_codec
         self.output_audio_codec = output_audio_codec
 
+    @staticmethod
+    def can_encrypt(output_formats:List[str], segment_type:str=SEGMENT_TYPE_MPEGTS) -> bool:
+        # ffmpeg only encrypts (AES-128) HLS MPEG-TS segments, neither fMP4 nor DASH
+        return not ("dash" in output_formats) and segment_type == SEGMENT_TYPE_MPEGTS
+
 
-    def __get_video_height(self, input_filepath:str, current_width:int)->int:
-        probe = ffmpeg.probe(input_filepath)
-        video_info = next(stream for stream in probe['streams'] if stream['codec_type'] == 'video')
+    def __get_video_height(self, media_info:MediaInfo, current_width:int)->int:
+        return int( media_info.display_height * current_width / media_info.display_width )
 
-        # Extract width and height
-        width = int(video_info['width'])
-        height = int(video_info['height'])
+    def __get_rate_control(self, encoding_profile:EncodingProfile, video_bitrate:int, stream_index:int=None) -> dict:
+        # Outputs with several video streams (DASH) need the options of each stream to be specific to it
+        if encoding_profile is None:
+            return {}
+        suffix = f":v:{stream_index}" if not (stream_index is None) else ""
+        return {f"{key}{suffix}": get_bitrate_argument(value)
+                for key, value in encoding_profile.get_rate_control(video_bitrate).items()}
 
-        return int( height * current_width / width )
+    def __create_key_info_file(self, encryption_key_directory:str, encryption_key_url:str) -> str:
+        # Same key layout as ffmpeg_streaming: a random key written to encryption_key_directory. An existing key is
+        # kept so that renditions transcoded before a restart stay playable with the rest
+        if not os.path.exists(os.path.dirname(encryption_key_directory)):
+            os.makedirs(os.path.dirname(encryption_key_directory))
+        if not os.path.isfile(encryption_key_directory):
+            with open(encryption_key_directory, "wb") as f:
+                f.write(secrets.token_bytes(16))
+        with tempfile.NamedTemporaryFile(mode='w', suffix='_key_info', delete=False) as key_info:
+            key_info_filepath = key_info.name
+        write_key_info_file(key_info_filepath=key_info_filepath, key_url=encryption_key_url,
+                            key_filepath=encryption_key_directory, iv=secrets.token_hex(16))
+        return key_info_filepath
+
+    def __transcode_renditions(self, input_filepath:str, base_output_dir:str, manifest_filename:str,
+                               configurations:List[TranscoderConfiguration], execution_mode:str,
+                               media_info:MediaInfo, encryption_key_directory:str=None, encryption_key_url:str=None,
+                               hls_options:dict=None, max_parallel_processes:int=None,
+                               encoding_profile:EncodingProfile=None, audio_bitrates:List[int]=None,
+                               segment_type:str=SEGMENT_TYPE_MPEGTS, progress:Callable[[float, float], None]=None,
+                               resume:bool=False) -> Union[str, None]:
+        renditions = get_renditions(configurations, source_width=media_info.display_width,
+                                    source_height=media_info.display_height)
+        audio_renditions = None
+        if not (audio_bitrates is None) and len(audio_bitrates) > 0 and media_info.has_audio:
+            audio_renditions = get_audio_renditions(renditions, bitrates=audio_bitrates,
+                                                    source_bitrate=media_info.audio_bitrate)
+        manifest_stem = os.path.splitext(manifest_filename)[0]
+        if not os.path.exists(base_output_dir):
+            os.makedirs(base_output_dir)
+
+        def is_pending(variant:Union[Rendition, AudioRendition]) -> bool:
+            return not resume or not is_complete_playlist(
+                os.path.join(base_output_dir, variant.get_playlist_filename(manifest_stem)))
+
+        pending = [rendition for rendition in renditions if is_pending(rendition)]
+        pending_audio = [audio for audio in audio_renditions if is_pending(audio)] \
+            if not (audio_renditions is None) else None
+        if len(pending) < len(renditions):
+            print(f"Resuming transcode, {len(renditions) - len(pending)} of {len(renditions)} renditions are complete")
+
+        key_info_filepath = None
+        if not (encryption_key_directory is None) and not (encryption_key_url is None):
+            key_info_filepath = self.__create_key_info_file(encryption_key_directory, encryption_key_url)
+
+        max_workers = max_parallel_processes or max(len(pending), 1)
+        # Unless the profile says otherwise, parallel processes share the cores instead of each using all of them
+        threads = max((os.cpu_count() or 1) // max_workers, 1) \
+            if execution_mode == Transcoder.EXECUTION_MODE_PARALLEL else None
+        processes = len(pending) + (1 if len(pending_audio or []) > 0 else 0) \
+            if execution_mode == Transcoder.EXECUTION_MODE_PARALLEL else 1
+        transcode_progress = TranscodeProgress(progress, duration=media_info.duration, fps=media_info.fps,
+                                               processes=processes) if not (progress is None) else None
+
+        def transcode(rendition_group:List[Rendition], audio_group:List[AudioRendition]=pending_audio,
+                      process:int=0) -> bool:
+            if len(rendition_group) == 0 and len(audio_group or []) == 0:
+                return True
+            return run_ffmpeg(build_hls_command(
+                input_filepath=input_filepath, renditions=rendition_group, output_dir=base_output_dir,
+                manifest_stem=manifest_stem, key_info_filepath=key_info_filepath,
+                video_codec=self.output_video_codec, audio_codec=self.output_audio_codec, hls_options=hls_options,
+                encoding_profile=encoding_profile, fps=media_info.fps, threads=threads,
+                audio_renditions=audio_group, segment_type=segment_type
+            ), progress=transcode_progress.get_process_callback(process) if not (transcode_progress is None) else None)
+
+        try:
+            if execution_mode == Transcoder.EXECUTION_MODE_PARALLEL:
+                # Each thread only waits on its own ffmpeg process. Shared audio is encoded by a process of its own
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    audio_result = executor.submit(transcode, [], pending_audio, len(pending)) \
+                        if not (pending_audio is None) else None
+                    # Renditions leave the shared audio to its own process
+                    results = list(executor.map(
+                        lambda index: transcode([pending[index]], None if pending_audio is None else [], index),
+                        range(len(pending))
+                    ))
+                    if not (audio_result is None) and not audio_result.result():
+                        print(f"Could not transcode the shared audio renditions")
+                        results = [False for _ in pending]
+                failed = [rendition for rendition, result in zip(pending, results) if not result]
+                for rendition in failed:
+                    print(f"Could not transcode rendition {rendition.width}x{rendition.height}")
+                completed = [rendition for rendition in renditions if not rendition in failed]
+            else:
+                completed = renditions if transcode(pending) else []
+        finally:
+            if not (key_info_filepath is None):
+                os.remove(key_info_filepath)
+
+        if len(completed) == 0:
+            return None
+        output_filepath = os.path.join(base_output_dir, manifest_filename)
+        print(f"Saving transcoded video's master playlist to {output_filepath}")
+        write_master_playlist(path=output_filepath, renditions=completed, manifest_stem=manifest_stem,
+                              audio_renditions=audio_renditions, segment_type=segment_type)
+        return output_filepath
 
 
 
 
     def transcode(self, input_filepath:str, base_output_dir:str, manifest_filename:str,
                   configurations:List[TranscoderConfiguration], output_formats:List[str]=['hls'],
-                  encryption_key_directory:str=None, encryption_key_url:str=None, *args, **kwargs) -> Union[str, None]:
+                  encryption_key_directory:str=None, encryption_key_url:str=None, hls_options:dict=None,
+                  execution_mode:str=EXECUTION_MODE_SINGLE, max_parallel_processes:int=None,
+                  media_info:MediaInfo=None, encoding_profile:EncodingProfile=None,
+                  audio_bitrates:List[int]=None, segment_type:str=SEGMENT_TYPE_MPEGTS,
+                  progress:Callable[[float, float], None]=None, resume:bool=False,
+                  *args, **kwargs) -> Union[str, None]:
+        """
+        media_info is the probed source (see mediainfo.get_media_info). When it is not given the input is probed once
+        here; callers that already probed the input should pass it on so that ffprobe does not run again.
+        encoding_profile sets the speed/quality trade-off and segment duration; without one ffmpeg_streaming's
+        defaults are used.
+        audio_bitrates switches to shared audio: the audio is encoded once per bitrate into audio only renditions
+        that the video only renditions refer to (see hls.write_master_playlist), instead of once per rendition.
+        ffmpeg_streaming cannot produce such playlists, so the single execution mode then runs as the shared one.
+        output_formats are 'hls', 'dash' or both. HLS segments are MPEG-TS or, with segment_type SEGMENT_TYPE_FMP4,
+        fragmented MP4. DASH output is produced through ffmpeg_streaming in one ffmpeg process, whatever the execution
+        mode. Together, HLS and DASH share one set of CMAF segments: ffmpeg's dash muxer writes manifest_filename and
+        its variant playlists next to the .mpd. Only MPEG-TS output can be encrypted (see can_encrypt).
+        progress is called with the percentage of the source transcoded so far and the speed in source frames per
+        second. With resume, renditions whose playlists were completed in base_output_dir by an earlier, interrupted
+        transcode are kept instead of transcoded again; this needs the shared or parallel execution mode.
+        Returns the path of the HLS master playlist, or of the DASH manifest if HLS was not requested.
+        """
         if not (input_filepath is None) and len(input_filepath) > 0 \
                 and not (base_output_dir is None) and len(base_output_dir) > 0 \
                 and not (manifest_filename is None) and len(manifest_filename) > 0 \
                 and len(configurations) > 0 and len(output_formats) > 0:
-            if not os.path.exists(input_filepath):
+            # ffmpeg reads http(s) inputs (e.g. presigned S3 urls) directly
+            if not is_url(input_filepath) and not os.path.exists(input_filepath):
                 print(f"Could no transcode video as the raw video was not found at {input_filepath}")
                 return None
             else:
                 print(f"Transcoding video {input_filepath}")
+            if not Transcoder.can_encrypt(output_formats, segment_type) and not (encryption_key_directory is None) \
+                    and not (encryption_key_url is None):
+                print(f"Could not transcode video as {output_formats} output with {segment_type} segments cannot be "
+                      f"encrypted")
+                return None
+            if media_info is None:
+                media_info = get_media_info(input_filepath)
+            if execution_mode == Transcoder.EXECUTION_MODE_SINGLE and not (audio_bitrates is None) \
+                    and len(audio_bitrates) > 0 and media_info.has_audio:
+                execution_mode = Transcoder.EXECUTION_MODE_SHARED_DECODE
+            if execution_mode in (Transcoder.EXECUTION_MODE_SHARED_DECODE, Transcoder.EXECUTION_MODE_PARALLEL) \
+                    and output_formats == ['hls']:
+                return self.__transcode_renditions(
+                    input_filepath=input_filepath, base_output_dir=base_output_dir,
+                    manifest_filename=manifest_filename, configurations=configurations,
+                    execution_mode=execution_mode, media_info=media_info,
+                    encryption_key_directory=encryption_key_directory,
+                    encryption_key_url=encryption_key_url, hls_options=hls_options,
+                    max_parallel_processes=max_parallel_processes, encoding_profile=encoding_profile,
+                    audio_bitrates=audio_bitrates, segment_type=segment_type, progress=progress, resume=resume
+                )
             video = ffmpeg_streaming.input(input_filepath)
-            for format in output_formats:
-                output_format = None
-                if format == 'hls':
-                    output_format = video.hls(Formats.h264(audio=self.output_audio_codec, video=self.output_video_codec))
-
-                if not output_format is None:
-                    output_format.representations(
-                        *[
-                            Representation(
-                                size=Size(width=config.width, height=config.height if config.height > 0 else self.__get_video_height(input_filepath=input_filepath, current_width=config.width)),
-                                bitrate=Bitrate(audio=config.audio_bitrate, video=config.video_bitrate)
-                            ) for config in configurations]
-                    )
-                    if not os.path.exists(base_output_dir):
-                        os.makedirs(base_output_dir)
-                    output_filepath = os.path.join(base_output_dir, manifest_filename)
-                    print(f"Saving transcoded video's master playlist to {output_filepath}")
-
-                    if not (encryption_key_directory is None) and not (encryption_key_url is None):
-                        output_format.encryption(encryption_key_directory, encryption_key_url)
-                    output_format.output(output_filepath, monitor=monitor)
-                    return output_filepath
+            codec_options = {}
+            if not (encoding_profile is None):
+                codec_options = encoding_profile.get_video_options(
+                    VIDEO_ENCODERS.get(self.output_video_codec, self.output_video_codec), fps=media_info.fps)
+                hls_options = {"hls_time": encoding_profile.segment_duration, **(hls_options or {})}
+            video_format = Formats.h264(audio=self.output_audio_codec, video=self.output_video_codec, **codec_options)
+            manifest_stem = os.path.splitext(manifest_filename)[0]
+            output_format = None
+            is_dash = "dash" in output_formats
+            if is_dash:
+                # Video renditions can only be switched between within one adaptation set
+                dash_options = {"adaptation_sets": "id=0,streams=v id=1,streams=a" if media_info.has_audio
+                                else "id=0,streams=v"}
+                if not (encoding_profile is None):
+                    dash_options["seg_duration"] = encoding_profile.segment_duration
+                output_format = video.dash(video_format, **dash_options)
+                if "hls" in output_formats:
+                    # The HLS playlists reference the fMP4 segments of the DASH output instead of a second encode
+                    output_format.generate_hls_playlist()
+                    output_format.options.update({"hls_master_name": manifest_filename})
+                output_filepath = os.path.join(base_output_dir, f"{manifest_stem}.mpd")
+            elif "hls" in output_formats:
+                output_format = video.hls(video_format, **(hls_options or {}))
+                if segment_type == SEGMENT_TYPE_FMP4:
+                    output_format.fragmented_mp4()
+                output_filepath = os.path.join(base_output_dir, manifest_filename)
+
+            if not output_format is None:
+                output_format.representations(
+                    *[
+                        Representation(
+                            size=Size(width=config.width, height=config.height if config.height > 0 else self.__get_video_height(media_info=media_info, current_width=config.width)),
+                            bitrate=Bitrate(audio=config.audio_bitrate, video=config.video_bitrate),
+                            **self.__get_rate_control(encoding_profile, config.video_bitrate,
+                                                      stream_index=index if is_dash else None)
+                        ) for index, config in enumerate(configurations)]
+                )
+                if not os.path.exists(base_output_dir):
+                    os.makedirs(base_output_dir)
+                print(f"Saving transcoded video's manifest to {output_filepath}")
+
+                if not (encryption_key_directory is None) and not (encryption_key_url is None):
+                    output_format.encryption(encryption_key_directory, encryption_key_url)
+                transcode_progress = TranscodeProgress(progress, duration=media_info.duration, fps=media_info.fps) \
+                    if not (progress is None) else None
+
+                def report(ffmpeg, duration, time_, time_left, process):
+                    monitor(ffmpeg, duration, time_, time_left, process)
+                    if not (transcode_progress is None):
+                        transcode_progress.update(0, time_)
+
+                output_format.output(output_filepath, monitor=report)
+                if is_dash and "hls" in output_formats:
+                    return os.path.join(base_output_dir, manifest_filename)
+                return output_filepath
+            print(f"Could not transcode video as none of the output formats {output_formats} is supported")
+            return None
         else:
             print(f"Could not transcode video as some of the configurations are missing")
         return None
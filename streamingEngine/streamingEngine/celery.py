@@ -1,6 +1,8 @@
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from celery.signals import before_task_publish, after_task_publish, task_prerun, task_postrun, \
+    worker_process_shutdown, worker_shutdown
 
 # setting the Django settings module.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'streamingEngine.settings')
@@ -8,4 +10,35 @@ app = Celery('streamingEngine')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Looks up for task modules in Django applications and loads them
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+# Queues of the transcoding job classes and the tasks every worker runs at once (see settings.TRANSCODE_ROUTING and
+# settings.TRANSCODE_WORKER), set once the configuration is loaded
+from .backends.routing import get_task_queues, get_worker_concurrency
+
+
+@app.on_after_configure.connect
+def configure_transcoding_queues(sender:Celery, **kwargs):
+    sender.conf.task_queues = get_task_queues()
+    sender.conf.worker_concurrency = get_worker_concurrency()
+
+
+# Queue wait and duration of every task, exported by the workers (see settings.METRICS)
+from .backends.metrics import record_task_published, record_task_started, record_task_finished, \
+    remove_worker_metrics
+before_task_publish.connect(record_task_published)
+task_prerun.connect(record_task_started)
+task_postrun.connect(record_task_finished)
+# Pool processes exit with worker_process_shutdown; a solo pool runs its tasks in the worker, which exits with
+# worker_shutdown
+worker_process_shutdown.connect(remove_worker_metrics)
+worker_shutdown.connect(remove_worker_metrics)
+
+# Spans of every task, children of the span that published it (see settings.TRACING)
+from .backends.tracing import trace_task_published, trace_task_sent, trace_task_started, trace_task_finished, \
+    flush_spans
+before_task_publish.connect(trace_task_published)
+after_task_publish.connect(trace_task_sent)
+task_prerun.connect(trace_task_started)
+task_postrun.connect(trace_task_finished)
+worker_process_shutdown.connect(flush_spans)
\ No newline at end of file
@@ -0,0 +1,64 @@
+import os, tempfile, time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...backends.transcoder.ladder import get_children_cpu_seconds
+from ...backends.transcoder.mediainfo import get_media_info
+from ...backends.transcoder.transcoder import Transcoder
+from ...task import get_encoding_profile, get_shared_audio_bitrates, plan_transcoding_configurations
+
+
+def get_directory_size(directory:str) -> int:
+    return sum(os.path.getsize(os.path.join(path, filename))
+               for path, _, filenames in os.walk(directory) for filename in filenames)
+
+
+class Command(BaseCommand):
+    help = "Transcodes sample clips with each encoding profile (settings.TRANSCODE_PROFILES) and reports the encoding " \
+           "speed in source frames per second, the ffmpeg CPU time and the output size, using the same ladder and " \
+           "execution mode as the transcoding tasks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("clips", nargs="+", type=str, help="Local video files")
+        parser.add_argument("--profiles", type=str, default=",".join(settings.TRANSCODE_PROFILES.keys()),
+                            help="Comma separated profile names")
+        parser.add_argument("--execution-mode", type=str, default=settings.TRANSCODE_EXECUTION["MODE"])
+
+    def handle(self, *args, **options):
+        profiles = [name.strip() for name in options["profiles"].split(",") if len(name.strip()) > 0]
+        for name in profiles:
+            if not name in settings.TRANSCODE_PROFILES.keys():
+                raise CommandError(f"Unknown encoding profile {name}")
+
+        for clip in options["clips"]:
+            if not os.path.isfile(clip):
+                raise CommandError(f"{clip} does not exist")
+            media_info = get_media_info(clip)
+            configurations, _ = plan_transcoding_configurations(input_filepath=clip, media_info=media_info)
+            frames = (media_info.duration or 0) * (media_info.fps or 0)
+            for name in profiles:
+                with tempfile.TemporaryDirectory() as output_dir:
+                    cpu_seconds = get_children_cpu_seconds()
+                    start = time.perf_counter()
+                    result = Transcoder().transcode(
+                        input_filepath=clip, base_output_dir=output_dir, manifest_filename="master.m3u8",
+                        configurations=configurations, execution_mode=options["execution_mode"],
+                        max_parallel_processes=settings.TRANSCODE_EXECUTION["MAX_PARALLEL_PROCESSES"],
+                        media_info=media_info, encoding_profile=get_encoding_profile(name),
+                        audio_bitrates=get_shared_audio_bitrates(),
+                        output_formats=settings.TRANSCODE_OUTPUT["FORMATS"],
+                        segment_type=settings.TRANSCODE_OUTPUT["SEGMENT_TYPE"]
+                    )
+                    elapsed = time.perf_counter() - start
+                    if not (cpu_seconds is None):
+                        cpu_seconds = get_children_cpu_seconds() - cpu_seconds
+                    if result is None:
+                        self.stderr.write(f"{os.path.basename(clip)} {name}: transcoding failed")
+                        continue
+                    size = get_directory_size(output_dir)
+                self.stdout.write(
+                    f"{os.path.basename(clip)} {name}: {frames / elapsed:.1f} fps, {elapsed:.1f}s, "
+                    f"cpu={cpu_seconds if cpu_seconds is None else round(cpu_seconds, 1)}s, "
+                    f"{size / 1024 / 1024:.2f} MiB ({len(configurations)} renditions)"
+                )
@@ -0,0 +1,73 @@
+import io, statistics, time, uuid
+from typing import Any, Callable, List
+
+import boto3
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...backends.s3.s3 import S3, get_request_counts, reset_request_counts
+
+
+def measure(operation:Callable[[], Any], iterations:int) -> List[float]:
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        operation()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+class Command(BaseCommand):
+    help = "Measures per request latency of S3 reads with a fresh client per request vs. the shared pooled client. " \
+           "Run it against the local S3 stand-in from docker-compose (localstack) or any S3 compatible endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--size", type=int, default=512 * 1024, help="Size of the benchmark object in bytes")
+        parser.add_argument("--bucket", type=str, default=settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"])
+
+    def handle(self, *args, **options):
+        bucket = options["bucket"]
+        path = f"benchmark/{uuid.uuid4()}.ts"
+        storage = S3()
+        storage.upload_file(basedir=bucket, data=io.BytesIO(b"0" * options["size"]), path=path,
+                            content_type="video/mp2t", create_basedir_if_not_exist=True)
+
+        def fresh_client():
+            # This is what every view and task did before the client registry was introduced
+            client = boto3.client(
+                service_name='s3', aws_access_key_id=settings.AWS["ACCESS_KEY_ID"],
+                aws_secret_access_key=settings.AWS["ACCESS_KEY_SECRET"],
+                endpoint_url=settings.AWS["S3"]["URL"],
+                region_name=settings.AWS["REGION"]
+            )
+            client.get_object(Bucket=bucket, Key=path)['Body'].read()
+
+        def pooled_client():
+            S3().s3.get_object(Bucket=bucket, Key=path)['Body'].read()
+
+        try:
+            for name, operation in [("fresh client", fresh_client), ("pooled client", pooled_client)]:
+                latencies = sorted(measure(operation, options["iterations"]))
+                self.stdout.write(
+                    f"{name}: mean={statistics.mean(latencies):.2f}ms "
+                    f"p50={latencies[len(latencies) // 2]:.2f}ms "
+                    f"p95={latencies[int(len(latencies) * 0.95) - 1]:.2f}ms"
+                )
+
+            operations = [
+                ("get_file", lambda: storage.get_file(basedir=bucket, path=path)),
+                ("get_file_stream", lambda: storage.get_file_stream(basedir=bucket, path=path).close()),
+                ("does_file_exist", lambda: storage.does_file_exist(basedir=bucket, path=path)),
+                ("upload_file", lambda: storage.upload_file(basedir=bucket, data=io.BytesIO(b"0"), path=path + ".copy",
+                                                            content_type="video/mp2t")),
+                ("copy_file", lambda: storage.copy_file(source_basedir=bucket, source_path=path,
+                                                        destination_basedir=bucket, destination_path=path + ".copy")),
+                ("delete_file", lambda: storage.delete_file(basedir=bucket, path=path + ".copy")),
+            ]
+            for name, operation in operations:
+                reset_request_counts()
+                operation()
+                self.stdout.write(f"{name}: S3 round trips {get_request_counts()}")
+        finally:
+            storage.delete_file(basedir=bucket, path=path)
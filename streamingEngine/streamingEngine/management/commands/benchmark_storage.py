@@ -0,0 +1,173 @@
+import io, os, time, uuid
+from typing import Callable, List, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...backends.storage import STORAGE_BACKENDS, get_storage
+from ...backends.storageInterface import IStorageInterface
+
+
+CONTENT_TYPE = "video/mp2t"
+
+
+def read_stream(storage:IStorageInterface, bucket:str, path:str, **kwargs):
+    file = storage.get_file_stream(basedir=bucket, path=path, **kwargs)
+    if file is None:
+        return None, None
+    return file, b"".join(file.chunks())
+
+
+def get_conformance_checks(storage:IStorageInterface, bucket:str, prefix:str) -> List[Tuple[str, Callable[[], bool]]]:
+    """
+    The behaviour of IStorageInterface that the views and tasks rely on. The checks run in order and share the files
+    they create under prefix.
+    """
+    path = f"{prefix}/conformance/segment.ts"
+    content = os.urandom(4096)
+
+    def get_content() -> bytes:
+        file = storage.get_file(basedir=bucket, path=path)
+        return None if file is None else file.file
+
+    def check_range() -> bool:
+        file, data = read_stream(storage, bucket, path, byte_range="bytes=10-19")
+        return file.status == 206 and data == content[10:20] and file.content_range == f"bytes 10-19/{len(content)}"
+
+    def check_etag() -> bool:
+        file, _ = read_stream(storage, bucket, path)
+        return not (file.etag is None) and read_stream(storage, bucket, path, if_none_match=file.etag)[0].status == 304
+
+    def check_list() -> bool:
+        for name in ["a/1.ts", "a/2.ts", "b/1.ts"]:
+            storage.upload_file(basedir=bucket, data=io.BytesIO(b"x"), path=f"{prefix}/list/{name}",
+                                content_type=CONTENT_TYPE)
+        return storage.get_all_filepaths(basedir=bucket, path=f"{prefix}/list/a/") == \
+            [f"{prefix}/list/a/1.ts", f"{prefix}/list/a/2.ts"] \
+            and len(storage.get_all_filepaths(basedir=bucket, path=f"{prefix}/list/")) == 3
+
+    def check_copy_and_move() -> bool:
+        copy_path, move_path = f"{prefix}/conformance/copy.ts", f"{prefix}/conformance/move.ts"
+        return storage.copy_file(bucket, path, bucket, copy_path) \
+            and storage.move_file(bucket, copy_path, bucket, move_path) \
+            and not storage.does_file_exist(basedir=bucket, path=copy_path) \
+            and storage.get_file(basedir=bucket, path=move_path).file == content
+
+    def check_batch_delete() -> bool:
+        paths = [f"{prefix}/batch/{index}.ts" for index in range(3)]
+        for batch_path in paths:
+            storage.upload_file(basedir=bucket, data=io.BytesIO(b"x"), path=batch_path, content_type=CONTENT_TYPE)
+        return storage.delete_files(basedir=bucket, paths=paths[:2] + [f"{prefix}/batch/missing.ts"]) \
+            and list(storage.iterate_filepaths(basedir=bucket, path=f"{prefix}/batch/")) == paths[2:]
+
+    def check_prefix_delete() -> bool:
+        return storage.delete_file(basedir=bucket, path=f"{prefix}/list/") \
+            and storage.get_all_filepaths(basedir=bucket, path=f"{prefix}/list/") == []
+
+    return [
+        ("put", lambda: storage.upload_file(basedir=bucket, data=io.BytesIO(content), path=path,
+                                            content_type=CONTENT_TYPE, create_basedir_if_not_exist=True)),
+        ("exists", lambda: storage.does_file_exist(basedir=bucket, path=path)),
+        ("put without overwrite", lambda: not storage.upload_file(basedir=bucket, data=io.BytesIO(b"other"),
+                                                                  path=path, content_type=CONTENT_TYPE)
+                                          and get_content() == content),
+        ("get", lambda: get_content() == content
+                        and storage.get_file(basedir=bucket, path=path).content_type == CONTENT_TYPE),
+        ("stream", lambda: read_stream(storage, bucket, path)[1] == content),
+        ("stream range", check_range),
+        ("stream if-none-match", check_etag),
+        ("stream unsatisfiable range", lambda: read_stream(storage, bucket, path,
+                                                           byte_range=f"bytes={len(content) + 10}-")[0].status == 416),
+        ("missing file", lambda: not storage.does_file_exist(basedir=bucket, path=f"{prefix}/missing.ts")
+                                 and storage.get_file(basedir=bucket, path=f"{prefix}/missing.ts") is None),
+        ("list", check_list),
+        ("copy and move", check_copy_and_move),
+        ("delete files", check_batch_delete),
+        ("delete prefix", check_prefix_delete),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Runs every storage backend (settings.STORAGE_BACKEND) through the same workload: conformance checks of " \
+           "the behaviour the views and tasks rely on, then the throughput of put, get, stream, list and delete."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backends", type=str, default=",".join(STORAGE_BACKENDS),
+                            help="Comma separated storage backends")
+        parser.add_argument("--bucket", type=str, default=settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"])
+        parser.add_argument("--files", type=int, default=100, help="Number of files of the throughput workload")
+        parser.add_argument("--size", type=int, default=512 * 1024, help="Size of every file, in bytes")
+        parser.add_argument("--skip-conformance", action="store_true")
+
+    def __check(self, storage:IStorageInterface, bucket:str, prefix:str) -> bool:
+        passed = True
+        for name, check in get_conformance_checks(storage, bucket, prefix):
+            try:
+                ok = bool(check())
+            except Exception as e:
+                print(e)
+                ok = False
+            passed = passed and ok
+            self.stdout.write(f"  {name}: {'ok' if ok else 'FAILED'}")
+        return passed
+
+    def __report(self, name:str, count:int, size:int, elapsed:float):
+        elapsed = max(elapsed, 1e-9)
+        self.stdout.write(f"  {name}: {count / elapsed:.1f} ops/s" +
+                          (f", {size / elapsed / 1024 / 1024:.1f} MiB/s" if size > 0 else "") + f", {elapsed:.2f}s")
+
+    def __benchmark(self, storage:IStorageInterface, bucket:str, prefix:str, files:int, size:int):
+        content = os.urandom(size)
+        paths = [f"{prefix}/throughput/{index // 10}/{index}.ts" for index in range(files)]
+
+        start = time.perf_counter()
+        for path in paths:
+            if not storage.upload_file(basedir=bucket, data=io.BytesIO(content), path=path,
+                                       content_type=CONTENT_TYPE, create_basedir_if_not_exist=True):
+                raise CommandError(f"Could not store {path}")
+        self.__report("put", files, files * size, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for path in paths:
+            storage.get_file(basedir=bucket, path=path)
+        self.__report("get", files, files * size, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for path in paths:
+            read_stream(storage, bucket, path)
+        self.__report("stream", files, files * size, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for path in paths:
+            read_stream(storage, bucket, path, byte_range="bytes=0-65535")
+        self.__report("stream 64 KiB range", files, files * min(size, 65536), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        listed = storage.get_all_filepaths(basedir=bucket, path=f"{prefix}/throughput/")
+        self.__report(f"list {len(listed)} files", 1, 0, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        storage.delete_file(basedir=bucket, path=f"{prefix}/throughput/")
+        self.__report(f"delete {files} files", 1, 0, time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        backends = [name.strip() for name in options["backends"].split(",") if len(name.strip()) > 0]
+        for name in backends:
+            if not name in STORAGE_BACKENDS:
+                raise CommandError(f"Unknown storage backend {name}")
+        if options["bucket"] is None:
+            raise CommandError("Provide a bucket")
+
+        failed = []
+        for name in backends:
+            storage = get_storage(name)
+            prefix = f"benchmark/{uuid.uuid4()}"
+            self.stdout.write(f"{name}:")
+            try:
+                if not options["skip_conformance"] and not self.__check(storage, options["bucket"], prefix):
+                    failed.append(name)
+                self.__benchmark(storage, options["bucket"], prefix, options["files"], options["size"])
+            finally:
+                storage.delete_file(basedir=options["bucket"], path=f"{prefix}/")
+        if len(failed) > 0:
+            raise CommandError(f"Conformance checks failed for {', '.join(failed)}")
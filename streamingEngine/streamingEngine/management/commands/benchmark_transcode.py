@@ -0,0 +1,58 @@
+import os, time, uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...backends.dedupe import release_transcoded_video, remove_alias_references
+from ...backends.s3.s3 import S3
+from ...task import transcode_video
+
+
+class Command(BaseCommand):
+    help = "Compares the wall time of transcoding a video stored in S3 in a single task against the chunked mode " \
+           "that fans out to every running celery worker. The chunked run needs the workers from docker-compose."
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", type=str, help="Path of the source video in the bucket")
+        parser.add_argument("--bucket", type=str, default=settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"])
+        parser.add_argument("--timeout", type=int, default=6 * 3600)
+
+    def transcode(self, input_path:str, bucket:str, chunked:bool, timeout:int) -> float:
+        video_id = str(uuid.uuid4())
+        output_storage_filepath = f"{settings.AWS_STREAM_UPLOAD_DIR}/benchmark/{video_id}"
+        master_path = f"{output_storage_filepath}/videos/master.m3u8"
+        arguments = dict(
+            input_filepath=input_path,
+            transcoding_base_output_dir=os.path.join(settings.AWS_TEMP_DOWNLOAD_DIR, video_id),
+            video_folder_name="videos",
+            manifest_filename="master.m3u8",
+            encryption_key_filename="keys",
+            encryption_key_url=f"/keys/{video_id}",
+            output_storage_basedir=bucket,
+            output_storage_filepath=output_storage_filepath,
+            s3_bucket_name=bucket,
+            chunked=chunked
+        )
+        storage = S3()
+        start = time.perf_counter()
+        if chunked:
+            transcode_video.delay(**arguments)
+            while not storage.does_file_exist(basedir=bucket, path=master_path):
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"The chunked transcode did not finish within {timeout} seconds")
+                time.sleep(1)
+        else:
+            transcode_video(**arguments)
+        elapsed = time.perf_counter() - start
+        if not storage.does_file_exist(basedir=bucket, path=master_path):
+            self.stderr.write(f"Transcoding {input_path} (chunked={chunked}) did not produce {master_path}")
+        if release_transcoded_video(storage, basedir=bucket, path=output_storage_filepath):
+            storage.delete_file(basedir=bucket, path=f"{output_storage_filepath}/")
+            remove_alias_references(storage, basedir=bucket, original=output_storage_filepath)
+        return elapsed
+
+    def handle(self, *args, **options):
+        single = self.transcode(options["input"], options["bucket"], chunked=False, timeout=options["timeout"])
+        self.stdout.write(f"single task: {single:.1f}s")
+        chunked = self.transcode(options["input"], options["bucket"], chunked=True, timeout=options["timeout"])
+        self.stdout.write(f"chunked: {chunked:.1f}s ({single / chunked:.2f}x)")
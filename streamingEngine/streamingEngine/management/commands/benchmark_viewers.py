@@ -0,0 +1,66 @@
+import asyncio, statistics, time
+from typing import Dict, List
+
+import httpx
+from django.core.management.base import BaseCommand
+
+
+async def watch(client:httpx.AsyncClient, url:str, requests:int, latencies:List[float], errors:List[str]):
+    for _ in range(requests):
+        start = time.perf_counter()
+        try:
+            async with client.stream("GET", url) as response:
+                async for _ in response.aiter_bytes():
+                    pass
+            if response.status_code >= 400:
+                errors.append(str(response.status_code))
+            else:
+                latencies.append((time.perf_counter() - start) * 1000)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+
+
+async def load_test(url:str, viewers:int, requests:int, timeout:float) -> Dict[str, float]:
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=viewers, max_keepalive_connections=viewers)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[watch(client, url, requests, latencies, errors) for _ in range(viewers)])
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests/s": len(latencies) / elapsed,
+        "p50": latencies[len(latencies) // 2] if len(latencies) > 0 else 0,
+        "p95": latencies[max(int(len(latencies) * 0.95) - 1, 0)] if len(latencies) > 0 else 0,
+        "mean": statistics.mean(latencies) if len(latencies) > 0 else 0,
+        "errors": len(errors)
+    }
+
+
+class Command(BaseCommand):
+    help = "Simulates concurrent viewers fetching the same segment from the synchronous (/playlist/) and the " \
+           "asynchronous (/async/playlist/) views. Run the synchronous views under a WSGI server and the asynchronous " \
+           "ones under an ASGI server (e.g. uvicorn streamingEngine.asgi:application) with one worker process each, " \
+           "then compare the throughput and latency as the number of viewers grows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("segment", type=str, help="Storage path of a segment, e.g. videos/<id>/videos/master_360p_0000.ts")
+        parser.add_argument("--sync-url", type=str, default="http://127.0.0.1:8000")
+        parser.add_argument("--async-url", type=str, default="http://127.0.0.1:8001")
+        parser.add_argument("--viewers", type=str, default="10,50,100,200", help="Comma separated viewer counts")
+        parser.add_argument("--requests", type=int, default=20, help="Requests per viewer")
+        parser.add_argument("--timeout", type=float, default=60)
+
+    def handle(self, *args, **options):
+        targets = [
+            ("sync", f"{options['sync_url'].rstrip('/')}/playlist/{options['segment']}/"),
+            ("async", f"{options['async_url'].rstrip('/')}/async/playlist/{options['segment']}/"),
+        ]
+        for viewers in [int(count) for count in options["viewers"].split(",")]:
+            for name, url in targets:
+                result = asyncio.run(load_test(url, viewers, options["requests"], options["timeout"]))
+                self.stdout.write(
+                    f"{name} viewers={viewers}: {result['requests/s']:.1f} requests/s "
+                    f"mean={result['mean']:.1f}ms p50={result['p50']:.1f}ms p95={result['p95']:.1f}ms "
+                    f"errors={result['errors']}"
+                )
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...backends.jobs import JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, get_job_store
+from ...backends.routing import get_job_class_by_name, get_task_route
+from ...task import transcode_video
+
+
+class Command(BaseCommand):
+    help = "Queues again the transcoding jobs that stopped making progress, e.g. because their worker was restarted. " \
+           "They resume from their last checkpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stale-after", type=int, default=settings.TRANSCODE_JOBS["STALE_AFTER"],
+                            help="Seconds since the last update after which a job is considered stalled")
+        parser.add_argument("--include-queued", action="store_true",
+                            help="Also queue again the jobs that were queued but never started")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        store = get_job_store()
+        if store is None:
+            raise CommandError("Transcoding jobs are not recorded (settings.TRANSCODE_JOBS)")
+        statuses = [JOB_STATUS_RUNNING] + ([JOB_STATUS_QUEUED] if options["include_queued"] else [])
+        now = time.time()
+        resumed = 0
+        for job_id in store.get_job_ids():
+            job = store.get(job_id)
+            if job is None or not (job.get("status") in statuses) or job.get("task") is None:
+                continue
+            if now - (job.get("updated_at") or 0) < options["stale_after"]:
+                continue
+            self.stdout.write(f"{job_id}: {job.get('status')}, checkpoint {job.get('checkpoint')}, "
+                              f"last updated {int(now - job.get('updated_at', now))}s ago")
+            if not options["dry_run"]:
+                # Marks the job as alive so that it is not queued twice before a worker picks it up
+                store.update(job_id, status=JOB_STATUS_QUEUED)
+                # On the queue of the class the job was queued in the first time
+                transcode_video.apply_async(kwargs=job["task"],
+                                            **get_task_route(get_job_class_by_name(job.get("job_class"))))
+            resumed += 1
+        self.stdout.write(f"{resumed} stalled jobs {'found' if options['dry_run'] else 'queued again'}")
@@ -1,19 +1,126 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import HttpResponse, HttpRequest
-class ResponseHandlerMiddleware():
+from django.urls import ResolverMatch
+import time
+
+from .backends.metrics import HTTP_REQUEST_DURATION, is_metrics_enabled, start_web_metrics_export
+from .backends.tracing import SPAN_KIND_SERVER, extract, is_tracing_enabled, start_span
+class HybridMiddleware():
+    """
+    Middleware that runs in the mode of the handler it wraps. Under ASGI the async views are awaited on the event
+    loop instead of being adapted to sync and run in a thread per request.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
         # One-time configuration and initialization.
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request:HttpRequest):
-        # Code to be executed for each request before
-        # the view (and later middleware) are called.
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process(request, self.get_response(self.prepare(request)))
+
+    async def __acall__(self, request:HttpRequest):
+        return self.process(request, await self.get_response(self.prepare(request)))
+
+    def prepare(self, request:HttpRequest) -> HttpRequest:
+        # Code to be executed for each request before the view (and later middleware) are called.
+        return request
+
+    def process(self, request:HttpRequest, response:HttpResponse) -> HttpResponse:
+        # Code to be executed for each request/response after the view is called.
+        return response
+
+
+class ResponseHandlerMiddleware(HybridMiddleware):
+
+    def prepare(self, request:HttpRequest) -> HttpRequest:
         if not request.path.endswith("/"):
             request.path += "/"
         if not request.path_info.endswith("/"):
             request.path_info += "/"
-        response:HttpResponse = self.get_response(request)
+        return request
+
+
+def get_view_name(match:ResolverMatch) -> str:
+    if match is None:
+        return "unmatched"
+    view_class = getattr(match.func, "view_class", None)
+    return view_class.__name__ if not (view_class is None) else match.url_name or match.view_name
+
+
+def get_request_kind(request:HttpRequest, match:ResolverMatch) -> str:
+    from .views import MANIFEST_EXTENSIONS, SEGMENT_EXTENSIONS
+    if not (match is None) and match.url_name in ("keys", "async-keys"):
+        return "key"
+    path = request.path.rstrip("/")
+    if path.endswith(MANIFEST_EXTENSIONS):
+        return "manifest"
+    if path.endswith(SEGMENT_EXTENSIONS):
+        return "segment"
+    # Playlist urls without a file name serve the master manifest
+    if not (match is None) and match.url_name in ("playlist", "async-playlist") and "segment_name" in match.kwargs:
+        return "manifest"
+    return "other"
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Records how long every view took to return its response. Bodies streamed from the storage are sent afterwards,
+    so for segments this is the time to the first byte.
+    """
+
+    def __call__(self, request:HttpRequest):
+        if not is_metrics_enabled():
+            return self.get_response(request)
+        return super().__call__(request)
+
+    def prepare(self, request:HttpRequest) -> HttpRequest:
+        request.started_at = time.perf_counter()
+        start_web_metrics_export()
+        return request
+
+    def process(self, request:HttpRequest, response:HttpResponse) -> HttpResponse:
+        match = getattr(request, "resolver_match", None)
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - request.started_at, view=get_view_name(match),
+                                      kind=get_request_kind(request, match), method=request.method,
+                                      status=f"{response.status_code // 100}xx")
+        return response
+
+
+class TracingMiddleware(HybridMiddleware):
+    """
+    Traces every request as a server span, which continues the trace of the client if it sent a traceparent header.
+    Requests of viewers (manifests, segments and keys) are too many to trace unless their client asks for it.
+    """
+
+    def __call__(self, request:HttpRequest):
+        if not is_tracing_enabled():
+            return self.get_response(request)
+        if iscoroutinefunction(self):
+            return self.__atrace(request)
+        with self.start_span(request) as span:
+            return self.finish_span(request, self.get_response(request), span)
+
+    async def __atrace(self, request:HttpRequest):
+        with self.start_span(request) as span:
+            return self.finish_span(request, await self.get_response(request), span)
 
-        # Code to be executed for each request/response after
-        # the view is called.
+    def start_span(self, request:HttpRequest):
+        request.trace_parent = extract(request.headers)
+        return start_span(f"{request.method} {request.path}", kind=SPAN_KIND_SERVER, parent=request.trace_parent,
+                          attributes={"http.request.method": request.method, "url.path": request.path})
 
-        return response
\ No newline at end of file
+    def finish_span(self, request:HttpRequest, response:HttpResponse, span) -> HttpResponse:
+        match = getattr(request, "resolver_match", None)
+        span.name = f"{request.method} {get_view_name(match)}"
+        span.set_attribute("http.response.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_error(f"HTTP {response.status_code}")
+        if request.trace_parent is None and get_request_kind(request, match) in ("manifest", "segment", "key"):
+            span.context.sampled = False
+        return response
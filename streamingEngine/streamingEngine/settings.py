@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
+from corsheaders.defaults import default_headers
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -50,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'streamingEngine.middleware.TracingMiddleware',
+    'streamingEngine.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -83,6 +87,12 @@ WSGI_APPLICATION = 'streamingEngine.wsgi.application'
 
 # CORS
 CORS_ORIGIN_ALLOW_ALL = True
+# Headers of the tus protocol used by resumable uploads
+CORS_ALLOW_HEADERS = list(default_headers) + [
+    "tus-resumable", "upload-length", "upload-metadata", "upload-offset"
+]
+CORS_EXPOSE_HEADERS = ["location", "tus-resumable", "tus-version", "tus-extension", "tus-max-size", "upload-length",
+                       "upload-offset"]
 
 # AWS Configuration
 AWS = {    
@@ -91,6 +101,28 @@ AWS = {
     "REGION": os.getenv('AWS_REGION'),
     "S3": {
         "URL": os.getenv('AWS_S3_DOMAIN'),
+        # Seconds for which a successful bucket existence check is trusted without asking S3 again
+        "BUCKET_CACHE_TTL": int(os.getenv('AWS_S3_BUCKET_CACHE_TTL', 300)),
+        # A single client (and its connection pool) is shared by every request and task in a process
+        "CLIENT": {
+            "MAX_POOL_CONNECTIONS": int(os.getenv('AWS_S3_MAX_POOL_CONNECTIONS', 50)),
+            "CONNECT_TIMEOUT": float(os.getenv('AWS_S3_CONNECT_TIMEOUT', 5)),
+            "READ_TIMEOUT": float(os.getenv('AWS_S3_READ_TIMEOUT', 60)),
+            "TCP_KEEPALIVE": os.getenv('AWS_S3_TCP_KEEPALIVE', 'true').lower() == 'true',
+            "RETRIES": {
+                "MAX_ATTEMPTS": int(os.getenv('AWS_S3_MAX_ATTEMPTS', 5)),
+                "MODE": os.getenv('AWS_S3_RETRY_MODE', 'standard')
+            }
+        },
+        # Downloads of raw videos are split into ranged GETs of MULTIPART_CHUNKSIZE bytes run MAX_CONCURRENCY at a time
+        "TRANSFER": {
+            "MULTIPART_CHUNKSIZE": int(os.getenv('AWS_S3_TRANSFER_CHUNKSIZE', 8 * 1024 * 1024)),
+            "MAX_CONCURRENCY": int(os.getenv('AWS_S3_TRANSFER_MAX_CONCURRENCY', 10))
+        },
+        # Prefix deletes remove up to 1000 keys per DeleteObjects request, MAX_CONCURRENCY requests at a time
+        "DELETE": {
+            "MAX_CONCURRENCY": int(os.getenv('AWS_S3_DELETE_MAX_CONCURRENCY', 4))
+        },
         "BUCKETS": {
             "RAW VIDEO": {
                 "NAME": os.getenv('AWS_STORAGE_BUCKET_NAME')
@@ -101,9 +133,90 @@ AWS = {
 AWS_TEMP_DOWNLOAD_DIR = os.path.join(BASE_DIR, 'downloads')
 AWS_STREAM_UPLOAD_DIR = "videos"
 
+# Uploads of raw videos. With DIRECT_TO_S3 files posted to /video/ are piped into an S3 multipart upload in parts of
+# PART_SIZE bytes instead of being written to local disk. Resumable (tus) uploads at /uploads/ and upload sessions at
+# /upload-sessions/ stay valid for RESUMABLE_TOKEN_MAX_AGE seconds. The presigned part urls handed out by upload
+# sessions expire after PRESIGNED_URL_EXPIRY seconds and can be renewed.
+VIDEO_UPLOAD = {
+    "DIRECT_TO_S3": os.getenv("VIDEO_UPLOAD_DIRECT_TO_S3", "true").lower() == "true",
+    "PART_SIZE": int(os.getenv("VIDEO_UPLOAD_PART_SIZE", 8 * 1024 * 1024)),
+    "MAX_SIZE": int(os.getenv("VIDEO_UPLOAD_MAX_SIZE", 20 * 1024 * 1024 * 1024)),
+    "RESUMABLE_TOKEN_MAX_AGE": int(os.getenv("VIDEO_UPLOAD_RESUMABLE_TOKEN_MAX_AGE", 24 * 3600)),
+    "PRESIGNED_URL_EXPIRY": int(os.getenv("VIDEO_UPLOAD_PRESIGNED_URL_EXPIRY", 3600)),
+    "ALLOWED_EXTENSIONS": ["mp4", "mkv"]
+}
+
+# How PlayList serves segments. proxy: every segment is streamed through Django. redirect: segment requests are
+# answered with a 302 to a presigned S3 url. presigned: media playlists are rewritten so that their segment uris are
+# presigned S3 urls and players never ask Django for segments. Keys are always served by KeysView.
+# PRESIGNED_URL_EXPIRY has to outlast the playback of the longest video, as players fetch a VOD playlist only once.
+PLAYLIST_DELIVERY = {
+    "MODE": os.getenv("PLAYLIST_DELIVERY_MODE", "proxy"),
+    "PRESIGNED_URL_EXPIRY": int(os.getenv("PLAYLIST_DELIVERY_PRESIGNED_URL_EXPIRY", 6 * 3600))
+}
+
+# Where videos, playlists and keys are stored. s3 uses AWS["S3"]; local stores them under LOCAL["ROOT"], which must be
+# shared by the web servers and the workers, in a directory per bucket of AWS["S3"]["BUCKETS"]. Files are sharded
+# into SHARD_DEPTH levels of SHARD_WIDTH hex characters so that no directory grows too large. local only delivers
+# playlists through the proxy and does not support presigned input, chunked transcoding or multipart/resumable
+# uploads.
+STORAGE_BACKEND = {
+    "NAME": os.getenv("STORAGE_BACKEND", "s3"),
+    "LOCAL": {
+        "ROOT": os.getenv("STORAGE_LOCAL_ROOT", os.path.join(BASE_DIR, 'storage')),
+        "SHARD_DEPTH": int(os.getenv("STORAGE_LOCAL_SHARD_DEPTH", 2)),
+        "SHARD_WIDTH": int(os.getenv("STORAGE_LOCAL_SHARD_WIDTH", 2)),
+        "FSYNC": os.getenv("STORAGE_LOCAL_FSYNC", "false").lower() == "true"
+    }
+}
+
 # Celery configuration
 CELERY_BROKER_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 CELERY_RESULT_BACKEND = os.getenv("REDIS_URL", "redis://localhost:6379")
+# Workers reserve one task at a time so that a transcode never waits behind another one that its worker prefetched.
+# Transcoding tasks are acknowledged once they ended (see task.py): the task of a worker that stopped is delivered
+# again after VISIBILITY_TIMEOUT seconds, which must be longer than the longest job. Workers take the tasks of the
+# highest priority first (0, then 3, 6 and 9) and among those the tasks of the queue they list first (see
+# TRANSCODE_ROUTING).
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv("CELERY_WORKER_PREFETCH_MULTIPLIER", 1))
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "visibility_timeout": int(os.getenv("CELERY_VISIBILITY_TIMEOUT", 12 * 3600)),
+    "queue_order_strategy": "priority"
+}
+
+# Cache in front of S3 for manifests, keys and hot segments; local storage is served from the OS page cache and is
+# not cached. Every worker keeps an in-memory LRU bounded by
+# MAX_BYTES; the optional Redis tier is shared by all workers. TTLs are in seconds and keyed by content type.
+# Invalidations (deletes and overwrites) are published on the INVALIDATION channel to every worker, which drop their
+# in-memory copies; the channel is enabled along with the Redis tier unless STORAGE_CACHE_INVALIDATION_ENABLED says
+# otherwise. A worker that does not receive them (disabled, or Redis unavailable) keeps in-memory entries at
+# most UNSHARED_MAX_TTL seconds, so it serves a deleted or replaced file for that long at most.
+STORAGE_CACHE_REDIS_ENABLED = os.getenv("STORAGE_CACHE_REDIS_ENABLED", "false").lower() == "true"
+STORAGE_CACHE = {
+    "ENABLED": os.getenv("STORAGE_CACHE_ENABLED", "true").lower() == "true",
+    "MAX_BYTES": int(os.getenv("STORAGE_CACHE_MAX_BYTES", 128 * 1024 * 1024)),
+    "MAX_ITEM_BYTES": int(os.getenv("STORAGE_CACHE_MAX_ITEM_BYTES", 4 * 1024 * 1024)),
+    "TTL": {
+        "application/vnd.apple.mpegurl": 30,
+        "application/x-mpegurl": 30,
+        "video/mp2t": 3600,
+        "application/dash+xml": 30,
+        "video/iso.segment": 3600,
+        "video/mp4": 3600,
+        "DEFAULT": 60
+    },
+    "REDIS": {
+        "ENABLED": STORAGE_CACHE_REDIS_ENABLED,
+        "URL": os.getenv("STORAGE_CACHE_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379")),
+        "KEY_PREFIX": "storage:"
+    },
+    "INVALIDATION": {
+        "ENABLED": os.getenv("STORAGE_CACHE_INVALIDATION_ENABLED", str(STORAGE_CACHE_REDIS_ENABLED)).lower() == "true",
+        "URL": os.getenv("STORAGE_CACHE_INVALIDATION_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379")),
+        "CHANNEL": os.getenv("STORAGE_CACHE_INVALIDATION_CHANNEL", "storage:invalidations"),
+        "UNSHARED_MAX_TTL": int(os.getenv("STORAGE_CACHE_UNSHARED_MAX_TTL", 30))
+    }
+}
 
 # APPEND_SLASH = False
 # Database
@@ -164,4 +277,186 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-TRANSCODE_COMPLETE_WEBHOOK = os.getenv("TRANSCODE_COMPLETE_WEBHOOK", "")
\ No newline at end of file
+TRANSCODE_COMPLETE_WEBHOOK = os.getenv("TRANSCODE_COMPLETE_WEBHOOK", "")
+
+# Upload of transcoded output. MAX_WORKERS should not exceed AWS["S3"]["CLIENT"]["MAX_POOL_CONNECTIONS"].
+TRANSCODE_UPLOAD = {
+    "MAX_WORKERS": int(os.getenv("TRANSCODE_UPLOAD_MAX_WORKERS", 16)),
+    "MAX_ATTEMPTS": int(os.getenv("TRANSCODE_UPLOAD_MAX_ATTEMPTS", 3)),
+    "RETRY_BACKOFF": float(os.getenv("TRANSCODE_UPLOAD_RETRY_BACKOFF", 0.5))
+}
+
+# Pipelined mode uploads (and deletes locally) each segment as soon as ffmpeg closes it. With EVENT_PLAYLISTS the
+# playlists are published as HLS EVENT playlists while transcoding, so a video becomes playable before it is finished.
+TRANSCODE_PIPELINE = {
+    "ENABLED": os.getenv("TRANSCODE_PIPELINE_ENABLED", "false").lower() == "true",
+    "EVENT_PLAYLISTS": os.getenv("TRANSCODE_PIPELINE_EVENT_PLAYLISTS", "false").lower() == "true",
+    "POLL_INTERVAL": float(os.getenv("TRANSCODE_PIPELINE_POLL_INTERVAL", 1.0))
+}
+
+# download: raw videos stored in S3 are streamed to AWS_TEMP_DOWNLOAD_DIR before transcoding. presigned: ffmpeg reads the
+# raw video over HTTP from a presigned url, so nothing is written to disk (needs an ffmpeg built with https support).
+TRANSCODE_INPUT = {
+    "MODE": os.getenv("TRANSCODE_INPUT_MODE", "download"),
+    "PRESIGNED_URL_EXPIRY": int(os.getenv("TRANSCODE_INPUT_PRESIGNED_URL_EXPIRY", 6 * 3600))
+}
+
+# single: all renditions in one ffmpeg process (ffmpeg_streaming). shared: one ffmpeg process that decodes the input
+# once for all renditions. parallel: one ffmpeg process per rendition, at most MAX_PARALLEL_PROCESSES at a time; the
+# master playlist only lists the renditions that completed.
+TRANSCODE_EXECUTION = {
+    "MODE": os.getenv("TRANSCODE_EXECUTION_MODE", "single"),
+    "MAX_PARALLEL_PROCESSES": int(os.getenv("TRANSCODE_EXECUTION_MAX_PARALLEL_PROCESSES", os.cpu_count() or 1))
+}
+
+# Fits TRANSCODING_CONFIGURATIONS to every source: rungs wider than the source are dropped, bitrates are capped at the
+# source's and rungs that would barely differ from the one below are merged. COMPLEXITY_ANALYSIS additionally encodes a
+# COMPLEXITY_SAMPLE_DURATION second sample to lower the bitrates of easy content (down to MIN_COMPLEXITY times the
+# static ones). The estimated savings are published with every video as ladder.json.
+TRANSCODE_LADDER = {
+    "ENABLED": os.getenv("TRANSCODE_LADDER_ENABLED", "true").lower() == "true",
+    "MIN_BITRATE_STEP": float(os.getenv("TRANSCODE_LADDER_MIN_BITRATE_STEP", 1.4)),
+    "COMPLEXITY_ANALYSIS": os.getenv("TRANSCODE_LADDER_COMPLEXITY_ANALYSIS", "false").lower() == "true",
+    "COMPLEXITY_SAMPLE_DURATION": float(os.getenv("TRANSCODE_LADDER_COMPLEXITY_SAMPLE_DURATION", 20)),
+    "REFERENCE_BITS_PER_PIXEL": float(os.getenv("TRANSCODE_LADDER_REFERENCE_BITS_PER_PIXEL", 0.1)),
+    "MIN_COMPLEXITY": float(os.getenv("TRANSCODE_LADDER_MIN_COMPLEXITY", 0.5)),
+    "MAX_COMPLEXITY": float(os.getenv("TRANSCODE_LADDER_MAX_COMPLEXITY", 1.0))
+}
+
+# Encoding profiles trade speed for quality per job (PUT /playlist/?profile=<name>). PRESET uses x264's names and is
+# mapped to the closest preset of other encoders. With CRF the encode targets a constant quality and the bitrates of the
+# ladder become caps of MAXRATE_FACTOR (and a VBV buffer of BUFSIZE_FACTOR) times the rendition's bitrate; without it
+# they are targets. Keyframes are placed every SEGMENT_DURATION seconds, the HLS segment duration. THREADS is per
+# ffmpeg process, 0 is automatic.
+TRANSCODE_PROFILES = {
+    "fast": {"PRESET": "veryfast", "THREADS": 0, "SEGMENT_DURATION": 6, "CRF": None, "MAXRATE_FACTOR": None,
+             "BUFSIZE_FACTOR": None},
+    "balanced": {"PRESET": "medium", "THREADS": 0, "SEGMENT_DURATION": 6, "CRF": 23, "MAXRATE_FACTOR": 1.0,
+                 "BUFSIZE_FACTOR": 2.0},
+    "archive": {"PRESET": "slow", "THREADS": 0, "SEGMENT_DURATION": 10, "CRF": 20, "MAXRATE_FACTOR": 1.5,
+                "BUFSIZE_FACTOR": 3.0},
+}
+TRANSCODE_DEFAULT_PROFILE = os.getenv("TRANSCODE_DEFAULT_PROFILE", "balanced")
+
+# FORMATS: hls, dash or hls,dash. SEGMENT_TYPE of HLS only output: mpegts or fmp4. DASH output, and HLS output along with
+# it, is made of fMP4 (CMAF) segments that one encode writes for both <manifest>.mpd and the HLS playlists. Only MPEG-TS
+# output is encrypted, so fMP4 output is refused unless ALLOW_UNENCRYPTED opts in to storing those videos unencrypted.
+# Chunked mode only produces MPEG-TS.
+TRANSCODE_OUTPUT = {
+    "FORMATS": [format.strip() for format in os.getenv("TRANSCODE_OUTPUT_FORMATS", "hls").split(",")
+                if len(format.strip()) > 0],
+    "SEGMENT_TYPE": os.getenv("TRANSCODE_OUTPUT_SEGMENT_TYPE", "mpegts"),
+    "ALLOW_UNENCRYPTED": os.getenv("TRANSCODE_OUTPUT_ALLOW_UNENCRYPTED", "false").lower() == "true"
+}
+if ("dash" in TRANSCODE_OUTPUT["FORMATS"] or TRANSCODE_OUTPUT["SEGMENT_TYPE"] != "mpegts") \
+        and not TRANSCODE_OUTPUT["ALLOW_UNENCRYPTED"]:
+    raise ImproperlyConfigured("DASH and fMP4 output cannot be encrypted. Set TRANSCODE_OUTPUT_ALLOW_UNENCRYPTED=true "
+                               "to store these videos unencrypted")
+
+# With SHARED the audio is encoded once per entry of BITRATES (bits per second, capped at the source's) into audio only
+# renditions that the master playlist references as EXT-X-MEDIA groups, and the video renditions carry no audio. Each
+# video rendition uses the highest of BITRATES not above the audio bitrate of its ladder rung. Otherwise every rendition
+# muxes its own encode of the audio at the bitrate of its rung.
+TRANSCODE_AUDIO = {
+    "SHARED": os.getenv("TRANSCODE_AUDIO_SHARED", "false").lower() == "true",
+    "BITRATES": [int(bitrate) for bitrate in os.getenv("TRANSCODE_AUDIO_BITRATES", "128000").split(",")
+                 if len(bitrate.strip()) > 0]
+}
+
+# Sources are identified by their SHA-256. A video whose source was already transcoded with the same ladder is not
+# transcoded again; an alias to the earlier video is stored instead. The index of transcoded sources lives in INDEX_DIR.
+TRANSCODE_DEDUPE = {
+    "ENABLED": os.getenv("TRANSCODE_DEDUPE_ENABLED", "true").lower() == "true",
+    "INDEX_DIR": os.getenv("TRANSCODE_DEDUPE_INDEX_DIR", f"{AWS_STREAM_UPLOAD_DIR}/dedupe")
+}
+
+# Chunked mode splits videos longer than MIN_DURATION seconds on keyframes into sections of about CHUNK_DURATION
+# seconds, transcodes them in parallel on any number of celery workers and stitches the results into one playlist.
+# Keyframes are only probed in the KEYFRAME_PROBE_WINDOW seconds around every split point, which should span the
+# longest keyframe interval of the sources.
+TRANSCODE_CHUNKING = {
+    "ENABLED": os.getenv("TRANSCODE_CHUNKING_ENABLED", "false").lower() == "true",
+    "MIN_DURATION": float(os.getenv("TRANSCODE_CHUNKING_MIN_DURATION", 300)),
+    "CHUNK_DURATION": float(os.getenv("TRANSCODE_CHUNKING_CHUNK_DURATION", 120)),
+    "KEYFRAME_PROBE_WINDOW": float(os.getenv("TRANSCODE_CHUNKING_KEYFRAME_PROBE_WINDOW", 10)),
+    "PRESIGNED_URL_EXPIRY": int(os.getenv("TRANSCODE_CHUNKING_PRESIGNED_URL_EXPIRY", 6 * 3600))
+}
+
+# Every transcoding job is recorded in Redis (a hash per video id, kept for TTL seconds) with its status, phase
+# (download, transcode, upload), progress, ETA and checkpoints, and is served at /jobs/<id>/. Progress is written at most
+# every PROGRESS_INTERVAL seconds. A job that is run again, e.g. after its worker was restarted, resumes from its last
+# checkpoint; `manage.py resume_transcode_jobs` queues again the running jobs not updated for STALE_AFTER seconds.
+TRANSCODE_JOBS = {
+    "ENABLED": os.getenv("TRANSCODE_JOBS_ENABLED", "true").lower() == "true",
+    "URL": os.getenv("TRANSCODE_JOBS_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379")),
+    "KEY_PREFIX": os.getenv("TRANSCODE_JOBS_KEY_PREFIX", "job:"),
+    "TTL": int(os.getenv("TRANSCODE_JOBS_TTL", 7 * 24 * 3600)),
+    "PROGRESS_INTERVAL": float(os.getenv("TRANSCODE_JOBS_PROGRESS_INTERVAL", 2.0)),
+    "STALE_AFTER": int(os.getenv("TRANSCODE_JOBS_STALE_AFTER", 900))
+}
+
+# Transcoding jobs are classed by the duration and size of their source, which a routing task probes on the queue of
+# the first of CLASSES (PROBE; otherwise every job is in DEFAULT_CLASS), and go to the QUEUE of the first of CLASSES
+# whose limits they are within (None is no limit). Sources that could not be probed are in DEFAULT_CLASS. Workers started without queues (celery worker -Q) consume those of CLASSES
+# in order, so short jobs are never queued behind long ones; workers consuming only the short queue are a fast lane:
+# celery -A streamingEngine worker -Q transcode_short. PRIORITY is the priority of their tasks (see
+# CELERY_BROKER_TRANSPORT_OPTIONS). The chunks of a video transcoded in chunks are queued like the video.
+TRANSCODE_ROUTING = {
+    "ENABLED": os.getenv("TRANSCODE_ROUTING_ENABLED", "true").lower() == "true",
+    "PROBE": os.getenv("TRANSCODE_ROUTING_PROBE", "true").lower() == "true",
+    "DEFAULT_CLASS": os.getenv("TRANSCODE_ROUTING_DEFAULT_CLASS", "standard"),
+    "CLASSES": [
+        {"NAME": "short", "QUEUE": os.getenv("TRANSCODE_ROUTING_SHORT_QUEUE", "transcode_short"), "PRIORITY": 0,
+         "MAX_DURATION": float(os.getenv("TRANSCODE_ROUTING_SHORT_MAX_DURATION", 300)),
+         "MAX_SIZE": int(os.getenv("TRANSCODE_ROUTING_SHORT_MAX_SIZE", 500 * 1024 * 1024))},
+        {"NAME": "standard", "QUEUE": os.getenv("TRANSCODE_ROUTING_STANDARD_QUEUE", "transcode"), "PRIORITY": 3,
+         "MAX_DURATION": float(os.getenv("TRANSCODE_ROUTING_STANDARD_MAX_DURATION", 3600)),
+         "MAX_SIZE": int(os.getenv("TRANSCODE_ROUTING_STANDARD_MAX_SIZE", 8 * 1024 * 1024 * 1024))},
+        {"NAME": "long", "QUEUE": os.getenv("TRANSCODE_ROUTING_LONG_QUEUE", "transcode_long"), "PRIORITY": 6,
+         "MAX_DURATION": None, "MAX_SIZE": None},
+    ]
+}
+
+# Tasks a worker runs at once. With CONCURRENCY 0 it is derived from the cores of the worker and THREADS_PER_JOB, the
+# cores a job keeps busy, which is itself derived from the THREADS of the default profile (all cores when automatic)
+# if 0. celery worker -c overrides it, e.g. for a fast lane worker.
+TRANSCODE_WORKER = {
+    "CONCURRENCY": int(os.getenv("TRANSCODE_WORKER_CONCURRENCY", 0)),
+    "THREADS_PER_JOB": int(os.getenv("TRANSCODE_WORKER_THREADS_PER_JOB", 0))
+}
+
+# Metrics in the Prometheus text format. Celery workers serve no HTTP, so every worker process writes its metrics to
+# TEXTFILE_DIR for node_exporter's textfile collector and/or pushes them to PUSHGATEWAY_URL, every INTERVAL seconds
+# from a thread. Web processes serve theirs on /metrics/; with more than one per host (e.g. gunicorn or uvicorn workers)
+# each only knows its own, so they export them the same way under WEB. /metrics/ then serves the metrics of every web
+# process of the host from WEB's TEXTFILE_DIR, which must be shared by them and only used by them; scrape either
+# /metrics/ or node_exporter for those, not both. Exported samples have a process label.
+METRICS = {
+    "ENABLED": os.getenv("METRICS_ENABLED", "true").lower() == "true",
+    "WORKER": {
+        "TEXTFILE_DIR": os.getenv("METRICS_TEXTFILE_DIR", ""),
+        "PUSHGATEWAY_URL": os.getenv("METRICS_PUSHGATEWAY_URL", ""),
+        "JOB": os.getenv("METRICS_JOB", "streamingengine_worker"),
+        "INTERVAL": float(os.getenv("METRICS_INTERVAL", 15))
+    },
+    "WEB": {
+        "TEXTFILE_DIR": os.getenv("METRICS_WEB_TEXTFILE_DIR", ""),
+        "PUSHGATEWAY_URL": os.getenv("METRICS_WEB_PUSHGATEWAY_URL", ""),
+        "JOB": os.getenv("METRICS_WEB_JOB", "streamingengine_web"),
+        "INTERVAL": float(os.getenv("METRICS_INTERVAL", 15))
+    }
+}
+
+# Spans of requests, task queueing and the phases of transcoding jobs, propagated to celery workers in the traceparent
+# header of task messages. They are exported as OTLP JSON to FILE (EXPORTER "file") or to an OpenTelemetry collector
+# at OTLP_ENDPOINT (EXPORTER "otlp"). SAMPLE_RATIO is the share of traces started by this service that are exported.
+TRACING = {
+    "ENABLED": os.getenv("TRACING_ENABLED", "false").lower() == "true",
+    "SERVICE_NAME": os.getenv("TRACING_SERVICE_NAME", "streamingEngine"),
+    "SAMPLE_RATIO": float(os.getenv("TRACING_SAMPLE_RATIO", 1.0)),
+    "EXPORTER": os.getenv("TRACING_EXPORTER", "file"),
+    "FILE": os.getenv("TRACING_FILE", os.path.join(BASE_DIR, 'traces.jsonl')),
+    "OTLP_ENDPOINT": os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"),
+    "BATCH_SIZE": int(os.getenv("TRACING_BATCH_SIZE", 512)),
+    "FLUSH_INTERVAL": float(os.getenv("TRACING_FLUSH_INTERVAL", 5))
+}
\ No newline at end of file
@@ -1,13 +1,35 @@
 import uuid
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple, Union
 
 from .backends.s3.s3 import S3
+from .backends.storageInterface import IStorageInterface
+from .backends.storage import get_storage, is_s3_storage
 from .backends.transcoder.transcoder import TranscoderConfiguration, Transcoder
-from .settings import AWS_TEMP_DOWNLOAD_DIR, TRANSCODE_COMPLETE_WEBHOOK
+from .backends.transcoder.hls import Rendition, AudioRendition, get_renditions, get_audio_renditions, \
+    is_variant_playlist, build_hls_command, run_ffmpeg, write_key_info_file, read_media_playlist, \
+    write_media_playlist, write_master_playlist, get_split_points, probe_keyframes, plan_chunks, \
+    SEGMENT_TYPE_MPEGTS
+from .backends.transcoder.mediainfo import MediaInfo, MEDIA_INFO_FILENAME, get_media_info, get_cached_media_info, \
+    remember_media_info
+from .backends.transcoder.ladder import LADDER_REPORT_FILENAME, analyze_complexity, plan_ladder, get_ladder_report, \
+    get_children_cpu_seconds
+from .backends.transcoder.profiles import EncodingProfile
+from .backends.jobs import JOB_STATUS_SUCCEEDED, PHASE_DOWNLOAD, PHASE_TRANSCODE, PHASE_UPLOAD, \
+    CHECKPOINT_DOWNLOADED, CHECKPOINT_TRANSCODED, CHECKPOINT_DISPATCHED, JobProgress, get_job_store, get_job_progress
+from .backends.tracing import get_current_span
+from .backends.routing import get_job_class, get_job_classes, get_task_route, is_routing_enabled
+from .backends.dedupe import ALIAS_FILENAME, INDEX_RECORD_FILENAME, HASH_CHUNK_SIZE, hash_chunks, hash_file, \
+    get_content_hasher, get_ladder_key, get_dedupe_index_path, load_json, save_json, load_content_hash, \
+    save_content_hash, add_alias_reference, remove_alias_reference
+from .settings import AWS_TEMP_DOWNLOAD_DIR, TRANSCODE_COMPLETE_WEBHOOK, TRANSCODE_UPLOAD, TRANSCODE_PIPELINE, \
+    TRANSCODE_CHUNKING, TRANSCODE_EXECUTION, TRANSCODE_INPUT, TRANSCODE_LADDER, TRANSCODE_DEDUPE, \
+    TRANSCODE_PROFILES, TRANSCODE_DEFAULT_PROFILE, TRANSCODE_AUDIO, TRANSCODE_OUTPUT, TRANSCODE_ROUTING
 
-import os, mimetypes, shutil
+import io, json, os, mimetypes, re, secrets, shutil, sys, threading, time
 
-from celery import shared_task
+from celery import shared_task, chord, group
 
 
 TRANSCODING_CONFIGURATIONS = [
@@ -18,130 +40,1014 @@ TRANSCODING_CONFIGURATIONS = [
 ]
 
 
-def get_video_from_s3(input_path:str, bucket:str, temp_directory_name="temp")->str:
+def get_encoding_profile(name:str=None) -> EncodingProfile:
+    if name is None or len(name) == 0:
+        name = TRANSCODE_DEFAULT_PROFILE
+    elif not name in TRANSCODE_PROFILES.keys():
+        print(f"Unknown encoding profile {name}, using {TRANSCODE_DEFAULT_PROFILE}")
+        name = TRANSCODE_DEFAULT_PROFILE
+    return EncodingProfile.from_settings(name, TRANSCODE_PROFILES[name])
+
+
+def get_shared_audio_bitrates() -> Union[List[int], None]:
+    return TRANSCODE_AUDIO["BITRATES"] if TRANSCODE_AUDIO["SHARED"] else None
+
+
+def get_output_manifest_filename(manifest_filename:str) -> str:
+    # The HLS master playlist, or the DASH manifest if only DASH is produced
+    if "hls" in TRANSCODE_OUTPUT["FORMATS"]:
+        return manifest_filename
+    return f"{os.path.splitext(manifest_filename)[0]}.mpd"
+
+
+def download_and_hash(storage:IStorageInterface, bucket:str, input_path:str, destination_filepath:str, hasher,
+                      progress:Callable[[int, int], None]=None) -> bool:
+    # Streamed in order so that the source is hashed as it is written, instead of being read again afterwards
+    file = storage.get_file_stream(basedir=bucket, path=input_path)
+    if file is None:
+        return False
+    size = file.content_length or 0
+    downloaded = 0
+    with open(destination_filepath, "wb") as f:
+        for chunk in file.chunks(chunk_size=HASH_CHUNK_SIZE):
+            f.write(chunk)
+            hasher.update(chunk)
+            downloaded += len(chunk)
+            if not (progress is None):
+                progress(downloaded, size)
+    return size == 0 or downloaded == size
+
+
+def get_video_from_s3(input_path:str, bucket:str, temp_directory_name="temp",
+                      progress:Callable[[int, int], None]=None, hasher=None)->str:
+    """
+    Downloads a raw video to a temp file and returns its path. If a hasher is given the video is fed to it while it
+    is downloaded, in one ordered stream instead of parallel ranged GETs.
+    """
     if (input_path is None) or (bucket) is None:
         print("Provide a bucket name and input filepath")
         return None
 
-    storage = S3()
+    storage = get_storage()
     is_file = storage.does_file_exist(basedir=bucket, path=input_path)
     if is_file:
-        file = storage.get_file(basedir=bucket, path=input_path)
-        if not (file is None) and not (file.file is None):
-            file_extension = input_path.split(".")[-1]
-            temp_filename = str(uuid.uuid4()) + "." + file_extension
+        file_extension = input_path.split(".")[-1]
+        temp_filename = str(uuid.uuid4()) + "." + file_extension
 
-            try:
-                if not (temp_directory_name is None) and len(temp_directory_name) > 0:
-                    if not os.path.exists(temp_directory_name):
-                        os.makedirs(temp_directory_name)
+        try:
+            if not (temp_directory_name is None) and len(temp_directory_name) > 0:
+                if not os.path.exists(temp_directory_name):
+                    os.makedirs(temp_directory_name)
 
-                temp_filename = os.path.join(temp_directory_name, temp_filename)
-                with open(temp_filename, 'wb') as f:
-                    f.write(file.file)
+            temp_filename = os.path.join(temp_directory_name, temp_filename)
+            # Streamed to disk in chunks, the video is never held in memory as a whole
+            if not (hasher is None):
+                downloaded = download_and_hash(storage=storage, bucket=bucket, input_path=input_path,
+                                               destination_filepath=temp_filename, hasher=hasher, progress=progress)
+            else:
+                downloaded = storage.download_file(basedir=bucket, path=input_path,
+                                                   destination_filepath=temp_filename, progress=progress)
+            if downloaded:
                 return temp_filename
-            except Exception as e:
-                print(f"Could not save S3 file to temp path")
-                print(e)
-        else:
             print(f"Could not fetch file from the url {input_path}")
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+        except Exception as e:
+            print(f"Could not save S3 file to temp path")
+            print(e)
 
     else:
         print(f"The s3 url {input_path} does not match any file")
     return None
 
-def upload_all_files_to_s3(input_path: str, bucket: str,
-                                  relative_output_path: str) -> bool:
-    if not os.path.exists(input_path):
+def get_source_media_info(storage:IStorageInterface, bucket:str, input_filepath:str, probe_input:str) -> MediaInfo:
+    """
+    Probes a raw video stored in S3 at most once. The result is kept in memory for the rest of the job and next to the
+    source as {input_filepath}.mediainfo.json, so later jobs on the same source skip ffprobe altogether. probe_input
+    is what ffprobe reads if the source has not been probed yet: a local copy or a presigned url.
+    """
+    cache_key = f"{bucket}/{input_filepath}"
+    media_info = get_cached_media_info(cache_key)
+    if not (media_info is None):
+        return media_info
+    sidecar_path = f"{input_filepath}.{MEDIA_INFO_FILENAME}"
+    if storage.does_file_exist(basedir=bucket, path=sidecar_path):
+        sidecar = storage.get_file(basedir=bucket, path=sidecar_path)
+        if not (sidecar is None):
+            try:
+                media_info = MediaInfo.from_json(sidecar.file)
+            except (ValueError, TypeError) as e:
+                print(f"Ignoring unreadable media info {sidecar_path}")
+                print(e)
+    if media_info is None:
+        media_info = get_media_info(probe_input, cache_key=cache_key)
+        if not storage.upload_file(basedir=bucket, data=io.BytesIO(media_info.to_json().encode()), path=sidecar_path,
+                                   content_type="application/json", overwrite=True):
+            print(f"Could not save media info of {input_filepath}")
+    remember_media_info(cache_key, media_info)
+    return media_info
+
+
+def plan_transcoding_configurations(input_filepath:str, media_info:MediaInfo) \
+        -> Tuple[List[TranscoderConfiguration], Union[float, None]]:
+    """
+    Returns the ladder to transcode a source with and its complexity, if it was analyzed.
+    """
+    if not TRANSCODE_LADDER["ENABLED"]:
+        return TRANSCODING_CONFIGURATIONS, None
+    complexity = None
+    if TRANSCODE_LADDER["COMPLEXITY_ANALYSIS"]:
+        complexity = analyze_complexity(input_filepath=input_filepath, media_info=media_info,
+                                        sample_duration=TRANSCODE_LADDER["COMPLEXITY_SAMPLE_DURATION"],
+                                        reference_bits_per_pixel=TRANSCODE_LADDER["REFERENCE_BITS_PER_PIXEL"])
+    configurations = plan_ladder(TRANSCODING_CONFIGURATIONS, media_info=media_info, complexity=complexity,
+                                 min_bitrate_step=TRANSCODE_LADDER["MIN_BITRATE_STEP"],
+                                 min_complexity=TRANSCODE_LADDER["MIN_COMPLEXITY"],
+                                 max_complexity=TRANSCODE_LADDER["MAX_COMPLEXITY"])
+    print(f"Planned {len(configurations)} of {len(TRANSCODING_CONFIGURATIONS)} renditions for {input_filepath}")
+    return configurations, complexity
+
+
+def save_ladder_report(path:str, configurations:List[TranscoderConfiguration], media_info:MediaInfo,
+                       complexity:float=None, cpu_seconds:float=None):
+    report = get_ladder_report(static=TRANSCODING_CONFIGURATIONS, planned=configurations, media_info=media_info,
+                               complexity=complexity, cpu_seconds=cpu_seconds)
+    print(f"Ladder saves about {report['bytes_saved']} bytes and {report['cpu_seconds_saved']} CPU seconds")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def get_source_content_hash(storage:IStorageInterface, bucket:str, input_filepath:str,
+                            local_filepath:str=None) -> Union[str, None]:
+    """
+    Returns the SHA-256 of a raw video stored in S3. Videos uploaded through S3MultipartUploadHandler are hashed
+    while they are uploaded. Others are hashed from local_filepath, or by streaming them from S3, and the hash is
+    saved next to the video for later jobs.
+    """
+    content_hash = load_content_hash(storage, basedir=bucket, path=input_filepath)
+    if not (content_hash is None):
+        return content_hash
+    if not (local_filepath is None):
+        content_hash = hash_file(local_filepath)
+    else:
+        file = storage.get_file_stream(basedir=bucket, path=input_filepath)
+        if file is None:
+            return None
+        content_hash = hash_chunks(file.chunks(chunk_size=HASH_CHUNK_SIZE))
+    save_content_hash(storage, basedir=bucket, path=input_filepath, content_hash=content_hash)
+    return content_hash
+
+
+def get_transcode_dedupe_index_path(content_hash:str, video_folder_name:str, manifest_filename:str,
+                                    encoding_profile:EncodingProfile) -> str:
+    # The ladder is planned from the source, so the static ladder and the planner settings identify the output
+    transcoder = Transcoder()
+    ladder_key = get_ladder_key({
+        "configurations": TRANSCODING_CONFIGURATIONS, "ladder": TRANSCODE_LADDER,
+        "codecs": [transcoder.output_video_codec, transcoder.output_audio_codec], "profile": encoding_profile,
+        "audio": get_shared_audio_bitrates(), "output": TRANSCODE_OUTPUT,
+        "video_folder_name": video_folder_name, "manifest_filename": manifest_filename
+    })
+    return get_dedupe_index_path(TRANSCODE_DEDUPE["INDEX_DIR"], content_hash, ladder_key)
+
+
+def alias_transcoded_duplicate(storage:IStorageInterface, bucket:str, dedupe_index_path:str,
+                               output_storage_filepath:str, video_folder_name:str, manifest_filename:str) -> bool:
+    """
+    Points output_storage_filepath at an earlier transcode of the same source with the same ladder, if it is still
+    stored, by saving an alias record that the views resolve. The alias is referenced by the earlier video first, so
+    that the earlier video is not deleted from under it (see dedupe.release_transcoded_video). Returns False if the
+    source has to be transcoded.
+    """
+    record = load_json(storage, basedir=bucket, path=dedupe_index_path)
+    if record is None or record.get("path") == output_storage_filepath:
+        return False
+    original = record["path"]
+    if not add_alias_reference(storage, basedir=bucket, original=original, alias=output_storage_filepath):
         return False
+    # A video that is being deleted is taken out of the index before its references are counted, so if it is still
+    # in the index now, the reference has been or will be counted
+    record = load_json(storage, basedir=bucket, path=dedupe_index_path)
+    manifest_path = f"{original}/{video_folder_name}/{get_output_manifest_filename(manifest_filename)}"
+    if record is None or record.get("path") != original \
+            or not storage.does_file_exist(basedir=bucket, path=manifest_path) \
+            or not save_json(storage, basedir=bucket, path=f"{output_storage_filepath}/{ALIAS_FILENAME}",
+                             data={"path": original}):
+        # The earlier video is being or has been deleted since, or the alias could not be saved
+        remove_alias_reference(storage, basedir=bucket, original=original, alias=output_storage_filepath)
+        return False
+    print(f"The source of {output_storage_filepath} was already transcoded to {original}")
+    return True
+
+
+def remember_transcoded_video(storage:IStorageInterface, bucket:str, dedupe_index_path:str,
+                              output_storage_filepath:str):
+    # The video keeps the path of its record, which is taken out of the index when the video is deleted
+    if not save_json(storage, basedir=bucket, path=dedupe_index_path, data={"path": output_storage_filepath}) \
+            or not save_json(storage, basedir=bucket, path=f"{output_storage_filepath}/{INDEX_RECORD_FILENAME}",
+                             data={"path": dedupe_index_path}):
+        print(f"Could not add {output_storage_filepath} to the index of transcoded videos")
+
 
+class UploadProgress(object):
+    def __init__(self, total_files:int, total_bytes:int, callback:Callable[[float], None]=None):
+        self.lock = threading.Lock()
+        self.callback = callback
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.uploaded_files = 0
+        self.uploaded_bytes = 0
+        self.failed_files = 0
+
+    def __call__(self, size:int, success:bool):
+        with self.lock:
+            if success:
+                self.uploaded_files += 1
+                self.uploaded_bytes += size
+            else:
+                self.failed_files += 1
+            per = round(self.uploaded_bytes / self.total_bytes * 100) if self.total_bytes > 0 else 100
+            sys.stdout.write(
+                "\rUploading...(%s%%) %s/%s files, %s failed [%s%s]" %
+                (per, self.uploaded_files, self.total_files, self.failed_files, '#' * per, '-' * (100 - per))
+            )
+            sys.stdout.flush()
+            if not (self.callback is None):
+                self.callback(per)
+
+
+def get_mimetype(filepath:str) -> str:
+    if filepath.endswith(".ts"):
+        return "video/mp2t"  # mimetypes package does not recognize hls ts files
+    mimetype = mimetypes.guess_type(filepath)[0]
+    if mimetype is None:
+        mimetype = 'text/html'
+    return mimetype
+
+
+def is_manifest(filepath:str) -> bool:
+    return filepath.endswith(".m3u8") or filepath.endswith(".mpd")
+
+
+def get_files_to_upload(input_path:str, relative_output_path:str) -> List[Tuple[str, str]]:
+    """
+    Walks the directory tree once and returns (local filepath, storage path) pairs for every file in it.
+    """
     if os.path.isfile(input_path):
-        if input_path.endswith(".ts"):
-            mimetype = "video/mp2t"  # mimetypes package does not recognize hls ts files
-        else:
-            mimetype = mimetypes.guess_type(input_path)[0]
-            if mimetype is None:
-                mimetype = 'text/html'
-        storage = S3()
-        storage.upload_file(
+        return [(input_path, relative_output_path)]
+    files = []
+    for directory, _, filenames in os.walk(input_path):
+        relative_directory = os.path.relpath(directory, input_path).replace(os.sep, "/")
+        for filename in filenames:
+            storage_path = f"{relative_output_path}/{filename}" if relative_directory == "." \
+                else f"{relative_output_path}/{relative_directory}/{filename}"
+            files.append((os.path.join(directory, filename), storage_path))
+    return files
+
+
+def upload_file_to_s3(storage:IStorageInterface, bucket:str, filepath:str, storage_path:str, max_attempts:int,
+                      retry_backoff:float, content:bytes=None) -> bool:
+    """
+    Uploads filepath, or content in its place if given, retrying with exponential backoff.
+    """
+    for attempt in range(1, max_attempts + 1):
+        uploaded = storage.upload_file(
             basedir=bucket,
-            data=input_path,
-            path=relative_output_path,
-            content_type=mimetype,
-            use_concurrency=True,
-            create_basedir_if_not_exist=True
+            data=filepath if content is None else io.BytesIO(content),
+            path=storage_path,
+            content_type=get_mimetype(filepath),
+            create_basedir_if_not_exist=True,
+            overwrite=True
         )
-        return True
+        if uploaded:
+            return True
+        if attempt < max_attempts:
+            print(f"Retrying upload of {filepath} ({attempt}/{max_attempts} attempts failed)")
+            time.sleep(retry_backoff * 2 ** (attempt - 1))
+    print(f"Could not upload {filepath} to {bucket}/{storage_path}")
+    return False
+
+
+def upload_all_files_to_s3(input_path: str, bucket: str,
+                                  relative_output_path: str, progress:Callable[[float], None]=None) -> bool:
+    """
+    Uploads a file or a whole directory tree with a bounded pool of threads sharing one S3 client. Manifests are
+    uploaded only after every segment is in place so that a player never sees a playlist referencing missing
+    segments. progress is called with the percentage of bytes uploaded. Returns True only if every file was uploaded.
+    """
+    if not os.path.exists(input_path):
+        return False
+
+    files = get_files_to_upload(input_path=input_path, relative_output_path=relative_output_path)
+    progress = UploadProgress(total_files=len(files), total_bytes=sum(os.path.getsize(f) for f, _ in files),
+                              callback=progress)
+    storage = get_storage()
+    upload_settings = TRANSCODE_UPLOAD
+
+    def upload(file:Tuple[str, str]) -> bool:
+        filepath, storage_path = file
+        uploaded = upload_file_to_s3(
+            storage=storage, bucket=bucket, filepath=filepath, storage_path=storage_path,
+            max_attempts=upload_settings["MAX_ATTEMPTS"], retry_backoff=upload_settings["RETRY_BACKOFF"]
+        )
+        progress(size=os.path.getsize(filepath), success=uploaded)
+        return uploaded
+
+    success = True
+    with ThreadPoolExecutor(max_workers=upload_settings["MAX_WORKERS"]) as executor:
+        for batch in [[f for f in files if not is_manifest(f[0])], [f for f in files if is_manifest(f[0])]]:
+            results = list(executor.map(upload, batch))
+            if not all(results):
+                success = False
+                break
+    print()
+    return success
+
+
+# URI of the initialization section of fMP4 segments
+MAP_URI_PATTERN = re.compile(r'URI="([^"]+)"')
+
+
+def is_segment(filepath:str) -> bool:
+    return filepath.endswith(".ts") or filepath.endswith(".m4s")
+
+
+class SegmentWatcher(threading.Thread):
+    """
+    Uploads the output of a running transcode while ffmpeg is still writing it. ffmpeg is expected to write every
+    segment to a .tmp file and rename it once complete (hls_flags=temp_file), so any segment present under its final
+    name is complete. Uploaded segments are deleted locally to bound disk usage. Manifests are only published by
+    finish(), unless event playlists are enabled, in which case variant playlists are re-published as they grow and
+    the master playlist is published once every variant playlist is available. A published revision of a playlist only
+    lists segments that were already uploaded.
+    """
+
+    def __init__(self, watch_dir:str, bucket:str, relative_output_path:str, publish_event_playlists:bool=False,
+                 poll_interval:float=1.0):
+        super().__init__(daemon=True)
+        self.watch_dir = watch_dir
+        self.bucket = bucket
+        self.relative_output_path = relative_output_path
+        self.publish_event_playlists = publish_event_playlists
+        self.poll_interval = poll_interval
+        self.storage = get_storage()
+        self.stop_event = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=TRANSCODE_UPLOAD["MAX_WORKERS"])
+        self.lock = threading.Lock()
+        self.submitted = set()
+        self.uploaded = set()
+        self.futures = []
+        self.published_playlists = {}
+        self.failed = False
+
+    def __upload(self, filepath:str, storage_path:str, delete:bool) -> bool:
+        uploaded = upload_file_to_s3(
+            storage=self.storage, bucket=self.bucket, filepath=filepath, storage_path=storage_path,
+            max_attempts=TRANSCODE_UPLOAD["MAX_ATTEMPTS"], retry_backoff=TRANSCODE_UPLOAD["RETRY_BACKOFF"]
+        )
+        if not uploaded:
+            self.failed = True
+        else:
+            self.uploaded.add(os.path.normpath(filepath))
+            if delete:
+                os.remove(filepath)
+        return uploaded
+
+    def __is_uploaded(self, directory:str, uri:str) -> bool:
+        return os.path.normpath(os.path.join(directory, uri)) in self.uploaded
+
+    def get_publishable_revision(self, filepath:str) -> Union[str, None]:
+        """
+        The current revision of a media playlist cut before the first segment that is not uploaded yet, e.g. one
+        that ffmpeg closed after the files to upload were listed. None if it does not list any uploaded segment.
+        """
+        directory = os.path.dirname(filepath)
+        with open(filepath, "r") as f:
+            lines = f.read().splitlines()
+        revision = []
+        # Tags of the next segment, e.g. its #EXTINF
+        pending = []
+        for line in lines:
+            stripped = line.strip()
+            if len(stripped) > 0 and not stripped.startswith("#"):
+                if not self.__is_uploaded(directory, stripped):
+                    break
+                revision += pending + [line]
+                pending = []
+                continue
+            if stripped.startswith("#EXT-X-MAP:"):
+                match = MAP_URI_PATTERN.search(stripped)
+                if not (match is None) and not self.__is_uploaded(directory, match.group(1)):
+                    break
+            pending.append(line)
+        else:
+            revision += pending
+        if not any(len(line.strip()) > 0 and not line.strip().startswith("#") for line in revision):
+            return None
+        return "\n".join(revision) + "\n"
+
+    def __publish_playlists(self):
+        playlists = [(f, p) for f, p in get_files_to_upload(self.watch_dir, self.relative_output_path)
+                     if is_manifest(f)]
+        variants = [(f, p) for f, p in playlists if not self.__is_master_playlist(f)]
+        for filepath, storage_path in variants:
+            revision = self.get_publishable_revision(filepath)
+            if not (revision is None) and self.published_playlists.get(filepath) != revision:
+                if upload_file_to_s3(storage=self.storage, bucket=self.bucket, filepath=filepath,
+                                     storage_path=storage_path, max_attempts=TRANSCODE_UPLOAD["MAX_ATTEMPTS"],
+                                     retry_backoff=TRANSCODE_UPLOAD["RETRY_BACKOFF"], content=revision.encode()):
+                    self.published_playlists[filepath] = revision
+        if len(variants) > 0 and all(f in self.published_playlists.keys() for f, _ in variants):
+            for filepath, storage_path in playlists:
+                if self.__is_master_playlist(filepath) and not (filepath in self.published_playlists.keys()):
+                    if self.__upload(filepath=filepath, storage_path=storage_path, delete=False):
+                        self.published_playlists[filepath] = None
+
+    def __is_master_playlist(self, filepath:str) -> bool:
+        return not is_variant_playlist(filepath)
+
+    def upload_completed_files(self):
+        if not os.path.exists(self.watch_dir):
+            return
+        with self.lock:
+            for filepath, storage_path in get_files_to_upload(self.watch_dir, self.relative_output_path):
+                if filepath.endswith(".tmp") or is_manifest(filepath) or filepath in self.submitted:
+                    continue
+                self.submitted.add(filepath)
+                self.futures.append(self.executor.submit(
+                    self.__upload, filepath=filepath, storage_path=storage_path, delete=is_segment(filepath)
+                ))
+            if self.publish_event_playlists:
+                # Only segments whose upload completed are listed in the published playlists
+                self.__publish_playlists()
+
+    def run(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.upload_completed_files()
+            except Exception as e:
+                print(f"Error uploading transcoded files from {self.watch_dir}")
+                print(e)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.executor.shutdown(wait=True)
+
+    def finish(self) -> bool:
+        """
+        Uploads whatever is left once ffmpeg has exited, publishing the final playlists last. Returns True only if
+        every file of the output was uploaded.
+        """
+        self.stop_event.set()
+        self.join()
+        self.upload_completed_files()
+        self.executor.shutdown(wait=True)
+        if self.failed or not all(future.result() for future in self.futures):
+            return False
+        remaining = [(f, p) for f, p in get_files_to_upload(self.watch_dir, self.relative_output_path)
+                     if is_manifest(f)]
+        remaining.sort(key=lambda file: self.__is_master_playlist(file[0]))
+        return all(self.__upload(filepath=f, storage_path=p, delete=False) for f, p in remaining)
+
+
+def classify_transcode_job(input_filepath:str, s3_bucket_name:str="") -> dict:
+    """
+    The class of a job (see settings.TRANSCODE_ROUTING) from the probe of its source, a local file or a file of the
+    storage in s3_bucket_name. The media info of stored sources is kept next to them, so the worker that transcodes
+    them does not probe them again. Sources that cannot be probed get the default class.
+    """
+    media_info = None
+    if TRANSCODE_ROUTING["PROBE"]:
+        try:
+            if s3_bucket_name is None or len(s3_bucket_name) == 0:
+                media_info = get_media_info(input_filepath)
+            else:
+                storage = get_storage()
+                if is_s3_storage():
+                    probe_input = storage.get_presigned_url(basedir=s3_bucket_name, path=input_filepath,
+                                                            expires_in=TRANSCODE_INPUT["PRESIGNED_URL_EXPIRY"])
+                else:
+                    probe_input = storage.get_filepath(basedir=s3_bucket_name, path=input_filepath)
+                if not (probe_input is None):
+                    media_info = get_source_media_info(storage=storage, bucket=s3_bucket_name,
+                                                       input_filepath=input_filepath, probe_input=probe_input)
+        except Exception as e:
+            print(f"Could not probe {input_filepath}. Queueing it in the default class")
+            print(e)
+    if media_info is None:
+        return get_job_class()
+    return get_job_class(duration=media_info.duration, size=media_info.size)
+
+
+def start_transcode_job(**kwargs) -> str:
+    """
+    Records a transcoding job and queues transcode_video with kwargs, which are kept with the job so that it can be
+    queued again. Returns the id of the job, i.e. of the transcoded video. If the class of the job is told from a
+    probe of its source, route_transcode_job is queued instead to probe it on a worker, as a slow read of the source
+    must not hold the request.
+    """
+    job_id = kwargs["output_storage_filepath"].split("/")[-1]
+    job_class = get_job_class() if is_routing_enabled() and not TRANSCODE_ROUTING["PROBE"] else None
+    store = get_job_store()
+    if not (store is None):
+        store.create(job_id, task=kwargs, job_class=job_class["NAME"] if not (job_class is None) else None)
+    span = get_current_span()
+    if not (span is None):
+        span.set_attribute("job.id", job_id)
+    if is_routing_enabled() and TRANSCODE_ROUTING["PROBE"]:
+        # Ahead of the queued transcodes, so that a short job is not held up until their queues are drained
+        route_transcode_job.apply_async(kwargs=kwargs, **get_task_route(get_job_classes()[0]))
     else:
-        success = True
-        for file in os.listdir(input_path):
-            filepath = os.path.join(input_path, file)
-            relative_filepath = f"{relative_output_path}/{file}"
-            success = success and upload_all_files_to_s3(input_path=filepath, bucket=bucket, relative_output_path=relative_filepath)
-        return success
+        transcode_video.apply_async(kwargs=kwargs, **get_task_route(job_class))
+    return job_id
+
+
+@shared_task(acks_late=True)
+def route_transcode_job(**kwargs):
+    """
+    Classes a job queued by start_transcode_job from the probe of its source and queues transcode_video on the queue
+    of its class. Runs on the queue of the first class, whose tasks are short.
+    """
+    job_id = kwargs["output_storage_filepath"].split("/")[-1]
+    job_class = classify_transcode_job(kwargs["input_filepath"], kwargs.get("s3_bucket_name", ""))
+    store = get_job_store()
+    if not (store is None):
+        store.update(job_id, job_class=job_class["NAME"])
+    span = get_current_span()
+    if not (span is None):
+        span.set_attribute("job.id", job_id)
+        span.set_attribute("job.class", job_class["NAME"])
+    transcode_video.apply_async(kwargs=kwargs, **get_task_route(job_class))
+
+
+def finish_transcode_job(job_id:str, success:bool, errors:List[str], transcoded_video_id:str=None,
+                         job:JobProgress=None):
+    """
+    Records the outcome of a job and reports it to TRANSCODE_COMPLETE_WEBHOOK as transcoded_video_id (the id of the
+    job by default). job is the progress of the job in this task, if any, so that its last phase is timed.
+    """
+    (job if not (job is None) else get_job_progress(job_id)).finish(success=success, errors=errors)
+    try:
+        requests.post(TRANSCODE_COMPLETE_WEBHOOK, data={"errors": errors, "success": success,
+                                                        "id": transcoded_video_id or job_id})
+    except Exception as e:
+        print(f"Error sending completion message to {TRANSCODE_COMPLETE_WEBHOOK}")
+
+
+# Transcoding tasks are acknowledged once they ended, so the task of a worker that stopped is delivered again. Chunks
+# are transcoded again and jobs resume from their checkpoint
+@shared_task(acks_late=True)
+def transcode_video_chunk(chunk_index:int, input_url:str, start:float, end:float, renditions:List[dict],
+                          manifest_stem:str, segment_duration:int, key:str, iv:str, encryption_key_url:str,
+                          output_storage_basedir:str, output_storage_filepath:str, transcoding_base_output_dir:str,
+                          encoding_profile:dict=None, fps:float=None, audio_renditions:List[dict]=None,
+                          job_id:str=None, chunk_count:int=None):
+    """
+    Transcodes one keyframe aligned section of a video into every rendition and uploads its segments. Returns the
+    (duration, uri) segment list of each rendition, in the order of renditions, and of each shared audio rendition,
+    or None if the chunk failed. Errors are not raised so that the chord callback always runs and can report the
+    failure. The chunks completed so far are counted in the job's record.
+    """
+    chunk_dir = os.path.join(transcoding_base_output_dir, f"chunk_{chunk_index:04d}")
+    output_dir = os.path.join(chunk_dir, "output")
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        key_filepath = os.path.join(chunk_dir, "key")
+        with open(key_filepath, "wb") as f:
+            f.write(bytes.fromhex(key))
+        key_info_filepath = os.path.join(chunk_dir, "key_info")
+        write_key_info_file(key_info_filepath=key_info_filepath, key_url=encryption_key_url,
+                            key_filepath=key_filepath, iv=iv)
+
+        chunk_renditions = [Rendition.from_dict(rendition) for rendition in renditions]
+        chunk_audio_renditions = [AudioRendition.from_dict(audio) for audio in audio_renditions] \
+            if not (audio_renditions is None) else None
+        command = build_hls_command(
+            input_filepath=input_url, renditions=chunk_renditions, output_dir=output_dir,
+            manifest_stem=manifest_stem, segment_duration=segment_duration, key_info_filepath=key_info_filepath,
+            start=start, end=end, segment_prefix=f"{chunk_index:04d}_",
+            encoding_profile=EncodingProfile.from_dict(encoding_profile) if not (encoding_profile is None) else None,
+            fps=fps, audio_renditions=chunk_audio_renditions
+        )
+        if not run_ffmpeg(command):
+            print(f"Could not transcode chunk {chunk_index} ({start}s - {end}s)")
+            return None
+
+        def read_playlist(filename:str) -> List[Tuple[float, str]]:
+            playlist = os.path.join(output_dir, filename)
+            segments = read_media_playlist(playlist)
+            # Only the stitched playlists are published
+            os.remove(playlist)
+            return segments
+
+        segments = [read_playlist(rendition.get_playlist_filename(manifest_stem)) for rendition in chunk_renditions]
+        audio_segments = [read_playlist(audio.get_playlist_filename(manifest_stem))
+                          for audio in chunk_audio_renditions or []]
+        if not upload_all_files_to_s3(input_path=output_dir, bucket=output_storage_basedir,
+                                      relative_output_path=output_storage_filepath):
+            print(f"Could not upload chunk {chunk_index}")
+            return None
+        store = get_job_store()
+        if not (job_id is None) and not (store is None):
+            completed_chunks = store.complete_chunk(job_id, chunk_index)
+            if not (completed_chunks is None) and not (chunk_count is None):
+                store.update(job_id, percent=round(completed_chunks / chunk_count * 100, 1))
+        return {"index": chunk_index, "segments": segments, "audio_segments": audio_segments}
+    except Exception as e:
+        print(f"Error transcoding chunk {chunk_index}")
+        print(e)
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+    return None
 
 
 @shared_task
+def stitch_transcoded_chunks(chunk_results:List[dict], renditions:List[dict], manifest_filename:str, iv:str,
+                             encryption_key_url:str, output_storage_basedir:str, output_storage_filepath:str,
+                             video_folder_name:str, transcoding_base_output_dir:str, dedupe_index_path:str=None,
+                             audio_renditions:List[dict]=None):
+    """
+    Joins the segment lists of every chunk into one continuous playlist per rendition, writes the master playlist
+    and publishes them once every chunk has been uploaded.
+    """
+    errors = []
+    success = False
+    transcoded_video_id = output_storage_filepath.split("/")[-1]
+    job = get_job_progress(transcoded_video_id)
+    try:
+        if any(result is None for result in chunk_results):
+            errors.append(f"{len([r for r in chunk_results if r is None])} of {len(chunk_results)} chunks failed")
+        else:
+            chunk_results = sorted(chunk_results, key=lambda result: result["index"])
+            stitched_renditions = [Rendition.from_dict(rendition) for rendition in renditions]
+            stitched_audio_renditions = [AudioRendition.from_dict(audio) for audio in audio_renditions] \
+                if not (audio_renditions is None) else None
+            manifest_stem = os.path.splitext(manifest_filename)[0]
+            output_dir = os.path.join(transcoding_base_output_dir, "stitched", video_folder_name)
+            os.makedirs(output_dir, exist_ok=True)
+            for key, variants in (("segments", stitched_renditions),
+                                  ("audio_segments", stitched_audio_renditions or [])):
+                for index, variant in enumerate(variants):
+                    segments = [tuple(segment) for result in chunk_results for segment in result[key][index]]
+                    write_media_playlist(path=os.path.join(output_dir, variant.get_playlist_filename(manifest_stem)),
+                                         segments=segments, key_url=encryption_key_url, iv=iv)
+            write_master_playlist(path=os.path.join(output_dir, manifest_filename), renditions=stitched_renditions,
+                                  manifest_stem=manifest_stem, audio_renditions=stitched_audio_renditions)
+            job.start_phase(PHASE_UPLOAD)
+            success = upload_all_files_to_s3(input_path=output_dir, bucket=output_storage_basedir,
+                                             relative_output_path=f"{output_storage_filepath}/{video_folder_name}")
+            if success:
+                print(f"Successfully uploaded video to {output_storage_basedir}/{output_storage_filepath}")
+                if not (dedupe_index_path is None):
+                    remember_transcoded_video(storage=get_storage(), bucket=output_storage_basedir,
+                                              dedupe_index_path=dedupe_index_path,
+                                              output_storage_filepath=output_storage_filepath)
+            else:
+                errors.append(f"Error uploading playlists to {output_storage_basedir}/{output_storage_filepath}")
+    except Exception as e:
+        errors.append(str(e))
+    finally:
+        shutil.rmtree(transcoding_base_output_dir, ignore_errors=True)
+
+    finish_transcode_job(transcoded_video_id, success=success, errors=errors, job=job)
+
+
+def transcode_video_in_chunks(input_filepath:str, s3_bucket_name:str, transcoding_base_output_dir:str,
+                              video_folder_name:str, manifest_filename:str, encryption_key_filename:str,
+                              encryption_key_url:str, output_storage_basedir:str, output_storage_filepath:str,
+                              encoding_profile:EncodingProfile, dedupe_index_path:str=None) -> bool:
+    """
+    Splits a video stored in S3 on keyframes and fans the sections out to a celery chord of transcode_video_chunk
+    tasks, which read the source directly from a presigned url. stitch_transcoded_chunks publishes the result.
+    Returns False without dispatching anything if the video is too short to benefit from being split.
+    """
+    storage = S3()
+    input_url = storage.get_presigned_url(basedir=s3_bucket_name, path=input_filepath,
+                                          expires_in=TRANSCODE_CHUNKING["PRESIGNED_URL_EXPIRY"])
+    if input_url is None:
+        return False
+    media_info = get_source_media_info(storage=storage, bucket=s3_bucket_name, input_filepath=input_filepath,
+                                       probe_input=input_url)
+    duration = media_info.duration or 0
+    if duration < TRANSCODE_CHUNKING["MIN_DURATION"]:
+        return False
+    chunk_duration = TRANSCODE_CHUNKING["CHUNK_DURATION"]
+    keyframes = probe_keyframes(input_url, split_points=get_split_points(duration, chunk_duration),
+                                window=TRANSCODE_CHUNKING.get("KEYFRAME_PROBE_WINDOW", 10.0))
+    chunks = plan_chunks(keyframes=keyframes, duration=duration, chunk_duration=chunk_duration)
+    if len(chunks) < 2:
+        return False
+
+    configurations, complexity = plan_transcoding_configurations(input_filepath=input_url, media_info=media_info)
+    renditions = get_renditions(configurations, source_width=media_info.display_width,
+                                source_height=media_info.display_height)
+    audio_renditions = None
+    audio_bitrates = get_shared_audio_bitrates()
+    if not (audio_bitrates is None) and len(audio_bitrates) > 0 and media_info.has_audio:
+        audio_renditions = [audio.to_dict() for audio in get_audio_renditions(
+            renditions, bitrates=audio_bitrates, source_bitrate=media_info.audio_bitrate
+        )]
+    renditions = [rendition.to_dict() for rendition in renditions]
+
+    # Every chunk encrypts with the same key and an explicit IV so that their segments form one playlist
+    key = secrets.token_bytes(16)
+    iv = secrets.token_hex(16)
+    key_path = f"{output_storage_filepath}/{encryption_key_filename}"
+    os.makedirs(transcoding_base_output_dir, exist_ok=True)
+    key_filepath = os.path.join(transcoding_base_output_dir, encryption_key_filename)
+    with open(key_filepath, "wb") as f:
+        f.write(key)
+    if not upload_file_to_s3(storage=storage, bucket=output_storage_basedir, filepath=key_filepath,
+                             storage_path=key_path, max_attempts=TRANSCODE_UPLOAD["MAX_ATTEMPTS"],
+                             retry_backoff=TRANSCODE_UPLOAD["RETRY_BACKOFF"]):
+        os.remove(key_filepath)
+        return False
+    media_info_filepath = os.path.join(transcoding_base_output_dir, MEDIA_INFO_FILENAME)
+    media_info.save(media_info_filepath)
+    report_filepaths = [media_info_filepath]
+    if TRANSCODE_LADDER["ENABLED"]:
+        # The chunks are transcoded by other workers, so only the byte savings are reported
+        report_filepaths.append(os.path.join(transcoding_base_output_dir, LADDER_REPORT_FILENAME))
+        save_ladder_report(path=report_filepaths[-1], configurations=configurations, media_info=media_info,
+                           complexity=complexity)
+    for report_filepath in report_filepaths:
+        upload_file_to_s3(storage=storage, bucket=output_storage_basedir, filepath=report_filepath,
+                          storage_path=f"{output_storage_filepath}/{os.path.basename(report_filepath)}",
+                          max_attempts=TRANSCODE_UPLOAD["MAX_ATTEMPTS"],
+                          retry_backoff=TRANSCODE_UPLOAD["RETRY_BACKOFF"])
+
+    print(f"Transcoding video {input_filepath} in {len(chunks)} chunks")
+    job_id = output_storage_filepath.split("/")[-1]
+    # The chunks and the stitching are queued like the video, which is classed from the same probe
+    route = get_task_route(get_job_class(duration=duration, size=media_info.size))
+    get_job_progress(job_id).start_phase(PHASE_TRANSCODE, chunks=len(chunks), completed_chunks=0)
+    chord(group(
+        transcode_video_chunk.s(
+            chunk_index=index, input_url=input_url, start=start, end=end, renditions=renditions,
+            manifest_stem=os.path.splitext(manifest_filename)[0],
+            segment_duration=encoding_profile.segment_duration, key=key.hex(), iv=iv,
+            encryption_key_url=encryption_key_url, output_storage_basedir=output_storage_basedir,
+            output_storage_filepath=f"{output_storage_filepath}/{video_folder_name}",
+            transcoding_base_output_dir=transcoding_base_output_dir, encoding_profile=encoding_profile.to_dict(),
+            fps=media_info.fps, audio_renditions=audio_renditions, job_id=job_id, chunk_count=len(chunks)
+        ).set(**route) for index, (start, end) in enumerate(chunks)
+    ))(stitch_transcoded_chunks.s(
+        renditions=renditions, manifest_filename=manifest_filename, iv=iv, encryption_key_url=encryption_key_url,
+        output_storage_basedir=output_storage_basedir, output_storage_filepath=output_storage_filepath,
+        video_folder_name=video_folder_name, transcoding_base_output_dir=transcoding_base_output_dir,
+        dedupe_index_path=dedupe_index_path, audio_renditions=audio_renditions
+    ).set(**route))
+    get_job_progress(job_id).checkpoint(CHECKPOINT_DISPATCHED)
+    # The key travels in the task arguments and the reports were uploaded; the stitching may run on another worker,
+    # so nothing is left on this one
+    shutil.rmtree(transcoding_base_output_dir, ignore_errors=True)
+    return True
+
+
+@shared_task(acks_late=True)
 def transcode_video(input_filepath:str, transcoding_base_output_dir:str, video_folder_name:str, manifest_filename:str,
                     encryption_key_filename:str, encryption_key_url:str,
-                    output_storage_basedir:str, output_storage_filepath:str, s3_bucket_name:str=""):
+                    output_storage_basedir:str, output_storage_filepath:str, s3_bucket_name:str="",
+                    chunked:bool=None, encoding_profile:str=None):
+    """
+    Runs the transcoding job of one video. A job that runs again, e.g. because its worker was restarted, resumes from
+    the last checkpoint in its record: the downloaded source and the renditions transcoded so far are reused, and
+    dispatched chunks are not dispatched again.
+    """
 
     errors = []
     transcoded_video_id = input_filepath
     success = False
+    job_id = output_storage_filepath.split("/")[-1]
+    job = get_job_progress(job_id)
+    store = get_job_store()
+    span = get_current_span()
+    if not (span is None):
+        span.set_attribute("job.id", job_id)
+    record = (store.get(job_id) if not (store is None) else None) or {}
+    checkpoint = record.get("checkpoint")
+    if record.get("status") == JOB_STATUS_SUCCEEDED:
+        print(f"Transcoding job {job_id} already succeeded")
+        return
+    if checkpoint == CHECKPOINT_DISPATCHED:
+        print(f"The chunks of transcoding job {job_id} were already dispatched")
+        return
+    attempts = store.increment(job_id, "attempts") if not (store is None) else None
+    resume = not (attempts is None) and attempts > 1
 
     try:
         transcoded_video_output_dir = os.path.join(transcoding_base_output_dir, video_folder_name)
         encryption_key_path = os.path.join(transcoding_base_output_dir, encryption_key_filename)
         print(f"Transcoding video from {input_filepath} to {transcoded_video_output_dir}")
         use_s3 = not (s3_bucket_name) is None and len(s3_bucket_name) > 0
-        if use_s3:
-            downloaded_filepath = get_video_from_s3(input_path=input_filepath, bucket=s3_bucket_name,
-                                                    temp_directory_name=AWS_TEMP_DOWNLOAD_DIR)
-            if (downloaded_filepath is None) or len(downloaded_filepath) == 0:
-                print("Could not fetch file from S3. Aborting task")
-                errors.append(f"Could not fetch file from S3 {input_filepath}")
-                requests.post(TRANSCODE_COMPLETE_WEBHOOK, data={"errors": errors, "success": success, "id": transcoded_video_id})
+        if chunked is None:
+            chunked = TRANSCODE_CHUNKING["ENABLED"]
+        # Chunks are stitched into MPEG-TS playlists only
+        chunked = chunked and TRANSCODE_OUTPUT["FORMATS"] == ["hls"] \
+            and TRANSCODE_OUTPUT["SEGMENT_TYPE"] == SEGMENT_TYPE_MPEGTS
+        # Chunk tasks and presigned inputs read the source from a presigned url, which only S3 can sign
+        chunked = chunked and is_s3_storage()
+        presigned_input = TRANSCODE_INPUT["MODE"] == "presigned" and is_s3_storage()
+        encrypt = Transcoder.can_encrypt(TRANSCODE_OUTPUT["FORMATS"], TRANSCODE_OUTPUT["SEGMENT_TYPE"])
+        if not encrypt and not TRANSCODE_OUTPUT.get("ALLOW_UNENCRYPTED", False):
+            # Never publish clear segments for a video whose key url says it is protected
+            errors.append(f"{TRANSCODE_OUTPUT['FORMATS']} output with {TRANSCODE_OUTPUT['SEGMENT_TYPE']} segments "
+                          f"cannot be encrypted")
+            finish_transcode_job(job_id, success=success, errors=errors, transcoded_video_id=transcoded_video_id,
+                                 job=job)
+            return
+        profile = get_encoding_profile(encoding_profile)
+        storage = get_storage()
+        dedupe_index_path = None
+        content_hash = None
+        if TRANSCODE_DEDUPE["ENABLED"] and use_s3:
+            # Unless the source is downloaded anyway it is hashed by streaming it, if it was not hashed on upload
+            if chunked or presigned_input:
+                content_hash = get_source_content_hash(storage=storage, bucket=s3_bucket_name,
+                                                       input_filepath=input_filepath)
+            else:
+                content_hash = load_content_hash(storage, basedir=s3_bucket_name, path=input_filepath)
+            if not (content_hash is None):
+                dedupe_index_path = get_transcode_dedupe_index_path(content_hash, video_folder_name, manifest_filename,
+                                                                    profile)
+                if alias_transcoded_duplicate(storage=storage, bucket=output_storage_basedir,
+                                              dedupe_index_path=dedupe_index_path,
+                                              output_storage_filepath=output_storage_filepath,
+                                              video_folder_name=video_folder_name, manifest_filename=manifest_filename):
+                    success = True
+                    transcoded_video_id = output_storage_filepath.split("/")[-1]
+                    finish_transcode_job(job_id, success=success, errors=errors,
+                                         transcoded_video_id=transcoded_video_id, job=job)
+                    return
+        # Sections of the source are read straight from S3 by every chunk task, so only S3 inputs can be split
+        if chunked and use_s3 and transcode_video_in_chunks(
+            input_filepath=input_filepath, s3_bucket_name=s3_bucket_name,
+            transcoding_base_output_dir=transcoding_base_output_dir, video_folder_name=video_folder_name,
+            manifest_filename=manifest_filename, encryption_key_filename=encryption_key_filename,
+            encryption_key_url=encryption_key_url, output_storage_basedir=output_storage_basedir,
+            output_storage_filepath=output_storage_filepath, encoding_profile=profile,
+            dedupe_index_path=dedupe_index_path
+        ):
+            return
+        downloaded_filepath = None
+        if use_s3 and presigned_input:
+            # ffmpeg reads the raw video straight from S3, it is never downloaded
+            input_filepath = storage.get_presigned_url(basedir=s3_bucket_name, path=input_filepath,
+                                                       expires_in=TRANSCODE_INPUT["PRESIGNED_URL_EXPIRY"])
+            if input_filepath is None:
+                errors.append(f"Could not create a presigned url for {transcoded_video_id}")
+                finish_transcode_job(job_id, success=success, errors=errors, transcoded_video_id=transcoded_video_id,
+                                     job=job)
                 return
+        elif use_s3:
+            downloaded_filepath = record.get("downloaded_filepath") \
+                if checkpoint in (CHECKPOINT_DOWNLOADED, CHECKPOINT_TRANSCODED) else None
+            if not (downloaded_filepath is None) and os.path.isfile(downloaded_filepath):
+                print(f"Resuming transcoding job {job_id} with the video downloaded to {downloaded_filepath}")
+            else:
+                job.start_phase(PHASE_DOWNLOAD)
+                # A source from S3 that was not hashed on upload is hashed while it is downloaded
+                hasher = get_content_hasher() if TRANSCODE_DEDUPE["ENABLED"] and dedupe_index_path is None \
+                    and is_s3_storage() else None
+                downloaded_filepath = get_video_from_s3(
+                    input_path=input_filepath, bucket=s3_bucket_name, temp_directory_name=AWS_TEMP_DOWNLOAD_DIR,
+                    progress=lambda downloaded, size: job(downloaded / size * 100 if size > 0 else 100),
+                    hasher=hasher
+                )
+                if (downloaded_filepath is None) or len(downloaded_filepath) == 0:
+                    print("Could not fetch file from S3. Aborting task")
+                    errors.append(f"Could not fetch file from S3 {input_filepath}")
+                    finish_transcode_job(job_id, success=success, errors=errors,
+                                         transcoded_video_id=transcoded_video_id, job=job)
+                    return
+                if not (hasher is None):
+                    content_hash = hasher.hexdigest()
+                    save_content_hash(storage, basedir=s3_bucket_name, path=input_filepath, content_hash=content_hash)
+                checkpoint = CHECKPOINT_DOWNLOADED
+                job.checkpoint(checkpoint, downloaded_filepath=downloaded_filepath)
             input_filepath = downloaded_filepath
-        
+        if TRANSCODE_DEDUPE["ENABLED"] and dedupe_index_path is None \
+                and (not use_s3 or not (downloaded_filepath is None)):
+            # Hashed from the local copy, unless it was hashed while it was downloaded
+            if not use_s3:
+                content_hash = hash_file(input_filepath)
+            elif content_hash is None:
+                content_hash = get_source_content_hash(storage=storage, bucket=s3_bucket_name,
+                                                       input_filepath=transcoded_video_id, local_filepath=input_filepath)
+            dedupe_index_path = get_transcode_dedupe_index_path(content_hash, video_folder_name, manifest_filename,
+                                                                profile)
+            if alias_transcoded_duplicate(storage=storage, bucket=output_storage_basedir,
+                                          dedupe_index_path=dedupe_index_path,
+                                          output_storage_filepath=output_storage_filepath,
+                                          video_folder_name=video_folder_name, manifest_filename=manifest_filename):
+                shutil.rmtree(transcoding_base_output_dir, ignore_errors=True)
+                if not (downloaded_filepath is None):
+                    os.remove(downloaded_filepath)
+                success = True
+                transcoded_video_id = output_storage_filepath.split("/")[-1]
+                finish_transcode_job(job_id, success=success, errors=errors, transcoded_video_id=transcoded_video_id,
+                                     job=job)
+                return
+        if use_s3:
+            media_info = get_source_media_info(storage=storage, bucket=s3_bucket_name, input_filepath=transcoded_video_id,
+                                               probe_input=input_filepath)
+        else:
+            media_info = get_media_info(input_filepath)
+        # Published with the transcoded video
+        media_info.save(os.path.join(transcoding_base_output_dir, MEDIA_INFO_FILENAME))
+        configurations, complexity = plan_transcoding_configurations(input_filepath=input_filepath,
+                                                                     media_info=media_info)
 
         transcoder = Transcoder()
+        hls_options = {}
+        watcher = None
+        # ffmpeg's dash muxer does not write segments to temporary files, so they cannot be picked up while it runs
+        if TRANSCODE_PIPELINE["ENABLED"] and not ("dash" in TRANSCODE_OUTPUT["FORMATS"]):
+            # Upload segments as soon as ffmpeg closes them instead of waiting for the whole transcode
+            hls_options["hls_flags"] = "temp_file"
+            if TRANSCODE_PIPELINE["EVENT_PLAYLISTS"]:
+                hls_options["hls_playlist_type"] = "event"
+            watcher = SegmentWatcher(
+                watch_dir=transcoding_base_output_dir,
+                bucket=output_storage_basedir,
+                relative_output_path=output_storage_filepath,
+                publish_event_playlists=TRANSCODE_PIPELINE["EVENT_PLAYLISTS"],
+                poll_interval=TRANSCODE_PIPELINE["POLL_INTERVAL"]
+            )
+            watcher.start()
         print(f"Transcoding video {input_filepath} to {transcoded_video_output_dir}")
-        res = transcoder.transcode(
-            input_filepath=input_filepath,
-            base_output_dir=transcoded_video_output_dir,
-            manifest_filename=manifest_filename,
-            configurations=TRANSCODING_CONFIGURATIONS,
-            encryption_key_directory=encryption_key_path,
-            encryption_key_url=encryption_key_url
-        )
+        cpu_seconds = get_children_cpu_seconds()
+        job.start_phase(PHASE_TRANSCODE)
+        try:
+            res = record.get("manifest_filepath") if checkpoint == CHECKPOINT_TRANSCODED else None
+            if not (res is None) and os.path.isfile(res):
+                print(f"Resuming transcoding job {job_id} with the video transcoded to {res}")
+            else:
+                res = transcoder.transcode(
+                    input_filepath=input_filepath,
+                    base_output_dir=transcoded_video_output_dir,
+                    manifest_filename=manifest_filename,
+                    configurations=configurations,
+                    output_formats=TRANSCODE_OUTPUT["FORMATS"],
+                    segment_type=TRANSCODE_OUTPUT["SEGMENT_TYPE"],
+                    encryption_key_directory=encryption_key_path if encrypt else None,
+                    encryption_key_url=encryption_key_url if encrypt else None,
+                    hls_options=hls_options,
+                    execution_mode=TRANSCODE_EXECUTION["MODE"],
+                    max_parallel_processes=TRANSCODE_EXECUTION["MAX_PARALLEL_PROCESSES"],
+                    media_info=media_info,
+                    encoding_profile=profile,
+                    audio_bitrates=get_shared_audio_bitrates(),
+                    progress=job,
+                    resume=resume
+                )
+        except Exception:
+            if not (watcher is None):
+                watcher.stop()
+            raise
 
         if not (res is None) and len(res) > 0:
             print(f"Successfully transcoded video and saved to {transcoded_video_output_dir}")
-            success = upload_all_files_to_s3(
-                input_path=transcoding_base_output_dir,
-                bucket=output_storage_basedir,
-                relative_output_path=output_storage_filepath
-            )
+            job.checkpoint(CHECKPOINT_TRANSCODED, manifest_filepath=res)
+            job.start_phase(PHASE_UPLOAD)
+            if TRANSCODE_LADDER["ENABLED"]:
+                if not (cpu_seconds is None):
+                    cpu_seconds = get_children_cpu_seconds() - cpu_seconds
+                save_ladder_report(path=os.path.join(transcoding_base_output_dir, LADDER_REPORT_FILENAME),
+                                   configurations=configurations, media_info=media_info, complexity=complexity,
+                                   cpu_seconds=cpu_seconds)
+            if not (watcher is None):
+                success = watcher.finish()
+            else:
+                success = upload_all_files_to_s3(
+                    input_path=transcoding_base_output_dir,
+                    bucket=output_storage_basedir,
+                    relative_output_path=output_storage_filepath,
+                    progress=job
+                )
             if success:
                 print(f"Deleting data from temp directory {transcoding_base_output_dir}")
                 shutil.rmtree(transcoding_base_output_dir, ignore_errors=False)
-                if use_s3:
+                if not (downloaded_filepath is None):
                     os.remove(downloaded_filepath)
                 transcoded_video_id = output_storage_filepath.split("/")[-1]
                 success = True
+                if not (dedupe_index_path is None):
+                    remember_transcoded_video(storage=storage, bucket=output_storage_basedir,
+                                              dedupe_index_path=dedupe_index_path,
+                                              output_storage_filepath=output_storage_filepath)
                 print(f"Successfully uploaded video to {output_storage_basedir}/{output_storage_filepath}")
             else:
                 errors.append(f"Error uploading video to {output_storage_basedir}/{output_storage_filepath}")
                 print(f"Error uploading video to {output_storage_basedir}/{output_storage_filepath}")
         else:
+            if not (watcher is None):
+                watcher.stop()
             errors.append(f"Error transcoding video from to {transcoded_video_output_dir}")
             print(f"Error transcoding video from to {transcoded_video_output_dir}")
     except Exception as e:
         errors.append(str(e))
 
-    try:
-        requests.post(TRANSCODE_COMPLETE_WEBHOOK, data={"errors": errors, "success": success, "id": transcoded_video_id})
-    except Exception as e:
-        print(f"Error sending completion message to {TRANSCODE_COMPLETE_WEBHOOK}")
\ No newline at end of file
+    finish_transcode_job(job_id, success=success, errors=errors, transcoded_video_id=transcoded_video_id,
+                         job=job)
\ No newline at end of file
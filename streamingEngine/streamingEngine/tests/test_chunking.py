@@ -0,0 +1,157 @@
+import os, shutil, tempfile
+from typing import Dict, List
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from streamingEngine import task
+from streamingEngine.backends.transcoder.hls import Rendition, get_split_points, plan_chunks, probe_keyframes, \
+    read_media_playlist
+
+
+RENDITIONS = [Rendition(width=640, height=360, video_bitrate=500000, audio_bitrate=128000),
+              Rendition(width=1280, height=720, video_bitrate=2000000, audio_bitrate=128000)]
+
+
+class PlanChunksTestCase(SimpleTestCase):
+    def test_without_keyframes_the_video_is_one_chunk(self):
+        self.assertEqual(plan_chunks(keyframes=[], duration=120, chunk_duration=30), [(0.0, None)])
+
+    def test_chunks_start_on_the_first_keyframe_of_each_split_point(self):
+        keyframes = [2.0 * index for index in range(50)]
+        self.assertEqual(plan_chunks(keyframes=keyframes, duration=100, chunk_duration=30),
+                         [(0.0, 30.0), (30.0, 60.0), (60.0, 90.0), (90.0, None)])
+
+    def test_late_keyframe_does_not_push_back_the_following_chunks(self):
+        keyframes = [0.0, 34.0, 60.0, 61.0, 90.0]
+        self.assertEqual(plan_chunks(keyframes=keyframes, duration=120, chunk_duration=30),
+                         [(0.0, 34.0), (34.0, 60.0), (60.0, 90.0), (90.0, None)])
+
+    def test_keyframe_past_several_split_points_skips_them(self):
+        self.assertEqual(plan_chunks(keyframes=[0.0, 70.0, 90.0], duration=120, chunk_duration=30),
+                         [(0.0, 70.0), (70.0, 90.0), (90.0, None)])
+
+    def test_short_tail_is_merged_into_the_last_chunk(self):
+        keyframes = [2.0 * index for index in range(50)]
+        # Splitting at 90 would leave a 5 second tail, less than a quarter of a chunk
+        self.assertEqual(plan_chunks(keyframes=keyframes, duration=95, chunk_duration=30),
+                         [(0.0, 30.0), (30.0, 60.0), (60.0, None)])
+
+    def test_split_points_skip_the_last_quarter(self):
+        self.assertEqual(get_split_points(duration=95, chunk_duration=30), [30, 60])
+        self.assertEqual(get_split_points(duration=100, chunk_duration=30), [30, 60, 90])
+        self.assertEqual(get_split_points(duration=20, chunk_duration=30), [])
+
+    def test_keyframes_are_probed_only_around_the_split_points(self):
+        packets = [{"pts_time": "30.5", "flags": "K__"}, {"pts_time": "31.0", "flags": "___"},
+                   {"pts_time": "N/A", "dts_time": "62.0", "flags": "K__"}, {"pts_time": "30.5", "flags": "K__"}]
+        with mock.patch("ffmpeg.probe", return_value={"packets": packets}) as probe:
+            self.assertEqual(probe_keyframes("input.mp4", split_points=[30, 60], window=5), [30.5, 62.0])
+        self.assertEqual(probe.call_args.kwargs["read_intervals"], "30%+5,60%+5")
+        with mock.patch("ffmpeg.probe") as probe:
+            self.assertEqual(probe_keyframes("input.mp4", split_points=[]), [])
+        probe.assert_not_called()
+
+
+def fake_ffmpeg(command:List[str], progress=None) -> bool:
+    """
+    Writes two segments and a media playlist for every HLS output of command instead of running it.
+    """
+    for index, argument in enumerate(command):
+        if argument != "-hls_segment_filename":
+            continue
+        segment_pattern = command[index + 1]
+        playlist = command[command.index("-strict", index) + 2]
+        uris = []
+        for number in range(2):
+            segment_filepath = segment_pattern.replace("%04d", f"{number:04d}")
+            with open(segment_filepath, "wb") as f:
+                f.write(b"segment")
+            uris.append(os.path.basename(segment_filepath))
+        with open(playlist, "w") as f:
+            f.write("#EXTM3U\n" + "".join(f"#EXTINF:4.000000,\n{uri}\n" for uri in uris) + "#EXT-X-ENDLIST\n")
+    return True
+
+
+class ChunkStitchingTestCase(SimpleTestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir, ignore_errors=True)
+        self.uploaded: Dict[str, List[str]] = {}
+
+    def upload(self, input_path:str, bucket:str, relative_output_path:str, progress=None) -> bool:
+        files = self.uploaded.setdefault(relative_output_path, [])
+        for directory, _, filenames in os.walk(input_path):
+            for filename in filenames:
+                files.append(os.path.relpath(os.path.join(directory, filename), input_path))
+        return True
+
+    def transcode_chunk(self, chunk_index:int, start:float, end:float) -> dict:
+        return task.transcode_video_chunk(
+            chunk_index=chunk_index, input_url="https://example.com/source.mp4", start=start, end=end,
+            renditions=[rendition.to_dict() for rendition in RENDITIONS], manifest_stem="master",
+            segment_duration=4, key="00" * 16, iv="11" * 16, encryption_key_url="https://example.com/key",
+            output_storage_basedir="video", output_storage_filepath="videos/id/videos",
+            transcoding_base_output_dir=self.base_dir
+        )
+
+    def test_chunks_upload_their_segments_under_unique_names(self):
+        with mock.patch.object(task, "run_ffmpeg", side_effect=fake_ffmpeg), \
+                mock.patch.object(task, "upload_all_files_to_s3", side_effect=self.upload), \
+                mock.patch.object(task, "get_job_store", return_value=None):
+            results = [self.transcode_chunk(0, 0.0, 30.0), self.transcode_chunk(1, 30.0, None)]
+        uploaded = self.uploaded["videos/id/videos"]
+        self.assertEqual(len(uploaded), len(set(uploaded)))
+        self.assertEqual(len(uploaded), 2 * len(RENDITIONS) * 2)
+        for result in results:
+            prefix = f"{result['index']:04d}_"
+            for segments in result["segments"]:
+                self.assertEqual(len(segments), 2)
+                self.assertTrue(all(prefix in uri for _, uri in segments))
+        # Only the stitched playlists are published
+        self.assertFalse(any(path.endswith(".m3u8") for path in uploaded))
+
+    def test_stitched_playlists_list_the_segments_in_chunk_order(self):
+        def get_result(index:int) -> dict:
+            return {"index": index, "segments": [[[4.0, f"master_{rendition.height}p_{index:04d}_{number:04d}.ts"]
+                                                  for number in range(2)] for rendition in RENDITIONS],
+                    "audio_segments": []}
+
+        playlists = {}
+
+        def upload(input_path:str, bucket:str, relative_output_path:str, progress=None) -> bool:
+            for rendition in RENDITIONS:
+                filename = rendition.get_playlist_filename("master")
+                playlists[filename] = read_media_playlist(os.path.join(input_path, filename))
+            return True
+
+        # Chord results do not come in chunk order
+        with mock.patch.object(task, "upload_all_files_to_s3", side_effect=upload), \
+                mock.patch.object(task, "get_job_progress"), \
+                mock.patch.object(task, "finish_transcode_job") as finish:
+            task.stitch_transcoded_chunks(
+                chunk_results=[get_result(2), get_result(0), get_result(1)],
+                renditions=[rendition.to_dict() for rendition in RENDITIONS], manifest_filename="master.m3u8",
+                iv="11" * 16, encryption_key_url="https://example.com/key", output_storage_basedir="video",
+                output_storage_filepath="videos/id", video_folder_name="videos",
+                transcoding_base_output_dir=self.base_dir
+            )
+        self.assertTrue(finish.call_args.kwargs["success"])
+        for rendition in RENDITIONS:
+            self.assertEqual([uri for _, uri in playlists[rendition.get_playlist_filename("master")]],
+                             [f"master_{rendition.height}p_{index:04d}_{number:04d}.ts"
+                              for index in range(3) for number in range(2)])
+
+    def test_stitching_fails_if_a_chunk_failed(self):
+        with mock.patch.object(task, "upload_all_files_to_s3") as upload, \
+                mock.patch.object(task, "get_job_progress"), \
+                mock.patch.object(task, "finish_transcode_job") as finish:
+            task.stitch_transcoded_chunks(
+                chunk_results=[None, {"index": 1, "segments": [[], []], "audio_segments": []}],
+                renditions=[rendition.to_dict() for rendition in RENDITIONS], manifest_filename="master.m3u8",
+                iv="11" * 16, encryption_key_url="https://example.com/key", output_storage_basedir="video",
+                output_storage_filepath="videos/id", video_folder_name="videos",
+                transcoding_base_output_dir=self.base_dir
+            )
+        upload.assert_not_called()
+        self.assertFalse(finish.call_args.kwargs["success"])
@@ -0,0 +1,126 @@
+import io, shutil, tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from streamingEngine import task
+from streamingEngine.backends.dedupe import ALIAS_FILENAME, INDEX_RECORD_FILENAME, add_alias_reference, \
+    get_alias_reference_path, get_alias_references, load_json, release_transcoded_video, remove_alias_references, \
+    save_json
+from streamingEngine.backends.local.local import LocalStorage
+
+
+BUCKET = "video"
+ORIGINAL = "videos/original"
+ALIAS = "videos/alias"
+INDEX_PATH = "dedupe/source-ladder.json"
+VIDEO_FOLDER_NAME = "videos"
+MANIFEST_FILENAME = "master.m3u8"
+
+
+class DedupeTestCase(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.storage = LocalStorage(root=self.root)
+        self.storage.create_bucket(BUCKET)
+        # A transcoded video that was added to the index of transcoded videos
+        self.storage.upload_file(basedir=BUCKET, data=io.BytesIO(b"#EXTM3U\n"),
+                                 path=f"{ORIGINAL}/{VIDEO_FOLDER_NAME}/{MANIFEST_FILENAME}",
+                                 content_type="application/vnd.apple.mpegurl")
+        task.remember_transcoded_video(self.storage, bucket=BUCKET, dedupe_index_path=INDEX_PATH,
+                                       output_storage_filepath=ORIGINAL)
+
+    def alias(self, alias:str=ALIAS) -> bool:
+        return task.alias_transcoded_duplicate(self.storage, bucket=BUCKET, dedupe_index_path=INDEX_PATH,
+                                               output_storage_filepath=alias, video_folder_name=VIDEO_FOLDER_NAME,
+                                               manifest_filename=MANIFEST_FILENAME)
+
+    def delete(self, path:str):
+        # What PlayList.delete does once release_transcoded_video allowed it
+        self.storage.delete_files(basedir=BUCKET, paths=list(self.storage.iterate_filepaths(BUCKET, f"{path}/")))
+        remove_alias_references(self.storage, BUCKET, path)
+
+    def test_alias_points_at_the_original(self):
+        self.assertTrue(self.alias())
+        self.assertEqual(load_json(self.storage, BUCKET, f"{ALIAS}/{ALIAS_FILENAME}"), {"path": ORIGINAL})
+        self.assertEqual(get_alias_references(self.storage, BUCKET, ORIGINAL), [ALIAS])
+
+    def test_original_is_not_its_own_alias(self):
+        self.assertFalse(self.alias(ORIGINAL))
+        self.assertEqual(get_alias_references(self.storage, BUCKET, ORIGINAL), [])
+
+    def test_alias_backs_out_if_the_original_is_incomplete(self):
+        self.storage.delete_file(basedir=BUCKET, path=f"{ORIGINAL}/{VIDEO_FOLDER_NAME}/{MANIFEST_FILENAME}")
+        self.assertFalse(self.alias())
+        self.assertEqual(get_alias_references(self.storage, BUCKET, ORIGINAL), [])
+        self.assertFalse(self.storage.does_file_exist(basedir=BUCKET, path=f"{ALIAS}/{ALIAS_FILENAME}"))
+
+    def test_references_of_aliases_pointing_elsewhere_are_removed(self):
+        add_alias_reference(self.storage, BUCKET, original=ORIGINAL, alias=ALIAS)
+        save_json(self.storage, BUCKET, f"{ALIAS}/{ALIAS_FILENAME}", {"path": "videos/other"})
+        self.assertEqual(get_alias_references(self.storage, BUCKET, ORIGINAL), [])
+        self.assertFalse(self.storage.does_file_exist(basedir=BUCKET,
+                                                      path=get_alias_reference_path(ORIGINAL, ALIAS)))
+
+    def test_reference_saved_before_the_alias_record_is_counted(self):
+        add_alias_reference(self.storage, BUCKET, original=ORIGINAL, alias=ALIAS)
+        self.assertEqual(get_alias_references(self.storage, BUCKET, ORIGINAL), [ALIAS])
+
+    def test_original_with_aliases_is_kept(self):
+        self.assertTrue(self.alias())
+        self.assertFalse(release_transcoded_video(self.storage, BUCKET, ORIGINAL))
+        # Put back in the index, so that later duplicates are aliased to it too
+        self.assertEqual(load_json(self.storage, BUCKET, INDEX_PATH), {"path": ORIGINAL})
+
+    def test_released_alias_drops_its_reference(self):
+        self.assertTrue(self.alias())
+        self.assertTrue(release_transcoded_video(self.storage, BUCKET, ALIAS))
+        self.assertEqual(get_alias_references(self.storage, BUCKET, ORIGINAL), [])
+        self.assertTrue(release_transcoded_video(self.storage, BUCKET, ORIGINAL))
+        self.assertIsNone(load_json(self.storage, BUCKET, INDEX_PATH))
+
+    def test_release_keeps_the_index_entry_of_a_newer_transcode(self):
+        save_json(self.storage, BUCKET, INDEX_PATH, {"path": "videos/newer"})
+        self.assertTrue(release_transcoded_video(self.storage, BUCKET, ORIGINAL))
+        self.assertEqual(load_json(self.storage, BUCKET, INDEX_PATH), {"path": "videos/newer"})
+        self.assertEqual(load_json(self.storage, BUCKET, f"{ORIGINAL}/{INDEX_RECORD_FILENAME}"),
+                         {"path": INDEX_PATH})
+
+    def test_alias_backs_out_if_the_original_is_released_before_its_reference_is_saved(self):
+        released = []
+
+        def add_after_release(storage, basedir, original, alias):
+            # The original's aliases are counted and it is deleted between the index lookup and the reference
+            released.append(release_transcoded_video(storage, basedir, original))
+            self.delete(original)
+            return add_alias_reference(storage, basedir, original=original, alias=alias)
+
+        with mock.patch.object(task, "add_alias_reference", side_effect=add_after_release):
+            self.assertFalse(self.alias())
+        self.assertEqual(released, [True])
+        self.assertFalse(self.storage.does_file_exist(basedir=BUCKET, path=f"{ALIAS}/{ALIAS_FILENAME}"))
+        self.assertEqual(list(self.storage.iterate_filepaths(BUCKET, f"{ORIGINAL}/")), [])
+
+    def test_alias_backs_out_if_the_original_is_deleted_after_its_reference_is_saved(self):
+        def add_before_delete(storage, basedir, original, alias):
+            # The reference is saved after the original's aliases were counted, but before it is deleted
+            self.assertTrue(release_transcoded_video(storage, basedir, original))
+            return add_alias_reference(storage, basedir, original=original, alias=alias)
+
+        with mock.patch.object(task, "add_alias_reference", side_effect=add_before_delete):
+            self.assertFalse(self.alias())
+        self.assertFalse(self.storage.does_file_exist(basedir=BUCKET, path=f"{ALIAS}/{ALIAS_FILENAME}"))
+        self.delete(ORIGINAL)
+        self.assertEqual(list(self.storage.iterate_filepaths(BUCKET, f"{ORIGINAL}/")), [])
+
+    def test_release_counts_a_reference_saved_before_it(self):
+        def add_then_release(storage, basedir, original, alias):
+            added = add_alias_reference(storage, basedir, original=original, alias=alias)
+            self.assertFalse(release_transcoded_video(storage, basedir, original))
+            return added
+
+        with mock.patch.object(task, "add_alias_reference", side_effect=add_then_release):
+            self.assertTrue(self.alias())
+        self.assertEqual(load_json(self.storage, BUCKET, INDEX_PATH), {"path": ORIGINAL})
+        self.assertEqual(get_alias_references(self.storage, BUCKET, ORIGINAL), [ALIAS])
@@ -0,0 +1,74 @@
+from typing import List, Tuple
+
+from django.test import SimpleTestCase
+
+from streamingEngine.backends.transcoder.hls import get_renditions
+from streamingEngine.backends.transcoder.ladder import plan_ladder
+from streamingEngine.backends.transcoder.mediainfo import MediaInfo
+from streamingEngine.backends.transcoder.transcoder import TranscoderConfiguration
+from streamingEngine.task import TRANSCODING_CONFIGURATIONS
+
+
+def get_rungs(configurations:List[TranscoderConfiguration]) -> List[Tuple[int, int, int]]:
+    return [(config.width, config.video_bitrate, config.audio_bitrate) for config in configurations]
+
+
+class PlanLadderTestCase(SimpleTestCase):
+    def test_source_larger_than_every_rung_keeps_the_ladder(self):
+        media_info = MediaInfo(width=1920, height=1080, video_bitrate=8000000)
+        self.assertEqual(get_rungs(plan_ladder(TRANSCODING_CONFIGURATIONS, media_info)),
+                         get_rungs(TRANSCODING_CONFIGURATIONS))
+
+    def test_rungs_wider_than_the_source_are_dropped(self):
+        media_info = MediaInfo(width=854, height=480, video_bitrate=8000000, audio_bitrate=320000)
+        self.assertEqual([config.width for config in plan_ladder(TRANSCODING_CONFIGURATIONS, media_info)],
+                         [320, 640, 854])
+
+    def test_source_narrower_than_every_rung_gets_one_rung_at_its_width(self):
+        media_info = MediaInfo(width=240, height=136, video_bitrate=8000000)
+        self.assertEqual(get_rungs(plan_ladder(TRANSCODING_CONFIGURATIONS, media_info)), [(240, 187500, 250000)])
+
+    def test_bitrates_are_capped_at_the_source(self):
+        media_info = MediaInfo(width=1920, height=1080, video_bitrate=400000, audio_bitrate=96000)
+        planned = plan_ladder(TRANSCODING_CONFIGURATIONS, media_info)
+        self.assertTrue(all(config.video_bitrate <= 400000 for config in planned))
+        self.assertTrue(all(config.audio_bitrate <= 96000 for config in planned))
+
+    def test_overall_bitrate_caps_sources_without_a_video_bitrate(self):
+        media_info = MediaInfo(width=1920, height=1080, bitrate=1100000, audio_bitrate=100000)
+        self.assertEqual(max(config.video_bitrate for config in plan_ladder(TRANSCODING_CONFIGURATIONS, media_info)),
+                         1000000)
+
+    def test_close_rungs_are_merged_into_the_larger_one(self):
+        # Capped at the source, the three largest rungs would all be encoded at 600k
+        media_info = MediaInfo(width=1920, height=1080, video_bitrate=600000)
+        self.assertEqual([(config.width, config.video_bitrate)
+                          for config in plan_ladder(TRANSCODING_CONFIGURATIONS, media_info)],
+                         [(320, 250000), (1280, 600000)])
+
+    def test_rungs_far_enough_apart_are_kept(self):
+        configurations = [TranscoderConfiguration(audio_bitrate=128000, video_bitrate=1000000, width=640),
+                          TranscoderConfiguration(audio_bitrate=128000, video_bitrate=1200000, width=854),
+                          TranscoderConfiguration(audio_bitrate=128000, video_bitrate=2000000, width=1280)]
+        media_info = MediaInfo(width=1920, height=1080)
+        self.assertEqual([config.width for config in plan_ladder(configurations, media_info)], [854, 1280])
+        self.assertEqual([config.width for config in plan_ladder(configurations, media_info, min_bitrate_step=1.1)],
+                         [640, 854, 1280])
+
+    def test_complexity_scales_bitrates_within_bounds(self):
+        media_info = MediaInfo(width=1920, height=1080)
+        easy = plan_ladder(TRANSCODING_CONFIGURATIONS, media_info, complexity=0.1)
+        self.assertEqual([config.video_bitrate for config in easy],
+                         [config.video_bitrate // 2 for config in TRANSCODING_CONFIGURATIONS])
+        hard = plan_ladder(TRANSCODING_CONFIGURATIONS, media_info, complexity=3.0)
+        self.assertEqual(get_rungs(hard), get_rungs(TRANSCODING_CONFIGURATIONS))
+
+    def test_portrait_source_is_fitted_by_its_width(self):
+        for media_info in [MediaInfo(width=1080, height=1920, video_bitrate=8000000),
+                           MediaInfo(width=1920, height=1080, rotation=90, video_bitrate=8000000)]:
+            planned = plan_ladder(TRANSCODING_CONFIGURATIONS, media_info)
+            self.assertEqual([config.width for config in planned], [320, 640, 854])
+            renditions = get_renditions(planned, source_width=media_info.display_width,
+                                        source_height=media_info.display_height)
+            self.assertEqual([(rendition.width, rendition.height) for rendition in renditions],
+                             [(320, 568), (640, 1138), (854, 1518)])
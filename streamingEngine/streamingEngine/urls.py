@@ -26,5 +26,14 @@ urlpatterns = [
     path('playlist/<path:segment_name>/', views.PlayList.as_view(), name='playlist'),
     path('keys/<str:id>/', views.KeysView.as_view(), name='keys'),
     path('vtt/<str:id>/', views.VttView.as_view(), name='vtt'),
-    path('video/', views.VideoUploader.as_view(), name='videos')
+    path('video/', views.VideoUploader.as_view(), name='videos'),
+    path('uploads/', views.ResumableUploadView.as_view(), name='uploads'),
+    path('uploads/<str:token>/', views.ResumableUploadView.as_view(), name='uploads'),
+    path('upload-sessions/', views.UploadSessionView.as_view(), name='upload-sessions'),
+    path('upload-sessions/<str:token>/', views.UploadSessionView.as_view(), name='upload-sessions'),
+    path('jobs/<str:id>/', views.JobView.as_view(), name='jobs'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+    # Non-blocking variants of the viewer facing endpoints, served by the ASGI application
+    path('async/playlist/<path:segment_name>/', views.AsyncPlayList.as_view(), name='async-playlist'),
+    path('async/keys/<str:id>/', views.AsyncKeysView.as_view(), name='async-keys')
 ]
@@ -1,24 +1,40 @@
-from typing import List
-import os, uuid, mimetypes, shutil
-from django.http import HttpResponse, HttpRequest, HttpResponseServerError, HttpResponseForbidden, JsonResponse
+from typing import Dict, List, Union
+import os, re, uuid, mimetypes, shutil, base64, math, json, time
+from django.http import HttpResponse, HttpRequest, HttpResponseServerError, HttpResponseForbidden, JsonResponse, \
+    StreamingHttpResponse, HttpResponseNotModified, HttpResponseRedirect, FileResponse
 from rest_framework.views import APIView
+from django.views import View
 from django.views.generic import TemplateView
 from django.conf import settings
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.core.files.base import ContentFile
+from django.core import signing
 from django.shortcuts import render
 
-from .backends.storageInterface import IStorageInterface
-from .backends.file import File
+from .backends.storageInterface import IStorageInterface, IAsyncStorageInterface
+from .backends.file import File, StreamingFile
 from .backends.s3.s3 import S3
+from .backends.s3.asyncs3 import AsyncS3StreamingFile
+from .backends.s3.uploadhandler import S3MultipartUploadHandler, S3UploadedFile
+from .backends.local.local import LocalStreamingFile
+from .backends.storage import get_storage, get_async_storage, is_s3_storage
+from .backends.cache import AsyncCacheFillingStreamingFile, get_cached_storage, get_async_cached_storage
+from .backends.dedupe import ALIAS_FILENAME, load_json, release_transcoded_video, remove_alias_references
 from django.views.decorators.cache import cache_control
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
 
-from .task import transcode_video
+from .backends.jobs import get_job_store, get_public_job
+from .backends.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, is_metrics_enabled, render_web_metrics
+from .task import start_transcode_job
 
 
 VIDEO_FOLDER_NAME = "videos"
 KEYS_FILE_NAME = "keys"
+# Files of a transcoded video that PlayList serves as they are stored: HLS and DASH manifests, MPEG-TS and fMP4 media
+# segments and fMP4 initialization segments. Any other path is a video whose master playlist is served.
+MANIFEST_EXTENSIONS = (".m3u8", ".mpd")
+SEGMENT_EXTENSIONS = (".ts", ".m4s", "_init.mp4")
 def get_storage_path(content:str)->str:
     storage_path = f"{settings.AWS_STREAM_UPLOAD_DIR}/{content}"
     return storage_path
@@ -29,6 +45,199 @@ def get_video_storage_path(content:str)->str:
 def get_key_storage_path(content:str)->str:
     return get_storage_path(content) + "/" + KEYS_FILE_NAME
 
+# Storage prefix of a video -> (storage prefix of the video it is an alias of or None, time of the lookup)
+_aliases: Dict[str, tuple] = {}
+# Videos are looked up again after this many seconds: an alias may not have been saved yet, or may have been deleted
+# through another process
+ALIAS_LOOKUP_INTERVAL = 60
+MAX_REMEMBERED_ALIASES = 10000
+
+def get_video_prefix(path:str)->Union[str, None]:
+    upload_dir = settings.AWS_STREAM_UPLOAD_DIR + "/"
+    if not path.startswith(upload_dir):
+        return None
+    id = path[len(upload_dir):].split("/")[0]
+    return get_storage_path(id) if len(id) > 0 else None
+
+def get_remembered_alias(prefix:str)->tuple:
+    # Returns whether the alias of a video is known and the alias
+    remembered = _aliases.get(prefix)
+    if remembered is None or time.monotonic() - remembered[1] > ALIAS_LOOKUP_INTERVAL:
+        return False, None
+    return True, remembered[0]
+
+def remember_alias(prefix:str, alias:Union[str, None]):
+    if len(_aliases) >= MAX_REMEMBERED_ALIASES:
+        _aliases.clear()
+    _aliases[prefix] = (alias, time.monotonic())
+
+def get_aliased_path(storage:IStorageInterface, bucket:str, path:str)->str:
+    """
+    Returns where a file of a video is actually stored. A video whose source had already been transcoded is saved as
+    an alias of the earlier video (see task.alias_transcoded_duplicate). Aliases are remembered by the process for
+    ALIAS_LOOKUP_INTERVAL seconds.
+    """
+    prefix = get_video_prefix(path)
+    if prefix is None:
+        return path
+    known, alias = get_remembered_alias(prefix)
+    if not known:
+        record = load_json(storage, basedir=bucket, path=f"{prefix}/{ALIAS_FILENAME}")
+        alias = record.get("path") if not (record is None) else None
+        remember_alias(prefix, alias)
+    return path if alias is None else alias + path[len(prefix):]
+
+async def aget_aliased_path(storage:IAsyncStorageInterface, bucket:str, path:str)->str:
+    prefix = get_video_prefix(path)
+    if prefix is None:
+        return path
+    known, alias = get_remembered_alias(prefix)
+    if not known:
+        alias_path = f"{prefix}/{ALIAS_FILENAME}"
+        file: File = await storage.get_file(basedir=bucket, path=alias_path) \
+            if await storage.does_file_exist(basedir=bucket, path=alias_path) else None
+        alias = json.loads(file.file).get("path") if not (file is None) else None
+        remember_alias(prefix, alias)
+    return path if alias is None else alias + path[len(prefix):]
+
+def is_encoding_profile(name:Union[str, None])->bool:
+    # No profile selects the default one
+    return name is None or len(name) == 0 or name in settings.TRANSCODE_PROFILES.keys()
+
+def transcode_stored_video(bucket:str, path:str, encryption_key_url:str="/keys/", encoding_profile:str=None)->str:
+    """
+    Starts transcoding a raw video stored in S3 and returns the id under which the transcoded video will be saved, which
+    is also the id of its transcoding job (see JobView). encoding_profile names one of settings.TRANSCODE_PROFILES.
+    """
+    temp_unique_dir = str(uuid.uuid4())
+    temp_dir = os.path.join(settings.AWS_TEMP_DOWNLOAD_DIR, temp_unique_dir)
+    start_transcode_job(
+        input_filepath=path,
+        transcoding_base_output_dir=temp_dir,
+        video_folder_name=VIDEO_FOLDER_NAME,
+        manifest_filename=PlayList.MASTER_MANIFEST_FILENAME,
+        encryption_key_filename=KEYS_FILE_NAME,
+        encryption_key_url=encryption_key_url.rstrip("/") + "/" + temp_unique_dir,
+        output_storage_basedir=bucket,
+        output_storage_filepath=get_storage_path(temp_unique_dir),
+        s3_bucket_name=bucket,
+        encoding_profile=encoding_profile
+    )
+    return temp_unique_dir
+
+def get_segment_url(bucket:str, path:str)->str:
+    return S3().get_presigned_url(basedir=bucket, path=path,
+                                  expires_in=settings.PLAYLIST_DELIVERY["PRESIGNED_URL_EXPIRY"])
+
+def get_delivery_mode()->str:
+    # Only S3 can sign urls, other storages are always proxied
+    return settings.PLAYLIST_DELIVERY["MODE"] if is_s3_storage() else "proxy"
+
+def get_presigned_playlist(storage:IStorageInterface, bucket:str, path:str)->Union[HttpResponse, None]:
+    """
+    Returns a media playlist whose segment uris are presigned S3 urls, so that players fetch segments from S3
+    directly. Master playlists are returned unchanged; their variant playlists are rewritten when requested. Key uris
+    are left alone so that keys are still served (and authorized) by KeysView. DASH manifests are returned unchanged,
+    as their segment templates cannot be presigned; their segments are redirected by PlayList.get instead.
+    """
+    file: File = storage.get_file(basedir=bucket, path=path)
+    if file is None:
+        return None
+    return HttpResponse(presign_playlist(bucket=bucket, path=path, playlist=file.file), content_type=file.content_type)
+
+def is_segment_name(segment_name:str)->bool:
+    return segment_name.endswith(SEGMENT_EXTENSIONS)
+
+def is_file_name(segment_name:str)->bool:
+    return segment_name.endswith(MANIFEST_EXTENSIONS) or is_segment_name(segment_name)
+
+def presign_playlist(bucket:str, path:str, playlist:Union[bytes, str])->str:
+    playlist = playlist.decode() if isinstance(playlist, bytes) else playlist
+    if "#EXTINF" in playlist:
+        directory = os.path.dirname(path)
+
+        def presign_uri(match:re.Match)->str:
+            # Initialization segment of fMP4 playlists
+            uri = match.group(1)
+            return match.group(0) if "://" in uri else f'URI="{get_segment_url(bucket, f"{directory}/{uri}")}"'
+
+        playlist = "\n".join([
+            get_segment_url(bucket, f"{directory}/{line.strip()}")
+            if len(line.strip()) > 0 and not line.startswith("#") and not "://" in line
+            else re.sub(r'URI="([^"]+)"', presign_uri, line) if line.startswith("#EXT-X-MAP:") else line
+            for line in playlist.split("\n")
+        ])
+    return playlist
+
+def get_streaming_response(request:HttpRequest, storage:IStorageInterface, bucket:str, path:str)->HttpResponse:
+    """
+    Pipes a stored file to the client in chunks. The Range and If-None-Match headers of the request are forwarded
+    to the storage so that partial and conditional requests never transfer more than what the client asked for.
+    Returns None if the file could not be fetched.
+    """
+    file: StreamingFile = storage.get_file_stream(
+        basedir=bucket,
+        path=path,
+        byte_range=request.headers.get("Range"),
+        if_none_match=request.headers.get("If-None-Match")
+    )
+    if file is None:
+        return None
+    if file.status == 304:
+        response = HttpResponseNotModified()
+    elif file.status == 416:
+        response = HttpResponse("Requested range not satisfiable", status=416)
+    elif isinstance(file, LocalStreamingFile) and file.status == 200:
+        # The WSGI server sends whole local files with sendfile(2) (wsgi.file_wrapper), without copying them through
+        # Python
+        response = FileResponse(file.file, content_type=file.content_type, status=file.status)
+        if "Content-Disposition" in response:
+            del response["Content-Disposition"]
+        if not (file.content_length is None):
+            response["Content-Length"] = str(file.content_length)
+    else:
+        response = StreamingHttpResponse(file.chunks(), content_type=file.content_type, status=file.status)
+        if not (file.content_length is None):
+            response["Content-Length"] = str(file.content_length)
+        if not (file.content_range is None):
+            response["Content-Range"] = file.content_range
+    if not (file.etag is None):
+        response["ETag"] = file.etag
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+async def get_async_streaming_response(request:HttpRequest, storage:IAsyncStorageInterface, bucket:str,
+                                       path:str)->HttpResponse:
+    """
+    get_streaming_response for async views. Streams from S3 and local files are relayed without blocking the event
+    loop; files served from the cache are already in memory and are returned as a whole.
+    """
+    file: StreamingFile = await storage.get_file_stream(
+        basedir=bucket,
+        path=path,
+        byte_range=request.headers.get("Range"),
+        if_none_match=request.headers.get("If-None-Match")
+    )
+    if file is None:
+        return None
+    if file.status == 304:
+        response = HttpResponseNotModified()
+    elif file.status == 416:
+        response = HttpResponse("Requested range not satisfiable", status=416)
+    else:
+        if isinstance(file, (AsyncS3StreamingFile, LocalStreamingFile, AsyncCacheFillingStreamingFile)):
+            response = StreamingHttpResponse(file.achunks(), content_type=file.content_type, status=file.status)
+        else:
+            response = HttpResponse(b"".join(file.chunks()), content_type=file.content_type, status=file.status)
+        if not (file.content_length is None):
+            response["Content-Length"] = str(file.content_length)
+        if not (file.content_range is None):
+            response["Content-Range"] = file.content_range
+    if not (file.etag is None):
+        response["ETag"] = file.etag
+    response["Accept-Ranges"] = "bytes"
+    return response
+
 class StreamingView(TemplateView):
 
     template_name = "index.html"
@@ -69,16 +278,16 @@ class SampleView(APIView):
 class KeysView(APIView):
 
     def __get_storage(self) -> IStorageInterface:
-        return S3()
+        return get_cached_storage(get_storage())
     @method_decorator(cache_control(max_age=0, no_cache=True, no_store=True))
     def get(self, request: HttpRequest, id:str, *args, **kwargs):
         is_authorized = True
         if not is_authorized:
             return HttpResponseForbidden("You are not allowed to access this video")
         if not (id is None) and len(id) > 0:
-            keys_path = get_key_storage_path(id)
             bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
             storage = self.__get_storage()
+            keys_path = get_aliased_path(storage, bucket, get_key_storage_path(id))
             file: File = storage.get_file(basedir=bucket, path=f"{keys_path}")
             if not (file is None):
                 return HttpResponse(ContentFile(file.file), content_type=file.content_type)
@@ -87,6 +296,28 @@ class KeysView(APIView):
 
 
 
+class AsyncKeysView(View):
+    """
+    KeysView for the ASGI application.
+    """
+
+    async def get(self, request: HttpRequest, id:str, *args, **kwargs):
+        response = HttpResponseServerError("Could not find keys")
+        is_authorized = True
+        if not is_authorized:
+            response = HttpResponseForbidden("You are not allowed to access this video")
+        elif not (id is None) and len(id) > 0:
+            bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
+            storage = get_async_cached_storage(get_async_storage())
+            keys_path = await aget_aliased_path(storage, bucket, get_key_storage_path(id))
+            file: File = await storage.get_file(basedir=bucket, path=keys_path)
+            if not (file is None):
+                response = HttpResponse(file.file, content_type=file.content_type)
+        # Django's cache_control decorator does not support coroutines before Django 5.0
+        patch_cache_control(response, max_age=0, no_cache=True, no_store=True)
+        return response
+
+
 class VideoUploader(APIView):
 
     def __save_file(self, file:InMemoryUploadedFile, temp_dir:str)->str:
@@ -102,7 +333,8 @@ class VideoUploader(APIView):
         temp_filepath = os.path.join(temp_dir, filename)
         try:
             with open(temp_filepath, 'wb') as f:
-                f.write(file.read())
+                for chunk in file.chunks():
+                    f.write(chunk)
             return temp_filepath
         except Exception as e:
             print("Error saving file to temp directory")
@@ -112,7 +344,7 @@ class VideoUploader(APIView):
         path = request.GET.get("path", "")
         if not (path is None) and len(path) > 0:
             bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
-            storage:IStorageInterface = S3()
+            storage:IStorageInterface = get_storage()
             result = storage.get_all_filepaths(basedir=bucket, path=path)
             return HttpResponse(str(result))
         return HttpResponse("No files found")
@@ -121,18 +353,29 @@ class VideoUploader(APIView):
         path = request.GET.get("path", "")
         if not (path is None) and len(path) > 0:
             bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
-            storage: IStorageInterface = S3()
+            storage: IStorageInterface = get_storage()
             result = storage.delete_file(basedir=bucket, path=path)
             return HttpResponse(str(result))
         return HttpResponse("No files found")
     def post(self,  request:HttpRequest, *args, **kwargs):
-        if not (request.FILES is None):
-            file: InMemoryUploadedFile = request.FILES.get('file', None)
+        bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
+        temp_unique_dir = str(uuid.uuid4())
+        if settings.VIDEO_UPLOAD["DIRECT_TO_S3"] and is_s3_storage():
+            # Must be set before the body is parsed. The file is streamed to S3 while the request is being read
+            request.upload_handlers = [S3MultipartUploadHandler(
+                request, bucket=bucket, path_prefix=get_storage_path(f"raw/{temp_unique_dir}"),
+                part_size=settings.VIDEO_UPLOAD["PART_SIZE"],
+                allowed_extensions=settings.VIDEO_UPLOAD["ALLOWED_EXTENSIONS"]
+            )]
 
-            bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
+        if not (request.FILES is None):
+            file: Union[InMemoryUploadedFile, S3UploadedFile] = request.FILES.get('file', None)
+            if isinstance(file, S3UploadedFile):
+                return HttpResponse(f"Uploaded file to {file.path}")
+            if file is None:
+                return HttpResponseServerError("Error uploading file")
 
             # Save video to temp directory
-            temp_unique_dir = str(uuid.uuid4())
             temp_dir = os.path.join(settings.AWS_TEMP_DOWNLOAD_DIR, temp_unique_dir)
             saved_filepath = self.__save_file(file=file, temp_dir=temp_dir)
             mimetype = mimetypes.guess_type(saved_filepath)[0]
@@ -141,7 +384,7 @@ class VideoUploader(APIView):
 
             s3_path = get_storage_path(f"raw/{temp_unique_dir}/{file.name}")
 
-            uploaded = S3().upload_file(
+            uploaded = get_storage().upload_file(
                 basedir=bucket,
                 data=saved_filepath,
                 path=s3_path,
@@ -156,11 +399,297 @@ class VideoUploader(APIView):
 
         return HttpResponseServerError("Error uploading file")
 
+TUS_VERSION = "1.0.0"
+RESUMABLE_UPLOAD_SALT = "streamingEngine.views.ResumableUploadView"
+
+
+def get_tus_response(status:int=204, headers:Dict[str, str]=None, content:str="")->HttpResponse:
+    response = HttpResponse(content, status=status)
+    response["Tus-Resumable"] = TUS_VERSION
+    response["Cache-Control"] = "no-store"
+    for key, value in (headers or {}).items():
+        response[key] = value
+    return response
+
+def parse_upload_metadata(value:str)->Dict[str, str]:
+    # Upload-Metadata: key base64(value),key base64(value),...
+    metadata = {}
+    for pair in [pair.strip() for pair in (value or "").split(",") if len(pair.strip()) > 0]:
+        key, _, encoded = pair.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(encoded).decode() if len(encoded) > 0 else ""
+        except Exception as e:
+            print(f"Could not decode upload metadata {key}")
+    return metadata
+
+
+class ResumableUploadView(APIView):
+    """
+    Resumable uploads of raw videos following the core tus 1.0 protocol (plus the creation and termination
+    extensions). Each upload is an S3 multipart upload, and its id is a signed token that holds the bucket, path,
+    S3 upload id and length, so no state is kept on the server. The offset of an upload is the total size of its
+    stored parts. If a PATCH request is cut off, the client resumes after the last stored part.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __get_upload(self, token:str)->Union[Dict, None]:
+        try:
+            return signing.loads(token, salt=RESUMABLE_UPLOAD_SALT,
+                                 max_age=settings.VIDEO_UPLOAD["RESUMABLE_TOKEN_MAX_AGE"])
+        except signing.BadSignature:
+            return None
+
+    def __get_offset(self, storage:S3, upload:Dict)->Union[tuple, None]:
+        parts = storage.list_parts(basedir=upload["bucket"], path=upload["path"], upload_id=upload["upload_id"])
+        if parts is None:
+            # The multipart upload is gone once it has been completed
+            if storage.does_file_exist(basedir=upload["bucket"], path=upload["path"]):
+                return upload["length"], None
+            return None
+        return sum([part["Size"] for part in parts]), parts
+
+    def options(self, request:HttpRequest, *args, **kwargs):
+        return get_tus_response(headers={
+            "Tus-Version": TUS_VERSION,
+            "Tus-Extension": "creation,termination",
+            "Tus-Max-Size": str(settings.VIDEO_UPLOAD["MAX_SIZE"])
+        })
+
+    def post(self, request:HttpRequest, token:str=None, *args, **kwargs):
+        try:
+            length = int(request.headers.get("Upload-Length", ""))
+        except ValueError:
+            return get_tus_response(status=400, content="Upload-Length is required")
+        if length <= 0:
+            return get_tus_response(status=400, content="Upload-Length must be greater than 0")
+        if length > settings.VIDEO_UPLOAD["MAX_SIZE"]:
+            return get_tus_response(status=413, content="The video is too large")
+
+        filename = os.path.basename(parse_upload_metadata(request.headers.get("Upload-Metadata")).get("filename", ""))
+        if not filename.split(".")[-1].lower() in settings.VIDEO_UPLOAD["ALLOWED_EXTENSIONS"]:
+            return get_tus_response(status=400, content="Unsupported video format")
+
+        bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
+        path = get_storage_path(f"raw/{uuid.uuid4()}/{filename}")
+        storage = S3()
+        if not storage.does_bucket_exist(bucket):
+            storage.create_bucket(bucket)
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        upload_id = storage.create_multipart_upload(basedir=bucket, path=path, content_type=content_type)
+        if upload_id is None:
+            return get_tus_response(status=500, content="Could not start the upload")
+
+        token = signing.dumps({"bucket": bucket, "path": path, "upload_id": upload_id, "length": length},
+                              salt=RESUMABLE_UPLOAD_SALT)
+        return get_tus_response(status=201, headers={"Location": f"/uploads/{token}/"}, content=path)
+
+    def head(self, request:HttpRequest, token:str=None, *args, **kwargs):
+        upload = self.__get_upload(token)
+        offset = self.__get_offset(S3(), upload) if not (upload is None) else None
+        if offset is None:
+            return get_tus_response(status=404)
+        return get_tus_response(status=200, headers={
+            "Upload-Offset": str(offset[0]),
+            "Upload-Length": str(upload["length"])
+        })
+
+    def patch(self, request:HttpRequest, token:str=None, *args, **kwargs):
+        upload = self.__get_upload(token)
+        if upload is None:
+            return get_tus_response(status=404)
+        if request.headers.get("Content-Type") != "application/offset+octet-stream":
+            return get_tus_response(status=415)
+
+        storage = S3()
+        offset = self.__get_offset(storage, upload)
+        if offset is None:
+            return get_tus_response(status=404)
+        offset, parts = offset
+        if request.headers.get("Upload-Offset") != str(offset) or parts is None:
+            return get_tus_response(status=409, headers={"Upload-Offset": str(offset)})
+
+        part_size = max(settings.VIDEO_UPLOAD["PART_SIZE"], S3.MIN_PART_SIZE)
+        content_length = int(request.headers.get("Content-Length") or 0)
+        buffer = bytearray()
+        received = 0
+
+        def upload_part(data:bytearray)->bool:
+            etag = storage.upload_part(basedir=upload["bucket"], path=upload["path"], upload_id=upload["upload_id"],
+                                       part_number=len(parts) + 1, data=bytes(data))
+            if etag is None:
+                return False
+            parts.append({"PartNumber": len(parts) + 1, "ETag": etag, "Size": len(data)})
+            return True
+
+        try:
+            while received < content_length and offset + len(buffer) < upload["length"]:
+                chunk = request.read(min(ResumableUploadView.CHUNK_SIZE, content_length - received))
+                if not chunk:
+                    break
+                received += len(chunk)
+                buffer += chunk
+                if len(buffer) >= part_size:
+                    if not upload_part(buffer):
+                        break
+                    offset += len(buffer)
+                    buffer = bytearray()
+        except Exception as e:
+            print(f"Upload of {upload['path']} was interrupted")
+            print(e)
+
+        # Leftover bytes are only stored if they complete the upload or are a valid part on their own. Otherwise the
+        # client is told the lower offset and sends them again with its next request
+        if len(buffer) > 0 and (offset + len(buffer) == upload["length"] or len(buffer) >= S3.MIN_PART_SIZE):
+            if upload_part(buffer):
+                offset += len(buffer)
+
+        if offset == upload["length"]:
+            if not storage.complete_multipart_upload(basedir=upload["bucket"], path=upload["path"],
+                                                     upload_id=upload["upload_id"], parts=parts):
+                return get_tus_response(status=500, content="Could not complete the upload")
+        return get_tus_response(headers={"Upload-Offset": str(offset)})
+
+    def delete(self, request:HttpRequest, token:str=None, *args, **kwargs):
+        upload = self.__get_upload(token)
+        if upload is None or not S3().abort_multipart_upload(basedir=upload["bucket"], path=upload["path"],
+                                                               upload_id=upload["upload_id"]):
+            return get_tus_response(status=404)
+        return get_tus_response()
+
+
+UPLOAD_SESSION_SALT = "streamingEngine.views.UploadSessionView"
+# S3 accepts at most 10000 parts per multipart upload
+MAX_UPLOAD_PARTS = 10000
+
+
+class UploadSessionView(APIView):
+    """
+    Uploads of raw videos straight from the client to S3. Django only hands out presigned part urls and completes
+    the multipart upload, so the video never passes through a web worker.
+
+    POST /upload-sessions/ {"filename", "size"} starts a session. It returns a signed session token, the part size
+    and a presigned PUT url per part.
+    GET /upload-sessions/<token>/ lists the stored parts and renews the urls of the parts still missing.
+    POST /upload-sessions/<token>/ {"encryption_url", "profile"} completes the upload and starts transcoding.
+    DELETE /upload-sessions/<token>/ aborts the upload.
+    """
+
+    def __get_session(self, token:str)->Union[Dict, None]:
+        try:
+            return signing.loads(token, salt=UPLOAD_SESSION_SALT,
+                                 max_age=settings.VIDEO_UPLOAD["RESUMABLE_TOKEN_MAX_AGE"])
+        except signing.BadSignature:
+            return None
+
+    def __get_part_urls(self, storage:S3, session:Dict, part_numbers:List[int])->List[Dict]:
+        return [{
+            "part_number": part_number,
+            "url": storage.get_presigned_url(
+                basedir=session["bucket"], path=session["path"], method="upload_part",
+                expires_in=settings.VIDEO_UPLOAD["PRESIGNED_URL_EXPIRY"],
+                params={"UploadId": session["upload_id"], "PartNumber": part_number}
+            )
+        } for part_number in part_numbers]
+
+    def __get_part_count(self, session:Dict)->int:
+        return math.ceil(session["size"] / session["part_size"])
+
+    def get(self, request:HttpRequest, token:str=None, *args, **kwargs):
+        session = self.__get_session(token)
+        if session is None:
+            return HttpResponse("Upload session not found", status=404)
+        storage = S3()
+        parts = storage.list_parts(basedir=session["bucket"], path=session["path"], upload_id=session["upload_id"])
+        if parts is None:
+            return HttpResponse("Upload session not found", status=404)
+        uploaded = [part["PartNumber"] for part in parts]
+        missing = [number for number in range(1, self.__get_part_count(session) + 1) if not number in uploaded]
+        return JsonResponse({
+            "path": session["path"],
+            "part_size": session["part_size"],
+            "uploaded": [{"part_number": part["PartNumber"], "size": part["Size"]} for part in parts],
+            "parts": self.__get_part_urls(storage, session, missing)
+        })
+
+    def post(self, request:HttpRequest, token:str=None, *args, **kwargs):
+        if token is None:
+            return self.__create(request)
+        return self.__complete(request, token)
+
+    def __create(self, request:HttpRequest):
+        filename = os.path.basename(str(request.data.get("filename", "")))
+        try:
+            size = int(request.data.get("size", 0))
+        except (TypeError, ValueError):
+            size = 0
+        if size <= 0:
+            return HttpResponse("size must be greater than 0", status=400)
+        if size > settings.VIDEO_UPLOAD["MAX_SIZE"]:
+            return HttpResponse("The video is too large", status=413)
+        if not filename.split(".")[-1].lower() in settings.VIDEO_UPLOAD["ALLOWED_EXTENSIONS"]:
+            return HttpResponse("Unsupported video format", status=400)
+
+        bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
+        path = get_storage_path(f"raw/{uuid.uuid4()}/{filename}")
+        storage = S3()
+        if not storage.does_bucket_exist(bucket):
+            storage.create_bucket(bucket)
+        upload_id = storage.create_multipart_upload(basedir=bucket, path=path,
+                                                    content_type=mimetypes.guess_type(filename)[0] or "video/mp4")
+        if upload_id is None:
+            return HttpResponseServerError("Could not start the upload")
+
+        part_size = max(settings.VIDEO_UPLOAD["PART_SIZE"], S3.MIN_PART_SIZE, math.ceil(size / MAX_UPLOAD_PARTS))
+        session = {"bucket": bucket, "path": path, "upload_id": upload_id, "size": size, "part_size": part_size}
+        return JsonResponse({
+            "session": signing.dumps(session, salt=UPLOAD_SESSION_SALT),
+            "path": path,
+            "part_size": part_size,
+            "parts": self.__get_part_urls(storage, session, list(range(1, self.__get_part_count(session) + 1)))
+        }, status=201)
+
+    def __complete(self, request:HttpRequest, token:str):
+        session = self.__get_session(token)
+        if session is None:
+            return HttpResponse("Upload session not found", status=404)
+        storage = S3()
+        # The stored parts are listed instead of trusting ETags sent by the client, which browsers can only read if
+        # the bucket's CORS configuration exposes them
+        parts = storage.list_parts(basedir=session["bucket"], path=session["path"], upload_id=session["upload_id"])
+        if parts is None:
+            return HttpResponse("Upload session not found", status=404)
+        encoding_profile = request.data.get("profile")
+        if not is_encoding_profile(encoding_profile):
+            return HttpResponse("Unknown encoding profile", status=400)
+        uploaded = sum([part["Size"] for part in parts])
+        if uploaded != session["size"] or len(parts) != self.__get_part_count(session):
+            return JsonResponse({"error": "The upload is incomplete", "uploaded": uploaded, "size": session["size"]},
+                                status=409)
+        if not storage.complete_multipart_upload(basedir=session["bucket"], path=session["path"],
+                                                 upload_id=session["upload_id"], parts=parts):
+            return HttpResponseServerError("Could not complete the upload")
+
+        encryption_key_url:str = request.data.get("encryption_url", "/keys/")
+        return JsonResponse({
+            "id": transcode_stored_video(bucket=session["bucket"], path=session["path"],
+                                         encryption_key_url=encryption_key_url, encoding_profile=encoding_profile),
+            "path": session["path"]
+        })
+
+    def delete(self, request:HttpRequest, token:str=None, *args, **kwargs):
+        session = self.__get_session(token)
+        if session is None or not S3().abort_multipart_upload(basedir=session["bucket"], path=session["path"],
+                                                                upload_id=session["upload_id"]):
+            return HttpResponse("Upload session not found", status=404)
+        return HttpResponse("ok")
+
+
 class PlayList(APIView):
 
     MASTER_MANIFEST_FILENAME = "master.m3u8"
     def __get_storage(self) -> IStorageInterface:
-        return S3()
+        return get_cached_storage(get_storage())
 
     def __save_file(self, file:InMemoryUploadedFile, temp_dir:str)->str:
         if not os.path.exists(temp_dir):
@@ -175,7 +704,8 @@ class PlayList(APIView):
         temp_filepath = os.path.join(temp_dir, filename)
         try:
             with open(temp_filepath, 'wb') as f:
-                f.write(file.read())
+                for chunk in file.chunks():
+                    f.write(chunk)
             return temp_filepath
         except Exception as e:
             print("Error saving file to temp directory")
@@ -186,11 +716,22 @@ class PlayList(APIView):
         if (not (segment_name is None)) and len(segment_name) > 0:
             bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
             storage = self.__get_storage()
-            if not ( "m3u8" in segment_name) and not ('.ts' in segment_name):
+            if not is_file_name(segment_name):
                 segment_name = segment_name.rstrip("/") + "/" + PlayList.MASTER_MANIFEST_FILENAME
-            file: File = storage.get_file(basedir=bucket, path=f"{segment_name}")
-            if not (file is None):
-                return HttpResponse(ContentFile(file.file), content_type=file.content_type)
+            segment_name = get_aliased_path(storage, bucket, segment_name)
+            delivery_mode = get_delivery_mode()
+            if delivery_mode in ("presigned", "redirect") and is_segment_name(segment_name):
+                # Segment bytes are served by S3, the worker only signs the url
+                url = get_segment_url(bucket, segment_name)
+                if not (url is None):
+                    return HttpResponseRedirect(url)
+                response = None
+            elif delivery_mode == "presigned":
+                response = get_presigned_playlist(storage=storage, bucket=bucket, path=segment_name)
+            else:
+                response = get_streaming_response(request=request, storage=storage, bucket=bucket, path=f"{segment_name}")
+            if not (response is None):
+                return response
         return HttpResponseServerError('Could not fetch a file. A file does not exist or has been removed')
 
     def delete(self, request:HttpRequest, segment_name:str, *args, **kwargs):
@@ -198,11 +739,14 @@ class PlayList(APIView):
             bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
             storage = self.__get_storage()
             storage_path = get_storage_path(segment_name)
-            contents:List[str] = storage.get_all_filepaths(basedir=bucket, path=storage_path)
-
-            if not (contents is None) and len(contents) > 0:
-                for content in contents:
-                    storage.delete_file(basedir=bucket, path=content)
+            # Aliases and the index of transcoded videos are read from the storage itself, not from the cache
+            if not release_transcoded_video(get_storage(), basedir=bucket, path=storage_path):
+                return HttpResponse("The video is shared by other videos and cannot be deleted", status=409)
+            # Deleting the prefix removes every file of the video and invalidates its cached manifests, keys and
+            # segments in one go
+            storage.delete_file(basedir=bucket, path=f"{storage_path}/")
+            remove_alias_references(get_storage(), basedir=bucket, original=storage_path)
+            _aliases.pop(storage_path, None)
 
         return HttpResponse("ok")
 
@@ -210,22 +754,13 @@ class PlayList(APIView):
         segment_name = request.GET.get("segment_name", "")
         if not (segment_name is None) and len(segment_name) > 0:
             bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
-            # Save video to temp directory
-            temp_unique_dir = str(uuid.uuid4())
-            temp_dir = os.path.join(settings.AWS_TEMP_DOWNLOAD_DIR, temp_unique_dir)
             encryption_key_url:str = request.GET.get("encryption_url", f"/keys/")
-            encryption_key_url = encryption_key_url.rstrip("/") + "/" + temp_unique_dir
-            transcode_video.delay(
-                input_filepath=segment_name,
-                transcoding_base_output_dir=temp_dir,
-                video_folder_name=VIDEO_FOLDER_NAME,
-                manifest_filename=PlayList.MASTER_MANIFEST_FILENAME,
-                encryption_key_filename=KEYS_FILE_NAME,
-                encryption_key_url=encryption_key_url,
-                output_storage_basedir=bucket,
-                output_storage_filepath=get_storage_path(temp_unique_dir),
-                s3_bucket_name=bucket
-            )
+            encoding_profile:str = request.GET.get("profile")
+            if not is_encoding_profile(encoding_profile):
+                return HttpResponse("Unknown encoding profile", status=400)
+            temp_unique_dir = transcode_stored_video(bucket=bucket, path=segment_name,
+                                                     encryption_key_url=encryption_key_url,
+                                                     encoding_profile=encoding_profile)
             # return HttpResponse(
             #     f"Your video {temp_unique_dir} is being transcoded and uploaded to S3. Please wait a while. The transcoded file will be saved in {temp_unique_dir}")
 
@@ -249,7 +784,7 @@ class PlayList(APIView):
             temp_dir = os.path.join(settings.AWS_TEMP_DOWNLOAD_DIR, temp_unique_dir)
             saved_filepath = self.__save_file(file=file, temp_dir=temp_dir)
 
-            transcode_video.delay(
+            start_transcode_job(
                 input_filepath=saved_filepath,
                 transcoding_base_output_dir=temp_dir,
                 video_folder_name=VIDEO_FOLDER_NAME,
@@ -261,4 +796,65 @@ class PlayList(APIView):
             )
             return HttpResponse(f"Your video {temp_unique_dir} is being transcoded and uploaded to S3. Please wait a while")
 
-        return HttpResponseServerError("Error uploading file")
\ No newline at end of file
+        return HttpResponseServerError("Error uploading file")
+
+
+class AsyncPlayList(View):
+    """
+    PlayList.get for the ASGI application. A viewer waiting on S3 does not hold a thread, so one process can serve
+    many more concurrent viewers than with the synchronous views.
+    """
+
+    async def get(self, request: HttpRequest, segment_name:str, *args, **kwargs):
+        response = None
+        if (not (segment_name is None)) and len(segment_name) > 0:
+            bucket = settings.AWS["S3"]["BUCKETS"]["RAW VIDEO"]["NAME"]
+            storage = get_async_cached_storage(get_async_storage())
+            if not is_file_name(segment_name):
+                segment_name = segment_name.rstrip("/") + "/" + PlayList.MASTER_MANIFEST_FILENAME
+            segment_name = await aget_aliased_path(storage, bucket, segment_name)
+            delivery_mode = get_delivery_mode()
+            if delivery_mode in ("presigned", "redirect") and is_segment_name(segment_name):
+                url = get_segment_url(bucket, segment_name)
+                if not (url is None):
+                    response = HttpResponseRedirect(url)
+            elif delivery_mode == "presigned":
+                file: File = await storage.get_file(basedir=bucket, path=segment_name)
+                if not (file is None):
+                    response = HttpResponse(presign_playlist(bucket=bucket, path=segment_name, playlist=file.file),
+                                            content_type=file.content_type)
+            else:
+                response = await get_async_streaming_response(request=request, storage=storage, bucket=bucket,
+                                                              path=segment_name)
+        if response is None:
+            response = HttpResponseServerError('Could not fetch a file. A file does not exist or has been removed')
+        patch_cache_control(response, max_age=0, no_cache=True, no_store=True)
+        return response
+
+
+class JobView(APIView):
+    """
+    Status, phase and progress of the transcoding job of a video, by the id returned when it was queued.
+    """
+
+    @method_decorator(cache_control(max_age=0, no_cache=True, no_store=True))
+    def get(self, request:HttpRequest, id:str, *args, **kwargs):
+        store = get_job_store()
+        job = store.get(id) if not (store is None) else None
+        if job is None:
+            return JsonResponse({"error": "Unknown transcoding job"}, status=404)
+        return JsonResponse(get_public_job(job))
+
+
+class MetricsView(View):
+    """
+    Metrics in the Prometheus text format, of every web process of this host if they export them to
+    METRICS['WEB']['TEXTFILE_DIR'], else of the process that handles the request.
+    """
+
+    def get(self, request:HttpRequest, *args, **kwargs):
+        if not is_metrics_enabled():
+            return HttpResponse("Metrics are disabled", status=404)
+        response = HttpResponse(render_web_metrics(), content_type=METRICS_CONTENT_TYPE)
+        patch_cache_control(response, max_age=0, no_cache=True, no_store=True)
+        return response